@@ -0,0 +1,55 @@
+"""Microbenchmark for landmark map generation.
+
+Compares maps/sec of the per-landmark genMultipleMaps (what the pipelines
+used to run through tf.py_func) against the vectorized genBatchMaps and the
+in-graph landmark_maps op.
+"""
+import time
+import argparse
+import numpy as np
+import tensorflow as tf
+from libs.tfpipeline import genMultipleMaps, genBatchMaps, landmark_maps
+
+
+def bench(f, n_maps, n_repeats=3):
+    best = None
+    for _ in range(n_repeats):
+        t = time.time()
+        f()
+        dt = time.time() - t
+        best = dt if best is None else min(best, dt)
+    return n_maps / best
+
+
+def main(batch_size=64, n_landmarks=68, shape=[64, 64], radius=3):
+    landmarks = np.random.uniform(
+        0.0, 1.0, [batch_size, n_landmarks * 2]).astype(np.float32)
+
+    ref = np.asarray([genMultipleMaps(l, shape=shape, radius=radius)
+                      for l in landmarks])
+    assert (ref == genBatchMaps(landmarks, shape, radius)).all()
+
+    rate_ref = bench(lambda: [genMultipleMaps(l, shape=shape, radius=radius)
+                              for l in landmarks], batch_size)
+    rate_np = bench(lambda: genBatchMaps(landmarks, shape, radius), batch_size)
+
+    g = tf.Graph()
+    with g.as_default():
+        ph = tf.placeholder(tf.float32, [None, n_landmarks * 2])
+        maps = landmark_maps(ph, shape=shape, radius=radius)
+        with tf.Session(graph=g) as sess:
+            assert (ref == sess.run(maps, feed_dict={ph: landmarks})).all()
+            rate_tf = bench(lambda: sess.run(maps, feed_dict={ph: landmarks}),
+                            batch_size)
+
+    print('genMultipleMaps : %10.1f maps/sec' % rate_ref)
+    print('genBatchMaps    : %10.1f maps/sec (x%.1f)' % (rate_np, rate_np / rate_ref))
+    print('landmark_maps   : %10.1f maps/sec (x%.1f)' % (rate_tf, rate_tf / rate_ref))
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--batch_size', type=int, default=64)
+    parser.add_argument('--radius', type=int, default=3)
+    args = parser.parse_args()
+    main(batch_size=args.batch_size, radius=args.radius)
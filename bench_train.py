@@ -0,0 +1,185 @@
+"""Training step benchmark for VAE_ALIGN1.
+
+Every mode runs in its own process so the reported peak RSS belongs to that
+mode alone.
+
+    python bench_train.py --modes feed,direct --steps 100
+
+Modes
+-----
+feed
+    sess.run(batch) to NumPy, then feed_dict back into the placeholders
+    (how the train loops used to work).
+direct
+    the model reads the pipeline tensors, one sess.run per step.
+xla
+    direct, with the model ops JIT compiled by XLA (utils.jit_scope).
+bf16
+    direct, with bfloat16 activations and float32 master weights.  Stock
+    CPU builds have no bfloat16 Conv2D kernel (utils.check_compute_dtype),
+    the mode is then reported as failed; it is not in the --cpu example.
+xla_bf16
+    both.
+e2e
+    direct, training the whole network instead of the align head only.
+e2e_recompute
+    e2e, recomputing the encoder / decoder activations in the backward pass
+    (VAE_ALIGN1(recompute=True)); compare its peak RSS with e2e's.
+
+    python bench_train.py --modes direct,xla --cpu
+    python bench_train.py --modes direct,xla,bf16,xla_bf16
+    python bench_train.py --modes e2e,e2e_recompute --cpu
+
+By default batches come from an in-graph synthetic queue so the numbers
+measure the training step and not the disk; pass --txt to use a real list.
+
+--towers runs every mode with that many data-parallel replicas (libs.towers,
+train_vae_align(n_towers=...)), each on its own --batch_size slice, and
+reports the scaling in examples/sec:
+
+    python bench_train.py --modes direct --towers 1,2,4 --cpu
+"""
+import time
+import argparse
+import resource
+import multiprocessing
+import tensorflow as tf
+from libs.utils import jit_scope
+from libs.utils import check_compute_dtype
+from libs.vae import VAE_ALIGN1
+from libs.tfpipeline import input_pipeline_reg
+from libs.towers import build_towers
+from libs.towers import minimize_towers
+from libs.towers import tower_feed
+
+
+def synthetic_batch(batch_size, shape):
+    img = tf.random_normal(shape)
+    locs = tf.random_uniform([136])
+    return tf.train.batch([img, locs], batch_size=batch_size, num_threads=2,
+                          capacity=4 * batch_size)
+
+
+def build(mode, args, n_towers=1):
+    if 'bf16' in mode:
+        check_compute_dtype(tf.bfloat16, '/cpu:0' if args.cpu else None)
+    shape = [128, 128, 1]
+    batch_size = args.batch_size * n_towers
+    if args.txt:
+        batch = input_pipeline_reg([args.txt], batch_size=batch_size,
+                                   shape=shape, is_training=True)
+    else:
+        batch = synthetic_batch(batch_size, shape)
+
+    def model(shard):
+        return VAE_ALIGN1(input_shape=[None] + shape,
+                          convolutional=True,
+                          variational=True,
+                          n_filters=[100, 100, 100],
+                          n_hidden=250,
+                          n_code=100,
+                          dropout=True,
+                          filter_sizes=[3, 3, 3],
+                          activation=tf.nn.relu,
+                          batch=None if mode == 'feed' else shard,
+                          compute_dtype=tf.bfloat16 if 'bf16' in mode else tf.float32,
+                          recompute='recompute' in mode)
+    with jit_scope('xla' in mode):
+        towers = build_towers(model, batch, n_towers)
+    opt_vars = [v for v in tf.trainable_variables()
+                if v.name.startswith("align/")]
+    optimizer = minimize_towers(tf.train.AdamOptimizer(0.0006), towers,
+                                var_list=None if 'e2e' in mode else opt_vars)
+    config = tf.ConfigProto()
+    if args.cpu:
+        config.device_count['GPU'] = 0
+    return batch, towers, optimizer, config
+
+
+def step_fn(mode, sess, batch, towers, optimizer):
+    train_op, cost = optimizer
+    feed_dict = tower_feed(towers, {'train': True, 'keep_prob': 0.8,
+                                    'keep_prob1': 0.9, 'keep_prob2': 0.7,
+                                    'keep': False})
+
+    def step():
+        if mode == 'feed':
+            batch_xs, label_xs = sess.run(batch)
+            size = len(batch_xs) // len(towers)
+            for i, ae in enumerate(towers):
+                feed_dict[ae['x']] = batch_xs[i * size:(i + 1) * size]
+                feed_dict[ae['label']] = label_xs[i * size:(i + 1) * size]
+        return sess.run([cost, train_op], feed_dict=feed_dict)[0]
+    return step
+
+
+def run(mode, n_towers, args, results):
+    try:
+        _run(mode, n_towers, args, results)
+    except Exception as e:
+        # e.g. no bfloat16 kernels; report instead of leaving main waiting
+        results.put((mode, n_towers, None, '%s: %s' % (
+            type(e).__name__, str(e).split('\n')[0])))
+
+
+def _run(mode, n_towers, args, results):
+    batch, towers, optimizer, config = build(mode, args, n_towers)
+    sess = tf.Session(config=config)
+    sess.run(tf.global_variables_initializer())
+    coord = tf.train.Coordinator()
+    tf.get_default_graph().finalize()
+    threads = tf.train.start_queue_runners(sess=sess, coord=coord)
+    step = step_fn(mode, sess, batch, towers, optimizer)
+    try:
+        for _ in range(args.warmup):
+            step()
+        t = time.time()
+        for _ in range(args.steps):
+            step()
+        dt = time.time() - t
+    finally:
+        coord.request_stop()
+        coord.join(threads, stop_grace_period_secs=5)
+        sess.close()
+    peak_rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024.0
+    results.put((mode, n_towers, args.steps / dt, peak_rss))
+
+
+def main(args):
+    results = multiprocessing.Queue()
+    rows = []
+    for mode in args.modes.split(','):
+        for n_towers in [int(n) for n in args.towers.split(',')]:
+            p = multiprocessing.Process(target=run,
+                                        args=(mode, n_towers, args, results))
+            p.start()
+            rows.append(results.get())
+            p.join()
+    ok = [r for r in rows if r[2] is not None]
+    base = ok[0][2] * ok[0][1] if ok else 1.0
+    print('%-12s %6s %12s %14s %8s %14s' % (
+        'mode', 'towers', 'steps/sec', 'examples/sec', 'speedup',
+        'peak RSS (MB)'))
+    for mode, n_towers, rate, rss in rows:
+        if rate is None:
+            print('%-12s %6d failed, %s' % (mode, n_towers, rss))
+            continue
+        examples = rate * n_towers * args.batch_size
+        print('%-12s %6d %12.3f %14.1f %7.2fx %14.1f' % (
+            mode, n_towers, rate, examples,
+            rate * n_towers / base, rss))
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--modes', default='feed,direct')
+    parser.add_argument('--steps', type=int, default=50)
+    parser.add_argument('--warmup', type=int, default=5)
+    parser.add_argument('--batch_size', type=int, default=64,
+                        help='examples per tower')
+    parser.add_argument('--towers', default='1',
+                        help='comma separated data-parallel replica counts')
+    parser.add_argument('--txt', default=None)
+    parser.add_argument('--cpu', action='store_true',
+                        help='hide GPUs, benchmark on the host')
+    main(parser.parse_args())
@@ -0,0 +1,8 @@
+from libs.feature_cache import build_feature_cache
+import sys
+
+if __name__ == '__main__':
+    CKPT = sys.argv[1] if len(sys.argv) > 1 else 'models/vae_gt20000-20000'
+    TXTs = sys.argv[2:] or ['300w-gt-aug.txt']
+    for txt in TXTs:
+        build_feature_cache(txt, CKPT)
@@ -0,0 +1,7 @@
+from libs.heatmap_cache import build_heatmap_cache
+import sys
+
+if __name__ == '__main__':
+    TXTs = sys.argv[1:] or ['300w-gt-aug.txt']
+    for txt in TXTs:
+        build_heatmap_cache(txt, shape=[64, 64], radius=3)
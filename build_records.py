@@ -0,0 +1,7 @@
+from libs.records import write_records
+import sys
+
+if __name__ == '__main__':
+    TXTs = sys.argv[1:] or ['300w-gt-aug.txt']
+    for txt in TXTs:
+        write_records(txt, n_shards=16, shape=[128, 128, 1])
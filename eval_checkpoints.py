@@ -0,0 +1,19 @@
+"""Evaluate a list or glob of checkpoints with one graph per process.
+
+    python eval_checkpoints.py 'models/align-300w-*' --procs 2
+"""
+from libs.evaluator import evaluate_checkpoints
+from libs.evaluator import format_table
+import argparse
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser()
+    parser.add_argument('ckpts', nargs='+',
+                        help='checkpoint prefixes, globs or directories')
+    parser.add_argument('--txt', default='300w-gt-test.txt')
+    parser.add_argument('--batch_size', type=int, default=69)
+    parser.add_argument('--procs', type=int, default=1)
+    args = parser.parse_args()
+    rows = evaluate_checkpoints(args.ckpts, n_procs=args.procs,
+                                txt=args.txt, batch_size=args.batch_size)
+    print(format_table(rows))
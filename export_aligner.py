@@ -0,0 +1,7 @@
+from libs.export import export_aligner
+import sys
+
+if __name__ == '__main__':
+    ckpt = sys.argv[1]
+    output = sys.argv[2] if len(sys.argv) > 2 else 'aligner.pb'
+    export_aligner(ckpt, output)
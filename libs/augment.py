@@ -0,0 +1,124 @@
+"""Online geometric augmentation of images and their landmarks.
+
+Every example of a batch gets its own random horizontal flip, rotation,
+scale and translation.  The image is resampled once with
+tf.contrib.image.transform and the landmarks go through the same affine map
+as one batched matrix product; flipped landmarks are reordered with the
+precomputed utils.FLIP_PERMUTATIONS tables.  This replaces materializing an
+augmented list such as 300w-gt-aug.txt on disk.
+"""
+import math
+import tensorflow as tf
+from libs.utils import flip_landmarks_tf
+
+
+def random_affine(n, max_angle=15.0, scale_range=(0.9, 1.1), max_shift=0.05,
+                  flip_prob=0.5):
+    """Random per-example augmentation parameters.
+
+    Parameters
+    ----------
+    n : int or tf.Tensor
+        Number of examples.
+    max_angle : float, optional
+        Rotations are uniform in [-max_angle, max_angle] degrees.
+    scale_range : tuple, optional
+        Uniform scale range.
+    max_shift : float, optional
+        Translations are uniform in [-max_shift, max_shift] of the image size.
+    flip_prob : float, optional
+        Probability of a horizontal flip.
+
+    Returns
+    -------
+    flips : tf.Tensor
+        [n] bool.
+    linear : tf.Tensor
+        [n, 2, 2] rotation * scale, applied around the image center.
+    shifts : tf.Tensor
+        [n, 2] translations in normalized coordinates.
+    """
+    flips = tf.random_uniform([n]) < flip_prob
+    angles = tf.random_uniform([n], -max_angle, max_angle) * (math.pi / 180)
+    scales = tf.random_uniform([n], scale_range[0], scale_range[1])
+    cos, sin = scales * tf.cos(angles), scales * tf.sin(angles)
+    linear = tf.reshape(tf.stack([cos, -sin, sin, cos], axis=1), [-1, 2, 2])
+    shifts = tf.random_uniform([n, 2], -max_shift, max_shift)
+    return flips, linear, shifts
+
+
+def transform_landmarks(landmarks, flips, linear, shifts, n_landmarks=68):
+    """Apply random_affine parameters to N x 2K normalized landmarks.
+
+    p' = c + linear (flip(p) - c) + shift, with c the image center.
+    """
+    points = tf.reshape(landmarks, [-1, n_landmarks, 2])
+    flipped = tf.reshape(flip_landmarks_tf(points, n_landmarks),
+                         [-1, n_landmarks, 2])
+    mask = tf.tile(tf.reshape(flips, [-1, 1, 1]), [1, n_landmarks, 2])
+    points = tf.where(mask, flipped, points) - 0.5
+    # [N, K, 2] x [N, 2, 2]^T
+    points = tf.matmul(points, linear, transpose_b=True)
+    points = points + 0.5 + tf.expand_dims(shifts, 1)
+    points = tf.reshape(points, tf.shape(landmarks))
+    points.set_shape(landmarks.get_shape())
+    return points
+
+
+def transform_images(images, flips, linear, shifts):
+    """Resample N x H x W x C images with the same maps as
+    transform_landmarks."""
+    shape = images.get_shape().as_list()
+    h, w = float(shape[1]), float(shape[2])
+    # forward map in pixels: u' = A D (u - c) + c + t, D flips x.
+    # transform() wants the inverse, u = D A^-1 (u' - c - t) + c.
+    a, b = linear[:, 0, 0], linear[:, 0, 1] * (w / h)
+    c, d = linear[:, 1, 0] * (h / w), linear[:, 1, 1]
+    det = a * d - b * c
+    ia, ib, ic, id_ = d / det, -b / det, -c / det, a / det
+    sign = tf.where(flips, -tf.ones_like(a), tf.ones_like(a))
+    ia, ib = sign * ia, sign * ib
+    # normalized landmarks are pixel / size, so the center is at size / 2
+    cx, cy = w / 2, h / 2
+    tx, ty = cx + shifts[:, 0] * w, cy + shifts[:, 1] * h
+    zeros = tf.zeros_like(a)
+    transforms = tf.stack([ia, ib, cx - ia * tx - ib * ty,
+                           ic, id_, cy - ic * tx - id_ * ty,
+                           zeros, zeros], axis=1)
+    transformed = tf.contrib.image.transform(images, transforms,
+                                             interpolation='BILINEAR')
+    transformed.set_shape(images.get_shape())
+    return transformed
+
+
+def augment_batch(images, landmarks, n_landmarks=68, **kwargs):
+    """Randomly flip, rotate, scale and translate a batch.
+
+    Parameters
+    ----------
+    images : tf.Tensor
+        N x H x W x C float images (before standardization).
+    landmarks : tf.Tensor
+        N x 2K normalized landmarks.
+    n_landmarks : int, optional
+        K, 68 or 106 for flips.
+    **kwargs
+        random_affine arguments.
+
+    Returns
+    -------
+    images, landmarks : tf.Tensor, tf.Tensor
+        Augmented batch, same shapes.
+    """
+    with tf.name_scope('augment'):
+        flips, linear, shifts = random_affine(tf.shape(images)[0], **kwargs)
+        return (transform_images(images, flips, linear, shifts),
+                transform_landmarks(landmarks, flips, linear, shifts,
+                                    n_landmarks))
+
+
+def augment_example(img, landmarks, **kwargs):
+    """augment_batch for one H x W x C image and its [2K] landmarks."""
+    imgs, locs = augment_batch(tf.expand_dims(img, 0),
+                               tf.expand_dims(landmarks, 0), **kwargs)
+    return imgs[0], locs[0]
@@ -2,12 +2,20 @@
 Parag K. Mital, Jan 2016.
 """
 
+import re
+import numpy as np
 import tensorflow as tf
 from tensorflow.python.ops import control_flow_ops
+from tensorflow.python.training import moving_averages
+
+# epsilon of batch_norm, and of fused_batch_norm: tf.nn.fused_batch_norm
+# raises anything smaller to cuDNN's lower bound
+BN_EPSILON = 1e-6
+FUSED_BN_EPSILON = 1.001e-5
 
 
 def batch_norm(x, phase_train, name='bn', decay=0.9, reuse=None,
-               affine=True):
+               affine=True, fused=False):
     """
     Batch normalization on convolutional maps.
     from: https://stackoverflow.com/questions/33949786/how-could-i-
@@ -23,11 +31,15 @@ def batch_norm(x, phase_train, name='bn', decay=0.9, reuse=None,
         string, variable name
     affine
         whether to affine-transform outputs
+    fused
+        use tf.nn.fused_batch_norm, see fused_batch_norm
     Return
     ------
     normed
         batch-normalized maps
     """
+    if fused:
+        return fused_batch_norm(x, phase_train, name, decay, reuse, affine)
     with tf.variable_scope(name, reuse=reuse):
         shape = x.get_shape().as_list()
         beta = tf.get_variable(name='beta', shape=[shape[-1]],
@@ -59,5 +71,203 @@ def batch_norm(x, phase_train, name='bn', decay=0.9, reuse=None,
 
         # tf.nn.batch_normalization
         normed = tf.nn.batch_norm_with_global_normalization(
-            x, mean, var, beta, gamma, 1e-6, affine)
+            x, mean, var, beta, gamma, BN_EPSILON, affine)
+    return normed
+
+
+def fused_batch_norm(x, phase_train, name='bn', decay=0.9, reuse=None,
+                     affine=True):
+    """Same as batch_norm, computed with one tf.nn.fused_batch_norm op.
+
+    The variables are created with the same names as batch_norm, including
+    the ExponentialMovingAverage statistics (whose names come from the
+    tf.nn.moments ops), and the moving variance averages the same biased
+    batch variance, so checkpoints load in either implementation.  The
+    outputs are not bit-identical: the fused op normalizes with
+    FUSED_BN_EPSILON instead of BN_EPSILON, so fold a model trained with
+    fused=True with fold_checkpoint(..., epsilon=FUSED_BN_EPSILON).
+    The training-mode op and the average updates are built inside the
+    training branch of the cond, so inference runs only the inference op.
+    When `phase_train` is a Python bool only that branch is built and the
+    graph has no cond.  2D inputs are normalized as [N, 1, 1, C] maps.
+
+    Parameters
+    ----------
+    x : tf.Tensor
+        4D BHWD or 2D BD input.
+    phase_train : tf.Tensor or bool
+        True in the training phase.
+    name : str, optional
+        Variable scope, same as batch_norm.
+    decay : float, optional
+        Decay of the moving averages.
+    reuse : bool, optional
+        Reuse the variables.
+    affine : bool, optional
+        Whether to scale the outputs by gamma.
+
+    Returns
+    -------
+    normed : tf.Tensor
+        Batch-normalized input.
+    """
+    epsilon = FUSED_BN_EPSILON
+    with tf.variable_scope(name, reuse=reuse):
+        shape = x.get_shape().as_list()
+        beta = tf.get_variable(name='beta', shape=[shape[-1]],
+                               initializer=tf.constant_initializer(0.0),
+                               trainable=True)
+        gamma = tf.get_variable(name='gamma', shape=[shape[-1]],
+                                initializer=tf.constant_initializer(1.0),
+                                trainable=affine)
+        scale = gamma if affine else tf.ones_like(gamma)
+        x4 = x if len(shape) == 4 else tf.reshape(x, [-1, 1, 1, shape[-1]])
+
+        # the EMA variables are created outside the cond, from stand-ins with
+        # the op names tf.nn.moments(x, axes, name='moments') gives its
+        # outputs, so they keep their legacy names; the stand-ins' own update
+        # op is never run
+        with tf.name_scope('moments'):
+            with tf.name_scope('moments_1'):
+                mean_names = tf.zeros([shape[-1]], name='mean')
+                var_names = tf.zeros([shape[-1]], name='variance')
+        ema = tf.train.ExponentialMovingAverage(decay=decay)
+        ema.apply([mean_names, var_names])
+        ema_mean, ema_var = ema.average(mean_names), ema.average(var_names)
+
+        def train_branch():
+            normed, batch_mean, batch_var = tf.nn.fused_batch_norm(
+                x4, scale, beta, epsilon=epsilon, is_training=True)
+            # the op returns the Bessel-corrected variance, tf.nn.moments
+            # (and so batch_norm's average) the biased one
+            n = tf.cast(tf.reduce_prod(tf.shape(x4)[:3]), batch_var.dtype)
+            ema_apply_op = tf.group(
+                moving_averages.assign_moving_average(
+                    ema_mean, batch_mean, decay, zero_debias=False),
+                moving_averages.assign_moving_average(
+                    ema_var, batch_var * (n - 1) / n, decay,
+                    zero_debias=False))
+            with tf.control_dependencies([ema_apply_op]):
+                return tf.identity(normed)
+
+        def test_branch():
+            return tf.nn.fused_batch_norm(
+                x4, scale, beta, mean=ema_mean, variance=ema_var,
+                epsilon=epsilon, is_training=False)[0]
+
+        if isinstance(phase_train, bool):
+            normed = train_branch() if phase_train else test_branch()
+        else:
+            normed = control_flow_ops.cond(phase_train, train_branch,
+                                           test_branch)
+        if len(shape) != 4:
+            normed = tf.reshape(normed, [-1, shape[-1]])
     return normed
+
+
+def fold_batch_norm(W, b, beta, gamma, mean, variance, epsilon=BN_EPSILON,
+                    affine=True):
+    """Fold inference-time batch norm into the preceding layer's weights.
+
+    bn(conv(x, W) + b) == conv(x, W_folded) + b_folded
+
+    Parameters
+    ----------
+    W : np.ndarray
+        [..., C] weights, output channels last (utils.conv2d / utils.linear).
+    b : np.ndarray
+        [C] bias.
+    beta, gamma, mean, variance : np.ndarray
+        [C] batch norm parameters and moving averages.
+    epsilon : float, optional
+        Epsilon the layer was trained with.
+    affine : bool, optional
+        Whether gamma is applied.
+
+    Returns
+    -------
+    W_folded, b_folded : np.ndarray, np.ndarray
+    """
+    scale = 1.0 / np.sqrt(variance + epsilon)
+    if affine:
+        scale = scale * gamma
+    return W * scale, (b - mean) * scale + beta
+
+
+def _normalized(name):
+    # 'align/' scopes produce 'align//conv1/W' in some TF versions
+    return re.sub('/+', '/', name)
+
+
+def fold_checkpoint(ckpt, pairs, epsilon=BN_EPSILON):
+    """Folded weights for every (layer, batch norm) pair of a checkpoint.
+
+    Parameters
+    ----------
+    ckpt : str
+        Checkpoint prefix.
+    pairs : list of (str, str)
+        Variable scopes of a layer with 'W' / 'b' variables and of the
+        batch_norm applied to its output, e.g. ('align/conv1', 'align/bn1').
+    epsilon : float, optional
+        Epsilon the batch norms were trained with, FUSED_BN_EPSILON for
+        fused_batch_norm.
+
+    Returns
+    -------
+    values : dict
+        Checkpoint variable name to folded value, for every 'W' and 'b'
+        of the listed layers.
+    """
+    reader = tf.train.NewCheckpointReader(ckpt)
+    names = {_normalized(n): n for n in reader.get_variable_to_shape_map()}
+
+    def get(name):
+        return reader.get_tensor(names[_normalized(name)])
+
+    def ema(bn_scope, stat):
+        suffix = '/%s/ExponentialMovingAverage' % stat
+        matches = [n for n in names
+                   if n.startswith(_normalized(bn_scope) + '/') and
+                   n.endswith(suffix)]
+        if len(matches) != 1:
+            raise ValueError('Expected one %s average under %s, found %s' % (
+                stat, bn_scope, matches))
+        return reader.get_tensor(names[matches[0]])
+
+    values = {}
+    for layer_scope, bn_scope in pairs:
+        W, b = fold_batch_norm(get(layer_scope + '/W'), get(layer_scope + '/b'),
+                               get(bn_scope + '/beta'), get(bn_scope + '/gamma'),
+                               ema(bn_scope, 'mean'), ema(bn_scope, 'variance'),
+                               epsilon)
+        values[names[_normalized(layer_scope + '/W')]] = W
+        values[names[_normalized(layer_scope + '/b')]] = b
+    return values
+
+
+def assign_folded(sess, values, ckpt=None):
+    """Load a checkpoint into a graph built without batch norm (e.g.
+    VAE_ALIGN1(folded_bn=True)) and overwrite the folded layers.
+
+    Parameters
+    ----------
+    sess : tf.Session
+        Session of the folded graph.
+    values : dict
+        Output of fold_checkpoint.
+    ckpt : str, optional
+        Checkpoint to restore the remaining variables from.
+    """
+    folded = {_normalized(n): v for n, v in values.items()}
+    variables = {_normalized(v.op.name): v for v in tf.global_variables()}
+    if ckpt is not None:
+        reader = tf.train.NewCheckpointReader(ckpt)
+        in_ckpt = {_normalized(n): n
+                   for n in reader.get_variable_to_shape_map()}
+        restore = {in_ckpt[n]: v for n, v in variables.items()
+                   if n in in_ckpt and n not in folded}
+        tf.train.Saver(restore).restore(sess, ckpt)
+    for name, value in folded.items():
+        v = variables[name]
+        sess.run(v.initializer, feed_dict={v.initial_value: value})
@@ -14,6 +14,7 @@ import os
 import sys
 from six.moves import urllib
 import collections
+from libs.profiler import StepProfiler
 
 
 def build_model(txt,
@@ -95,7 +96,8 @@ def build_model(txt,
 
 def train(txt, batch_size=100, sequence_length=150, n_cells=100, n_layers=3,
           learning_rate=0.00001, max_iter=50000, gradient_clip=5.0,
-          ckpt_name="model.ckpt", keep_prob=1.0):
+          ckpt_name="model.ckpt", keep_prob=1.0, profile_dir=None,
+          trace_every=0):
 
     g = tf.Graph()
     with tf.Session(graph=g) as sess:
@@ -113,6 +115,7 @@ def train(txt, batch_size=100, sequence_length=150, n_cells=100, n_layers=3,
         if os.path.exists(ckpt_name):
             saver.restore(sess, ckpt_name)
             print("Model restored.")
+        prof = StepProfiler(sess, profile_dir, trace_every=trace_every)
 
         cursor = 0
         it_i = 0
@@ -131,7 +134,7 @@ def train(txt, batch_size=100, sequence_length=150, n_cells=100, n_layers=3,
                     cursor = np.random.randint(0, high=sequence_length)
 
             feed_dict = {model['X']: Xs, model['Y']: Ys, model['keep_prob']: keep_prob}
-            out = sess.run([model['cost'], model['updates']], feed_dict=feed_dict)
+            out = prof.run([model['cost'], model['updates']], feed_dict=feed_dict)
             avg_cost += out[0]
 
             if (it_i + 1) % print_step == 0:
@@ -165,9 +168,10 @@ def train(txt, batch_size=100, sequence_length=150, n_cells=100, n_layers=3,
                 save_path = saver.save(sess, "./" + ckpt_name, global_step=it_i)
                 print("Model saved in file: %s" % save_path)
 
-            print(it_i, out[0], end='\r')
+            prof.step(cost=out[0])
             it_i += 1
 
+        prof.close()
         return model
 
 
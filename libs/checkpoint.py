@@ -0,0 +1,172 @@
+"""Checkpoints written in the background.
+
+AsyncCheckpointer.save only fetches the variables into host memory (one
+sess.run of the variable values); a writer thread then saves the snapshot
+with a tf.train.Saver of its own graph, fsyncs it and renames it into place,
+so the training loop never waits on disk.  The files are ordinary
+checkpoints that tf.train.Saver.restore reads.
+
+    ckpt = AsyncCheckpointer(sess, tf.global_variables(), 'models/',
+                             'align-300w-gtbbx', keep_last=5, keep_best=2)
+    ckpt.save(step, metric=cost)
+    ...
+    ckpt.close()
+"""
+import os
+import glob
+import queue
+import shutil
+import threading
+import tensorflow as tf
+
+
+def _fsync(path):
+    fd = os.open(path, os.O_RDONLY)
+    try:
+        os.fsync(fd)
+    finally:
+        os.close(fd)
+
+
+def _remove_checkpoint(prefix):
+    for f in glob.glob(prefix + '.index') + glob.glob(prefix + '.data-*') + \
+            glob.glob(prefix + '.meta'):
+        os.remove(f)
+
+
+class AsyncCheckpointer(object):
+    """Snapshot variables on the training thread, write them on another.
+
+    Parameters
+    ----------
+    sess : tf.Session
+        Training session.
+    var_list : list of tf.Variable, optional
+        Variables to save, defaults to tf.global_variables().
+    directory : str, optional
+        Output directory.
+    name : str, optional
+        Checkpoint prefix, saved as `directory/name-step`.
+    keep_last : int, optional
+        Number of most recent checkpoints kept.
+    keep_best : int, optional
+        Number of checkpoints with the lowest (or highest, see `mode`)
+        metric kept in addition to the most recent ones.
+    mode : str, optional
+        'min' or 'max', which metric values are best.
+    max_pending : int, optional
+        Snapshots queued before save() blocks, bounds host memory.
+    """
+
+    def __init__(self, sess, var_list=None, directory='models/',
+                 name='model', keep_last=5, keep_best=0, mode='min',
+                 max_pending=1):
+        self.sess = sess
+        self.var_list = var_list or tf.global_variables()
+        self.directory = directory
+        self.name = name
+        self.keep_last = keep_last
+        self.keep_best = keep_best
+        self.mode = mode
+        self.saved = []
+        self.error = None
+        if not os.path.exists(directory):
+            os.makedirs(directory)
+
+        # a copy of the variables in a graph of its own, so writing never
+        # touches the training graph or session.  Saved under the training
+        # graph's names, so its own Saver restores the files.
+        self.graph = tf.Graph()
+        with self.graph.as_default():
+            self.variables = [
+                tf.Variable(tf.zeros(v.get_shape(), v.dtype.base_dtype),
+                            name='v%d' % i, trainable=False)
+                for i, v in enumerate(self.var_list)]
+            self.saver = tf.train.Saver(
+                {v.op.name: copy
+                 for v, copy in zip(self.var_list, self.variables)},
+                max_to_keep=None)
+        self.graph.finalize()
+        self.writer_sess = tf.Session(graph=self.graph)
+
+        self.pending = queue.Queue(maxsize=max_pending)
+        self.thread = threading.Thread(target=self._loop, name='checkpoint')
+        self.thread.daemon = True
+        self.thread.start()
+
+    def save(self, step, metric=None):
+        """Snapshot the variables and queue them for writing.
+
+        Parameters
+        ----------
+        step : int
+            Global step, appended to the file name.
+        metric : float, optional
+            Value used by keep_best.
+        """
+        self._raise()
+        values = self.sess.run(self.var_list)
+        self.pending.put((step, metric, values))
+
+    def close(self):
+        """Write everything queued and stop the writer thread."""
+        self.pending.put(None)
+        self.thread.join()
+        self.writer_sess.close()
+        self._raise()
+
+    def _raise(self):
+        if self.error is not None:
+            error, self.error = self.error, None
+            raise error
+
+    def _loop(self):
+        while True:
+            item = self.pending.get()
+            if item is None:
+                return
+            try:
+                self._write(*item)
+            except Exception as e:
+                self.error = e
+
+    def _write(self, step, metric, values):
+        prefix = os.path.join(self.directory, '%s-%d' % (self.name, step))
+        tmp_dir = os.path.join(self.directory, '.tmp-%s-%d' % (self.name, step))
+        if os.path.exists(tmp_dir):
+            shutil.rmtree(tmp_dir)
+        os.makedirs(tmp_dir)
+        try:
+            feed_dict = {v.initial_value: value
+                         for v, value in zip(self.variables, values)}
+            self.writer_sess.run([v.initializer for v in self.variables],
+                                 feed_dict=feed_dict)
+            tmp_prefix = os.path.join(tmp_dir, 'ckpt')
+            self.saver.save(self.writer_sess, tmp_prefix,
+                            write_meta_graph=False)
+            files = sorted(glob.glob(tmp_prefix + '.*'))
+            for f in files:
+                _fsync(f)
+            # data shards first, the index last: a checkpoint only counts as
+            # present once its .index exists
+            files.sort(key=lambda f: f.endswith('.index'))
+            for f in files:
+                os.rename(f, prefix + f[len(tmp_prefix):])
+        finally:
+            shutil.rmtree(tmp_dir, ignore_errors=True)
+        # rewriting a step replaces its entry
+        self.saved = [s for s in self.saved if s[2] != prefix]
+        self.saved.append((step, metric, prefix))
+        self._rotate()
+        tf.train.update_checkpoint_state(
+            self.directory, prefix,
+            all_model_checkpoint_paths=[p for _, _, p in self.saved])
+
+    def _rotate(self):
+        keep = set(p for _, _, p in self.saved[-self.keep_last:])
+        scored = [s for s in self.saved if s[1] is not None]
+        scored.sort(key=lambda s: s[1], reverse=self.mode == 'max')
+        keep.update(p for _, _, p in scored[:self.keep_best])
+        for s in [s for s in self.saved if s[2] not in keep]:
+            _remove_checkpoint(s[2])
+            self.saved.remove(s)
@@ -11,6 +11,8 @@ import numpy as np
 import tensorflow as tf
 from . import dft
 from .utils import download_and_extract_tar
+from .heatmap_cache import read_landmark_list
+from .records import decode_pngs
 
 
 def create_input_pipeline(files, batch_size, n_epochs, shape, crop_shape=None,
@@ -461,3 +463,110 @@ class Dataset(object):
             Calculates std across 0th (batch) dimension.
         """
         return np.std(self.all_inputs, axis=0)
+
+
+def standardize_images(images):
+    """Vectorized tf.image.per_image_standardization.
+
+    Parameters
+    ----------
+    images : np.ndarray
+        N x H x W x C images of any dtype.
+
+    Returns
+    -------
+    standardized : np.ndarray
+        float32 images with zero mean and unit variance per image.
+    """
+    images = np.asarray(images, dtype=np.float32)
+    axes = tuple(range(1, images.ndim))
+    n = np.prod(images.shape[1:])
+    mean = images.mean(axis=axes, keepdims=True)
+    std = np.maximum(images.std(axis=axes, keepdims=True), 1.0 / np.sqrt(n))
+    return (images - mean) / std
+
+
+class LandmarkDataset(object):
+    """A whole 300-W list decoded once into memory.
+
+    Attributes
+    ----------
+    images : np.ndarray
+        N x H x W x C uint8 images, possibly a read-only memmap.
+    landmarks : np.ndarray
+        N x 2K float32 normalized landmarks.
+    num_examples : int
+        Number of examples.
+    """
+
+    def __init__(self, images, landmarks):
+        self.images = images
+        self.landmarks = landmarks
+        self.num_examples = len(images)
+
+    @classmethod
+    def from_list(cls, txt, shape=[128, 128, 1]):
+        """Decode every image of a list file.
+
+        Parameters
+        ----------
+        txt : str
+            300-W list file.
+        shape : list, optional
+            [height, width, channels] of every image.
+        """
+        names, landmarks = read_landmark_list(txt)
+        images = np.empty([len(names)] + list(shape), dtype=np.uint8)
+        for i, img in enumerate(decode_pngs(names, channels=shape[2])):
+            images[i] = img
+        return cls(images, landmarks)
+
+    @classmethod
+    def load(cls, txt, prefix=None, shape=[128, 128, 1]):
+        """Memory-map a dataset saved with `save`, building and saving it
+        from `txt` first if it does not exist yet.
+
+        Parameters
+        ----------
+        txt : str
+            300-W list file.
+        prefix : str, optional
+            Location of the saved arrays, defaults to `txt`.
+        shape : list, optional
+            [height, width, channels] of every image.
+        """
+        prefix = prefix or txt
+        if not os.path.exists(prefix + '.images.npy'):
+            cls.from_list(txt, shape).save(prefix)
+        return cls(np.load(prefix + '.images.npy', mmap_mode='r'),
+                   np.load(prefix + '.landmarks.npy'))
+
+    def save(self, prefix):
+        """Save as `prefix.images.npy` and `prefix.landmarks.npy`."""
+        np.save(prefix + '.images.npy', self.images)
+        np.save(prefix + '.landmarks.npy', self.landmarks)
+
+    def batches(self, batch_size, shuffle=False):
+        """Endless batch generator.
+
+        Like string_input_producer, batches run across epoch boundaries,
+        so every batch is full and the order is the list order unless
+        `shuffle` is set.
+
+        Yields
+        ------
+        Xs, ys : np.ndarray, np.ndarray
+            Standardized float32 images and their landmarks.
+        """
+        idxs = np.arange(self.num_examples)
+        order = np.random.permutation(idxs) if shuffle else idxs
+        start = 0
+        while True:
+            if start + batch_size > len(order):
+                nxt = np.random.permutation(idxs) if shuffle else idxs
+                order = np.concatenate([order[start:], nxt])
+                start = 0
+            batch_idxs = order[start:start + batch_size]
+            start += batch_size
+            yield (standardize_images(self.images[batch_idxs]),
+                   self.landmarks[batch_idxs])
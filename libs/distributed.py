@@ -0,0 +1,329 @@
+"""Parameter server training of the VAE and the VAEGAN.
+
+The variables live on the `ps` tasks (tf.train.replica_device_setter spreads
+them round robin).  Every `worker` task builds its own input pipeline and a
+copy of the model and trains on its own batches.  With sync=True a
+tf.train.SyncReplicasOptimizer aggregates the gradients of all workers before
+each update, otherwise every worker applies its own gradients as soon as they
+are computed.  Only the chief (worker 0) initializes the variables and writes
+checkpoints, through tf.train.MonitoredTrainingSession.
+
+Every model is trained with one GatedOptimizer step per iteration, one Adam
+per loss.  The VAEGAN's equilibrium rule (train_vaegan skips the generator or
+the discriminator update) gates the apply ops of their Adams with tf.cond, so
+a skipped subset is not touched at all: no momentum step, no bias correction
+power update.  The rule reads the real / fake costs as extra (value,
+variable) pairs next to the gradients, so with sync=True SyncReplicasOptimizer
+averages them over the workers like the gradients and the chief decides for
+the whole aggregated update.
+
+All tasks can run on one machine with localhost ports, see
+train_distributed.py:
+
+    python train_distributed.py --local --model vae --workers 1,2,4 --sync
+"""
+import time
+import numpy as np
+import tensorflow as tf
+from libs.vae import VAE
+from libs.vae import VARIANTS
+from libs.vaegan import VAEGAN
+from libs.tfpipeline import input_pipeline
+from libs.dataset_utils import create_input_pipeline
+
+
+def local_cluster(n_ps=1, n_workers=2, port=2222, host='localhost'):
+    """ClusterSpec of `n_ps` ps and `n_workers` worker tasks on
+    consecutive ports of one host."""
+    return tf.train.ClusterSpec({
+        'ps': ['%s:%d' % (host, port + i) for i in range(n_ps)],
+        'worker': ['%s:%d' % (host, port + n_ps + i)
+                   for i in range(n_workers)]})
+
+
+def start_server(cluster, job_name, task_index):
+    """tf.train.Server of one task.  Workers only talk to the ps tasks and
+    themselves, not to each other."""
+    config = None
+    if job_name == 'worker':
+        config = tf.ConfigProto(device_filters=[
+            '/job:ps', '/job:worker/task:%d' % task_index])
+    return tf.train.Server(cluster, job_name=job_name, task_index=task_index,
+                           config=config)
+
+
+def run_ps(cluster, task_index):
+    """Serve variables until the process is killed."""
+    start_server(cluster, 'ps', task_index).join()
+
+
+def vae_model(device, txt='300w-gt-aug.txt', batch_size=100,
+              learning_rate=0.0001, keep_prob=0.8, variant='base',
+              n_filters=[100, 100, 100], n_hidden=250, n_code=100,
+              variational=False, filter_sizes=[3, 3, 3]):
+    """train_vae's landmark map autoencoder.
+
+    Parameters
+    ----------
+    device : device function
+        Placement of the model, the pipeline stays on the worker.
+    txt : str, optional
+        300-W list file.
+    batch_size, learning_rate, keep_prob, variant, ... : optional
+        Same as train_vae.
+
+    Returns
+    -------
+    model : dict
+        'losses' (loss, var_list, gate name or None) triples, 'stats' name
+        -> scalar the gates read, 'gates' stats -> {gate name: bool tensor}
+        (see GatedOptimizer), 'fetches' to report, 'feed' sess ->
+        feed_dict of a step, 'batch_size', 'learning_rate'.
+    """
+    opts = VARIANTS[variant]
+    batch = input_pipeline([txt], batch_size=batch_size, shape=[128, 128, 1],
+                           is_training=True)
+    with tf.device(device):
+        ae = VAE(input_shape=[None, 128, 128, 1],
+                 convolutional=True,
+                 variational=variational,
+                 n_filters=n_filters,
+                 n_hidden=n_hidden,
+                 n_code=n_code,
+                 dropout=True,
+                 filter_sizes=filter_sizes,
+                 activation=tf.nn.relu,
+                 batch=batch,
+                 use_bn=opts['use_bn'])
+    feed_dict = {ae['train']: True, ae['keep_prob']: keep_prob}
+    return {'losses': [(ae['cost'], None, None)],
+            'stats': {},
+            'gates': None,
+            'fetches': {'cost': ae['cost']},
+            'feed': lambda sess: feed_dict,
+            'batch_size': batch_size,
+            'learning_rate': learning_rate}
+
+
+def vaegan_model(device, files, batch_size=64, learning_rate=0.00001,
+                 input_shape=[218, 178, 3], crop_shape=[64, 64, 3],
+                 crop_factor=0.8, n_filters=[100, 100, 100, 100],
+                 n_hidden=None, n_code=128, filter_sizes=[3, 3, 3, 3],
+                 activation=tf.nn.elu, equilibrium=0.693, margin=0.4):
+    """train_vaegan's VAEGAN, see vae_model for the returned dict."""
+    batch = create_input_pipeline(
+        files=files,
+        batch_size=batch_size,
+        n_epochs=None,
+        crop_shape=crop_shape,
+        crop_factor=crop_factor,
+        shape=input_shape)
+    with tf.device(device):
+        ae = VAEGAN(input_shape=[None] + crop_shape,
+                    convolutional=True,
+                    variational=True,
+                    n_filters=n_filters,
+                    n_hidden=n_hidden,
+                    n_code=n_code,
+                    filter_sizes=filter_sizes,
+                    activation=activation)
+        real_cost = -tf.reduce_mean(ae['loss_real'])
+        fake_cost = -tf.reduce_mean(ae['loss_fake'])
+
+    def gates(stats):
+        # train_vaegan's rule, on the (aggregated) costs of the update
+        real, fake = stats['real'], stats['fake']
+        gen_update = tf.logical_not(tf.logical_or(
+            real > equilibrium + margin, fake > equilibrium + margin))
+        dis_update = tf.logical_not(tf.logical_or(
+            real < equilibrium - margin, fake < equilibrium - margin))
+        neither = tf.logical_not(tf.logical_or(gen_update, dis_update))
+        return {'gen': tf.logical_or(gen_update, neither),
+                'dis': tf.logical_or(dis_update, neither)}
+
+    def var_list(scope):
+        return [v for v in tf.trainable_variables()
+                if v.name.startswith(scope)]
+
+    def feed(sess):
+        return {ae['x']: sess.run(batch) / 255.0,
+                ae['z_samp']: np.random.randn(
+                    batch_size, n_code).astype(np.float32),
+                ae['gamma']: 0.5}
+
+    return {'losses': [(ae['loss_enc'], var_list('encoder'), None),
+                       (ae['loss_gen'], var_list('generator'), 'gen'),
+                       (ae['loss_dis'], var_list('discriminator'), 'dis')],
+            'stats': {'real': real_cost, 'fake': fake_cost},
+            'gates': gates,
+            'fetches': {'real': real_cost, 'fake': fake_cost},
+            'feed': feed,
+            'batch_size': batch_size,
+            'learning_rate': learning_rate}
+
+
+MODELS = {'vae': vae_model, 'vaegan': vaegan_model}
+
+
+class GatedOptimizer(tf.train.Optimizer):
+    """One Adam per loss, each applied only when its gate is True.
+
+    The gates are computed by `gates` from scalar statistics that arrive
+    in apply_gradients as (value, stat variable) pairs, see gradients().
+    Wrapped in a SyncReplicasOptimizer those values are averaged over the
+    replicas like the gradients.  The stat variables keep the last values,
+    e.g. for TensorBoard.
+
+    Parameters
+    ----------
+    learning_rate : float
+        Learning rate of every Adam.
+    losses : list of (tf.Tensor, list of tf.Variable, str)
+        (loss, var_list, gate name or None), None var_list for all
+        trainable variables.  The var_lists must not overlap.
+    stats : dict
+        Name -> scalar tensor the gates read.
+    gates : callable, optional
+        {name: scalar} -> {gate name: bool tensor}.
+    """
+
+    def __init__(self, learning_rate, losses, stats, gates=None,
+                 use_locking=False, name='Gated'):
+        super(GatedOptimizer, self).__init__(use_locking, name)
+        self.losses = losses
+        self.stats = stats
+        self.gates = gates
+        self.optimizers = [tf.train.AdamOptimizer(learning_rate)
+                           for _ in losses]
+        with tf.variable_scope('stats'):
+            self.stat_vars = {n: tf.Variable(0.0, trainable=False, name=n)
+                              for n in sorted(stats)}
+
+    def gradients(self):
+        """(gradient, variable) pairs of every loss, then (value, stat
+        variable) pairs, for apply_gradients."""
+        grads_and_vars = []
+        for (loss, var_list, _), opt in zip(self.losses, self.optimizers):
+            grads_and_vars.extend(
+                (g, v) for g, v in opt.compute_gradients(loss,
+                                                         var_list=var_list)
+                if g is not None)
+        grads_and_vars.extend((tf.convert_to_tensor(self.stats[n]), v)
+                              for n, v in sorted(self.stat_vars.items()))
+        return grads_and_vars
+
+    def apply_gradients(self, grads_and_vars, global_step=None, name=None):
+        by_var = {v: g for g, v in grads_and_vars}
+        stats = {n: by_var[v] for n, v in self.stat_vars.items()}
+        gates = self.gates(stats) if self.gates else {}
+        updates = [v.assign(stats[n]) for n, v in self.stat_vars.items()]
+        stat_vars = set(self.stat_vars.values())
+        for (_, var_list, gate), opt in zip(self.losses, self.optimizers):
+            group = [(g, v) for g, v in grads_and_vars if v not in stat_vars
+                     and (var_list is None or v in var_list)]
+            if not group:
+                continue
+            # slots and beta powers outside the cond, variables cannot be
+            # created in a control flow branch
+            opt._create_slots([v for _, v in group])
+            if gate is None:
+                updates.append(opt.apply_gradients(group))
+            else:
+                updates.append(tf.cond(
+                    gates[gate],
+                    lambda opt=opt, group=group: opt.apply_gradients(group),
+                    tf.no_op))
+        with tf.control_dependencies(updates):
+            if global_step is None:
+                return tf.no_op(name=name)
+            with tf.colocate_with(global_step):
+                return tf.assign_add(global_step, 1, name=name).op
+
+
+def run_worker(cluster, task_index, model='vae', sync=False, n_steps=1000,
+               warmup=10, checkpoint_dir=None, save_secs=600, report=None,
+               log_every=100, **kwargs):
+    """Train as one worker task until the global step reaches `n_steps`.
+
+    Parameters
+    ----------
+    cluster : tf.train.ClusterSpec
+        Cluster, see local_cluster.
+    task_index : int
+        Index of this worker, 0 is the chief.
+    model : str, optional
+        Key of MODELS.
+    sync : bool, optional
+        Aggregate the gradients of all workers for every update.
+    n_steps : int, optional
+        Last global step.
+    warmup : int, optional
+        Local steps left out of the throughput.
+    checkpoint_dir : str, optional
+        Where the chief restores from and saves to.
+    save_secs : int, optional
+        Seconds between the chief's checkpoints.
+    report : callable, optional
+        Called with the throughput dict at the end, e.g. a Queue's put.
+    log_every : int, optional
+        Local steps between printed losses.
+    **kwargs
+        Arguments of the model function.
+
+    Returns
+    -------
+    result : dict
+        'task', 'steps' and 'examples' of this worker after the warmup,
+        'seconds' they took and 'examples_per_sec'.
+    """
+    server = start_server(cluster, 'worker', task_index)
+    n_workers = cluster.num_tasks('worker')
+    is_chief = task_index == 0
+    worker_device = '/job:worker/task:%d' % task_index
+    device = tf.train.replica_device_setter(worker_device=worker_device,
+                                            cluster=cluster)
+
+    with tf.device(worker_device):
+        spec = MODELS[model](device, **kwargs)
+    with tf.device(device):
+        global_step = tf.contrib.framework.get_or_create_global_step()
+        gated = GatedOptimizer(spec['learning_rate'], spec['losses'],
+                               spec['stats'], spec['gates'])
+        optimizer = gated
+        if sync:
+            optimizer = tf.train.SyncReplicasOptimizer(
+                gated, replicas_to_aggregate=n_workers,
+                total_num_replicas=n_workers)
+        train_op = optimizer.apply_gradients(gated.gradients(),
+                                             global_step=global_step)
+
+    hooks = [tf.train.StopAtStepHook(last_step=n_steps)]
+    if sync:
+        hooks.append(optimizer.make_session_run_hook(is_chief))
+    names = sorted(spec['fetches'])
+    fetches = [spec['fetches'][n] for n in names] + [train_op]
+
+    step_i, t_start = 0, None
+    with tf.train.MonitoredTrainingSession(
+            master=server.target, is_chief=is_chief,
+            checkpoint_dir=checkpoint_dir if is_chief else None,
+            save_checkpoint_secs=save_secs, hooks=hooks) as sess:
+        while not sess.should_stop():
+            values = sess.run(fetches, feed_dict=spec['feed'](sess))[:-1]
+            step_i += 1
+            if step_i == warmup:
+                t_start = time.time()
+            if step_i % log_every == 0:
+                print('worker %d step %d: ' % (task_index, step_i) + ', '.join(
+                    '%s %.4f' % (n, v) for n, v in zip(names, values)))
+    seconds = time.time() - t_start if t_start else 0.0
+    steps = max(step_i - warmup, 0)
+    result = {'task': task_index,
+              'steps': steps,
+              'examples': steps * spec['batch_size'],
+              'seconds': seconds,
+              'examples_per_sec': (steps * spec['batch_size'] / seconds
+                                   if seconds else 0.0)}
+    if report is not None:
+        report(result)
+    return result
@@ -0,0 +1,204 @@
+"""Evaluate many VAE_ALIGN1 checkpoints against one graph.
+
+The graph, session and decoded test set are built once; every checkpoint
+only costs a saver.restore and one pass over the in-memory images.  With
+n_procs > 1 the checkpoints are split over worker processes, each of which
+builds its own evaluator once.
+
+    rows = evaluate_checkpoints(['models/align-300w-*'], n_procs=2)
+    print(format_table(rows))
+"""
+import os
+import re
+import glob
+import multiprocessing
+import numpy as np
+import tensorflow as tf
+from libs.vae import VAE_ALIGN1
+from libs.dataset_utils import LandmarkDataset
+from libs.dataset_utils import standardize_images
+from libs import metrics
+
+# Same model as eval_vae.py.
+DEFAULT_MODEL = dict(input_shape=[None, 128, 128, 1],
+                     convolutional=True,
+                     variational=True,
+                     n_filters=[100, 100, 100],
+                     n_hidden=250,
+                     n_code=100,
+                     dropout=False,
+                     filter_sizes=[3, 3, 3],
+                     activation=tf.nn.relu)
+
+
+def _step(ckpt):
+    m = re.search(r'-(\d+)$', ckpt)
+    return int(m.group(1)) if m else -1
+
+
+def expand_checkpoints(patterns):
+    """Checkpoint prefixes for a list of prefixes, globs or directories.
+
+    Parameters
+    ----------
+    patterns : list of str
+        A checkpoint prefix ('models/align-1000'), a glob over prefixes
+        ('models/align-*') or a directory with a `checkpoint` file.
+
+    Returns
+    -------
+    ckpts : list of str
+        Unique prefixes ordered by global step.
+    """
+    ckpts = []
+    for pattern in patterns:
+        if os.path.isdir(pattern):
+            state = tf.train.get_checkpoint_state(pattern)
+            if state is not None:
+                ckpts.extend(state.all_model_checkpoint_paths)
+            continue
+        for f in glob.glob(pattern + '.index') or glob.glob(pattern):
+            if f.endswith('.index'):
+                ckpts.append(f[:-len('.index')])
+            elif '.data-' in f:
+                ckpts.append(f.split('.data-')[0])
+            elif f.endswith('.meta'):
+                ckpts.append(f[:-len('.meta')])
+            else:
+                ckpts.append(f)
+    return sorted(set(ckpts), key=lambda c: (_step(c), c))
+
+
+class CheckpointEvaluator(object):
+    """One graph and one decoded test set, restored from many checkpoints.
+
+    Parameters
+    ----------
+    txt : str, optional
+        300-W list to evaluate on; decoded once with LandmarkDataset.load.
+    batch_size : int, optional
+        Images per sess.run.
+    subsets : dict, optional
+        Named index ranges reported per checkpoint.
+    model : dict, optional
+        VAE_ALIGN1 arguments, defaults to DEFAULT_MODEL.
+    """
+
+    def __init__(self, txt='300w-gt-test.txt', batch_size=69,
+                 subsets=metrics.SUBSETS_300W, model=None):
+        self.batch_size = batch_size
+        self.subsets = subsets
+        self.data = LandmarkDataset.load(txt, shape=[128, 128, 1])
+        self.graph = tf.Graph()
+        with self.graph.as_default():
+            self.ae = VAE_ALIGN1(**(model or DEFAULT_MODEL))
+            self.saver = tf.train.Saver()
+            config = tf.ConfigProto()
+            config.gpu_options.allow_growth = True
+            self.sess = tf.Session(config=config)
+        self.graph.finalize()
+        self.feed_dict = {self.ae['train']: False, self.ae['keep']: False,
+                          self.ae['keep_prob']: 1.0,
+                          self.ae['keep_prob1']: 1.0,
+                          self.ae['keep_prob2']: 1.0}
+
+    def predict(self):
+        """N x 136 predictions of the restored model, in list order."""
+        preds = []
+        for start in range(0, self.data.num_examples, self.batch_size):
+            images = self.data.images[start:start + self.batch_size]
+            self.feed_dict[self.ae['x']] = standardize_images(images)
+            preds.append(self.sess.run(self.ae['y'], feed_dict=self.feed_dict))
+        return np.reshape(np.concatenate(preds), [self.data.num_examples, -1])
+
+    def evaluate(self, ckpt):
+        """Restore `ckpt` and evaluate it on the whole list.
+
+        Returns
+        -------
+        row : dict
+            'ckpt', 'nme', 'auc@0.08', 'failure@0.08' and the NME of every
+            subset that fits in the list.
+        """
+        self.saver.restore(self.sess, ckpt)
+        errors = metrics.ErrorAccumulator(self.subsets)
+        errors.update(metrics.nme(self.data.landmarks, self.predict()))
+        row = {'ckpt': ckpt, 'nme': errors.mean(),
+               'auc@0.08': errors.auc(0.08),
+               'failure@0.08': errors.failure_rate(0.08)}
+        for name in sorted(self.subsets):
+            if errors.count(name):
+                row[name] = errors.mean(name)
+        return row
+
+    def close(self):
+        self.sess.close()
+
+
+_evaluator = None
+
+
+def _init_worker(kwargs):
+    global _evaluator
+    _evaluator = CheckpointEvaluator(**kwargs)
+
+
+def _evaluate_worker(ckpt):
+    return _evaluator.evaluate(ckpt)
+
+
+def evaluate_checkpoints(patterns, n_procs=1, **kwargs):
+    """Evaluate every checkpoint matched by `patterns`.
+
+    Parameters
+    ----------
+    patterns : list of str
+        See expand_checkpoints.
+    n_procs : int, optional
+        Worker processes; each builds the graph and loads the data once.
+    **kwargs
+        CheckpointEvaluator arguments.
+
+    Returns
+    -------
+    rows : list of dict
+        One CheckpointEvaluator.evaluate row per checkpoint, by step.
+    """
+    ckpts = expand_checkpoints(patterns)
+    if not ckpts:
+        raise ValueError('No checkpoints match %s' % patterns)
+    if n_procs <= 1:
+        evaluator = CheckpointEvaluator(**kwargs)
+        try:
+            rows = []
+            for ckpt in ckpts:
+                rows.append(evaluator.evaluate(ckpt))
+                print('%s: %f' % (ckpt, rows[-1]['nme']))
+            return rows
+        finally:
+            evaluator.close()
+    # build the cached test set once before the workers memory-map it
+    LandmarkDataset.load(kwargs.get('txt', '300w-gt-test.txt'),
+                         shape=[128, 128, 1])
+    pool = multiprocessing.get_context('spawn').Pool(
+        min(n_procs, len(ckpts)), initializer=_init_worker,
+        initargs=(kwargs,))
+    try:
+        return pool.map(_evaluate_worker, ckpts, chunksize=1)
+    finally:
+        pool.close()
+        pool.join()
+
+
+def format_table(rows, columns=('nme', 'auc@0.08', 'failure@0.08',
+                                'LFPW', 'HELEN', 'IBUG', 'common')):
+    """Plain-text table of evaluate_checkpoints rows."""
+    columns = [c for c in columns if any(c in row for row in rows)]
+    width = max(len(row['ckpt']) for row in rows)
+    lines = ['%-*s ' % (width, 'checkpoint') +
+             ' '.join('%12s' % c for c in columns)]
+    for row in rows:
+        lines.append('%-*s ' % (width, row['ckpt']) +
+                     ' '.join('%12.5f' % row[c] if c in row else '%12s' % '-'
+                              for c in columns))
+    return '\n'.join(lines)
@@ -0,0 +1,109 @@
+"""Frozen inference graph for the landmark aligner.
+
+export_aligner restores a VAE_ALIGN1 checkpoint into a graph built for
+inference only: no dropout, batch norm folded into the align convolutions
+(batch_norm.fold_checkpoint).  Variables are turned into constants and
+everything that does not lead from 'x' to 'landmarks' (labels, losses,
+keep_prob / corrupt_prob / phase placeholders) is dropped.
+
+    export_aligner('models/align-300w-gtbbx-1000', 'aligner.pb')
+    predictor = LandmarkPredictor('aligner.pb')
+    landmarks = predictor.predict(images)   # N x 68 x 2
+"""
+import os
+import tensorflow as tf
+from libs.vae import VAE_ALIGN1
+from libs.vae import ALIGN_BN_PAIRS
+from libs.batch_norm import fold_checkpoint
+from libs.batch_norm import BN_EPSILON
+from libs.batch_norm import FUSED_BN_EPSILON
+from libs.batch_norm import assign_folded
+from libs.dataset_utils import standardize_images
+from libs.evaluator import DEFAULT_MODEL
+
+INPUT_NAME = 'x'
+OUTPUT_NAME = 'landmarks'
+
+
+def export_aligner(ckpt, output='aligner.pb', model=None):
+    """Write a frozen, pruned GraphDef of x -> landmarks.
+
+    Parameters
+    ----------
+    ckpt : str
+        VAE_ALIGN1 checkpoint prefix.
+    output : str, optional
+        Output .pb file.
+    model : dict, optional
+        VAE_ALIGN1 arguments, defaults to evaluator.DEFAULT_MODEL.  With
+        fused_bn=True the batch norms are folded with FUSED_BN_EPSILON.
+
+    Returns
+    -------
+    graph_def : tf.GraphDef
+        The written graph.
+    """
+    model = dict(model or DEFAULT_MODEL, dropout=False, folded_bn=True)
+    epsilon = FUSED_BN_EPSILON if model.pop('fused_bn', False) else BN_EPSILON
+    g = tf.Graph()
+    with g.as_default():
+        ae = VAE_ALIGN1(**model)
+        # not an Identity, which remove_training_nodes would strip
+        tf.reshape(ae['y'], [-1, 68, 2], name=OUTPUT_NAME)
+        with tf.Session(graph=g) as sess:
+            assign_folded(sess, fold_checkpoint(ckpt, ALIGN_BN_PAIRS, epsilon),
+                          ckpt)
+            graph_def = tf.graph_util.convert_variables_to_constants(
+                sess, g.as_graph_def(), [OUTPUT_NAME])
+    graph_def = tf.graph_util.remove_training_nodes(graph_def)
+    tf.train.write_graph(graph_def, os.path.dirname(output) or '.',
+                         os.path.basename(output), as_text=False)
+    print('wrote %s: %d ops, %d bytes' % (
+        output, len(graph_def.node), graph_def.ByteSize()))
+    return graph_def
+
+
+class LandmarkPredictor(object):
+    """Landmarks from a graph written by export_aligner.
+
+    Parameters
+    ----------
+    path : str
+        Frozen .pb file.
+    config : tf.ConfigProto, optional
+        Session configuration.
+    """
+
+    def __init__(self, path, config=None):
+        graph_def = tf.GraphDef()
+        with open(path, 'rb') as f:
+            graph_def.ParseFromString(f.read())
+        self.graph = tf.Graph()
+        with self.graph.as_default():
+            tf.import_graph_def(graph_def, name='')
+        self.graph.finalize()
+        self.x = self.graph.get_tensor_by_name(INPUT_NAME + ':0')
+        self.landmarks = self.graph.get_tensor_by_name(OUTPUT_NAME + ':0')
+        self.sess = tf.Session(graph=self.graph, config=config)
+
+    def predict(self, images, standardized=False):
+        """Landmarks of a batch.
+
+        Parameters
+        ----------
+        images : np.ndarray
+            N x 128 x 128 x 1 images, uint8 pixels unless `standardized`.
+        standardized : bool, optional
+            Images are already per-image standardized float32.
+
+        Returns
+        -------
+        landmarks : np.ndarray
+            N x 68 x 2 normalized (x, y) landmarks.
+        """
+        if not standardized:
+            images = standardize_images(images)
+        return self.sess.run(self.landmarks, feed_dict={self.x: images})
+
+    def close(self):
+        self.sess.close()
@@ -0,0 +1,274 @@
+"""Cached decoder outputs for training the align head alone.
+
+With the trunk frozen (VARIANTS[...]['align_only']) the align head reads
+the first encoder layer hs[0] and the 68 landmark maps y the decoder makes of
+each image.  y takes the whole encoder / decoder to compute, hs[0] one 3 x 3
+convolution of the image.  build_feature_cache runs the trunk once over a
+list and stores y as uint8 (sigmoid outputs, quantized to 1/255) in an .npy
+file: 64 * 64 * 68 bytes = 272 KB per line, about 28 GB for the 100k lines of
+300w-gt-aug.txt.  Storing hs[0] as well would take 800 KB more per line in
+float16 for a layer that is cheaper to recompute than to read.
+
+train_align_from_cache then trains the head on the 128 x 128 images (16 KB
+per line, LandmarkDataset) and rows of the cache read through a memmap: a
+step runs hs[0] and the head, not the rest of the encoder, the variational
+layers and the decoder.  It prints the seconds and examples/sec of every
+epoch, compare them with train_vae_align's.
+
+The trunk runs without dropout when the cache is built, where train_vae_align
+applies it every step, and there is no augmentation: every epoch sees the
+same maps.
+
+    build_feature_cache('300w-gt-aug.txt', 'models/vae_gt20000-20000')
+    train_align_from_cache('300w-gt-aug.txt', 'models/vae_gt20000-20000')
+"""
+import os
+import time
+import queue
+import threading
+import numpy as np
+import tensorflow as tf
+from libs import utils
+from libs.vae import VAE_ALIGN1
+from libs.vae import VARIANTS
+from libs.dataset_utils import LandmarkDataset
+from libs.dataset_utils import standardize_images
+from libs.heatmap_cache import read_landmark_list
+from libs.evaluator import DEFAULT_MODEL
+from libs.checkpoint import AsyncCheckpointer
+from libs.profiler import StepProfiler
+
+
+def cache_path_for(txt):
+    """Default cache location for a list file."""
+    return txt + '.decoded.npy'
+
+
+def _trunk_saver():
+    return tf.train.Saver([v for v in tf.global_variables()
+                           if not v.name.startswith('align/')])
+
+
+def build_feature_cache(txt, ckpt, cache_path=None, batch_size=64,
+                        model=None):
+    """Run the trunk of `ckpt` over every image of `txt` once.
+
+    Parameters
+    ----------
+    txt : str
+        300-W list file, decoded with LandmarkDataset.load.
+    ckpt : str
+        Checkpoint with the trunk (a train_vae or a train_vae_align one).
+    cache_path : str, optional
+        Output .npy file, defaults to `txt + '.decoded.npy'`.
+    batch_size : int, optional
+        Images per sess.run.
+    model : dict, optional
+        VAE_ALIGN1 arguments, defaults to evaluator.DEFAULT_MODEL.
+
+    Returns
+    -------
+    cache_path : str
+        Location of the written N x 64 x 64 x 68 uint8 cache.
+    """
+    cache_path = cache_path or cache_path_for(txt)
+    data = LandmarkDataset.load(txt, shape=[128, 128, 1])
+    g = tf.Graph()
+    with g.as_default():
+        ae = VAE_ALIGN1(**dict(model or DEFAULT_MODEL, dropout=False))
+        maps = tf.cast(tf.round(ae['maps'] * 255.0), tf.uint8)
+        shape = maps.get_shape().as_list()[1:]
+        with tf.Session(graph=g) as sess:
+            _trunk_saver().restore(sess, ckpt)
+            tmp_path = cache_path + '.tmp.npy'
+            out = np.lib.format.open_memmap(
+                tmp_path, mode='w+', dtype=np.uint8,
+                shape=tuple([data.num_examples] + shape))
+            feed_dict = {ae['train']: False, ae['keep']: False,
+                         ae['keep_prob']: 1.0, ae['keep_prob1']: 1.0,
+                         ae['keep_prob2']: 1.0}
+            for start in range(0, data.num_examples, batch_size):
+                images = data.images[start:start + batch_size]
+                feed_dict[ae['x']] = standardize_images(images)
+                out[start:start + len(images)] = sess.run(
+                    maps, feed_dict=feed_dict)
+                print('cached %d/%d' % (start + len(images),
+                                        data.num_examples), end='\r')
+            out.flush()
+            del out
+    os.rename(tmp_path, cache_path)
+    print('\nwrote %s, %.1f GB' % (cache_path,
+                                   os.path.getsize(cache_path) / 1024.0 ** 3))
+    return cache_path
+
+
+def prefetch_batches(arrays, batch_size, n_epochs, shuffle=True, prefetch=4):
+    """Batches of rows of several arrays, read by a background thread.
+
+    Parameters
+    ----------
+    arrays : list of np.ndarray
+        Arrays with the same number of rows, e.g. memmaps.
+    batch_size : int
+        Rows per batch, the last batch of an epoch may be smaller.
+    n_epochs : int
+        Number of passes.
+    shuffle : bool, optional
+        New random order every epoch.
+    prefetch : int, optional
+        Batches read ahead.
+
+    Yields
+    ------
+    epoch_i, rows : int, list of np.ndarray
+        Epoch and the batch of every array.
+    """
+    batches = queue.Queue(maxsize=prefetch)
+    n = len(arrays[0])
+
+    def read():
+        for epoch_i in range(n_epochs):
+            order = np.random.permutation(n) if shuffle else np.arange(n)
+            for start in range(0, n, batch_size):
+                # sorted rows read the memmaps front to back
+                idx = np.sort(order[start:start + batch_size])
+                batches.put((epoch_i, [a[idx] for a in arrays]))
+        batches.put(None)
+
+    thread = threading.Thread(target=read, name='feature_cache')
+    thread.daemon = True
+    thread.start()
+    while True:
+        batch = batches.get()
+        if batch is None:
+            return
+        yield batch
+
+
+def train_align_from_cache(txt, ckpt_name, cache_path=None, batch_size=64,
+                           n_epochs=50, keep_prob=0.8, img_step=100,
+                           save_step=20000, variant='base', model=None,
+                           keep_checkpoints=5, profile_dir=None):
+    """Train the align head of VAE_ALIGN1 on cached decoder outputs.
+
+    Checkpoints hold every variable (the trunk restored from `ckpt_name`), so
+    they work with eval_vae_align, the evaluator and export_aligner.
+
+    Parameters
+    ----------
+    txt : str
+        300-W list the cache was built from.
+    ckpt_name : str
+        Checkpoint the cache was built with.
+    cache_path : str, optional
+        Cache file, defaults to `txt + '.decoded.npy'`.
+    n_epochs : int, optional
+        Passes over the cache.
+    batch_size, keep_prob, img_step, save_step : optional
+        Same as train_vae_align.
+    variant : str, optional
+        Key of VARIANTS, must have align_only.
+    model : dict, optional
+        VAE_ALIGN1 arguments, defaults to evaluator.DEFAULT_MODEL with
+        dropout.
+    keep_checkpoints : int, optional
+        Most recent checkpoints kept.
+    profile_dir : str, optional
+        See profiler.StepProfiler.
+    """
+    opts = VARIANTS[variant]
+    if not opts['align_only']:
+        raise ValueError('variant %r trains the trunk, its outputs cannot '
+                         'be cached' % variant)
+    maps = np.load(cache_path or cache_path_for(txt), mmap_mode='r')
+    images = LandmarkDataset.load(txt, shape=[128, 128, 1]).images
+    _, labels = read_landmark_list(txt)
+    if not len(maps) == len(images) == len(labels):
+        raise ValueError('%d cached maps, %d images and %d labels, rebuild '
+                         'the cache' % (len(maps), len(images), len(labels)))
+
+    maps_ph = tf.placeholder(tf.uint8, [None] + list(maps.shape[1:]), 'maps')
+    ae = VAE_ALIGN1(**dict(model or DEFAULT_MODEL, dropout=True,
+                           maps=tf.to_float(maps_ph) / 255.0,
+                           loss_weights=opts['loss_weights']))
+    opt_vars = [v for v in tf.trainable_variables()
+                if v.name.startswith('align/')]
+    batch_idx = tf.Variable(0, dtype=tf.int32)
+    learning_rate = tf.train.exponential_decay(
+        opts['learning_rate'], batch_idx * batch_size, 192000, 0.95,
+        staircase=True)
+    optimizer = tf.train.AdamOptimizer(learning_rate=learning_rate).minimize(
+        ae['cost'], var_list=opt_vars, global_step=batch_idx)
+
+    sess = tf.Session()
+    sess.run(tf.global_variables_initializer())
+    if opts['restore_all']:
+        tf.train.Saver().restore(sess, ckpt_name)
+    else:
+        _trunk_saver().restore(sess, ckpt_name)
+    print('load ' + ckpt_name + ' successfully')
+    ckpt = AsyncCheckpointer(sess, tf.global_variables(), opts['align_dir'],
+                             'align-300w-gtbbx', keep_last=keep_checkpoints,
+                             keep_best=1)
+    prof = StepProfiler(sess, profile_dir)
+    tf.get_default_graph().finalize()
+
+    feed_dict = {ae['train']: True, ae['keep']: False,
+                 ae['keep_prob']: keep_prob, ae['keep_prob1']: 0.9,
+                 ae['keep_prob2']: 0.7}
+    batches = prefetch_batches([images, maps, labels], batch_size, n_epochs)
+    batch_i = 0
+    epoch_i = 0
+    cost = 0
+    n_batches = 0
+    window_cost, window_n = 0, 0
+    last_saved = None
+    t_epoch = time.time()
+
+    def end_epoch():
+        dt = time.time() - t_epoch
+        print('epoch: %d, average cost: %f, %.1f s, %.1f examples/sec' % (
+            epoch_i, cost / max(n_batches, 1), dt, len(maps) / dt))
+
+    try:
+        while True:
+            with prof.dequeue():
+                batch = next(batches, None)
+            if batch is None:
+                end_epoch()
+                break
+            if batch[0] != epoch_i:
+                end_epoch()
+                epoch_i, cost, n_batches = batch[0], 0, 0
+                t_epoch = time.time()
+            batch_xs, batch_maps, batch_ys = batch[1]
+            feed_dict[ae['x']] = standardize_images(batch_xs)
+            feed_dict[maps_ph] = batch_maps
+            feed_dict[ae['label']] = batch_ys
+            train_cost, pred = prof.run(
+                [ae['cost'], ae['y'], optimizer], feed_dict=feed_dict)[:2]
+            batch_i += 1
+            n_batches += 1
+            cost += train_cost
+            window_cost += train_cost
+            window_n += 1
+
+            if batch_i % img_step == 0:
+                err = utils.evaluateBatchError(
+                    batch_ys.reshape([-1, 68, 2]), pred, len(pred))
+                print('Mean error:' + np.array_str(err))
+
+            if batch_i % save_step == 0:
+                # named by the global step, scored by the mean cost since
+                # the previous save, as in train_vae_align
+                last_saved = sess.run(batch_idx)
+                ckpt.save(last_saved, metric=window_cost / window_n)
+                window_cost, window_n = 0, 0
+            prof.step(cost=train_cost)
+    finally:
+        step = sess.run(batch_idx)
+        if step != last_saved:
+            ckpt.save(step)
+        ckpt.close()
+        prof.close()
+        sess.close()
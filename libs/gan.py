@@ -9,6 +9,7 @@ import numpy as np
 import matplotlib.pyplot as plt
 import os
 import libs.batch_norm as bn
+from libs.profiler import StepProfiler
 from libs.utils import *
 
 
@@ -368,9 +369,17 @@ def GAN(input_shape, n_latent, n_features, rgb, debug=True):
     }
 
 
-def train_ds():
+def train_ds(profile_dir=None, trace_every=0):
     """Summary
-    
+
+    Parameters
+    ----------
+    profile_dir : str, optional
+        Write step-time reports, TensorBoard scalars and traces here, see
+        profiler.StepProfiler.
+    trace_every : int, optional
+        Write a Chrome trace every this many steps (needs profile_dir).
+
     Returns
     -------
     name : TYPE
@@ -448,6 +457,7 @@ def train_ds():
         sums['z'], sums['x'], sums['D_real'], sums['D_fake']])
     writer = tf.train.SummaryWriter("./logs", sess.graph_def)
 
+    prof = StepProfiler(sess, profile_dir, trace_every=trace_every)
     coord = tf.train.Coordinator()
     threads = tf.train.start_queue_runners(sess=sess, coord=coord)
     sess.run(init_op)
@@ -466,7 +476,7 @@ def train_ds():
     n_loss_g, total_loss_g = 1, 1
     try:
         while not coord.should_stop():
-            batch_xs = sess.run(batch)
+            batch_xs = prof.run_batch(batch)
             step_i += 1
             batch_zs = np.random.uniform(
                 -1.0, 1.0, [batch_size, n_latent]).astype(np.float32)
@@ -478,7 +488,7 @@ def train_ds():
 
             # if np.random.random() > (loss_g / (loss_d + loss_g)):
             if step_i % 3 == 1:
-                loss_d, _, sum_d = sess.run([gan['loss_D'], opt_d, D_sum_op],
+                loss_d, _, sum_d = prof.run([gan['loss_D'], opt_d, D_sum_op],
                                             feed_dict={gan['x']: batch_xs,
                                                        gan['z']: batch_zs,
                                                        gan['train']: True,
@@ -486,20 +496,14 @@ def train_ds():
                 total_loss_d += loss_d
                 n_loss_d += 1
                 writer.add_summary(sum_d, step_i)
-                print('%04d d* = lr: %0.08f, loss: %08.06f, \t' %
-                      (step_i, this_lr_d, loss_d) +
-                      'g  = lr: %0.08f, loss: %08.06f' % (this_lr_g, loss_g))
             else:
-                loss_g, _, sum_g = sess.run([gan['loss_G'], opt_g, G_sum_op],
+                loss_g, _, sum_g = prof.run([gan['loss_G'], opt_g, G_sum_op],
                                             feed_dict={gan['z']: batch_zs,
                                                        gan['train']: True,
                                                        lr_g: this_lr_g})
                 total_loss_g += loss_g
                 n_loss_g += 1
                 writer.add_summary(sum_g, step_i)
-                print('%04d d  = lr: %0.08f, loss: %08.06f, \t' %
-                      (step_i, this_lr_d, loss_d) +
-                      'g* = lr: %0.08f, loss: %08.06f' % (this_lr_g, loss_g))
 
             if step_i % 100 == 0:
                 samples = sess.run(gan['G'], feed_dict={
@@ -517,11 +521,14 @@ def train_ds():
                                        global_step=step_i,
                                        write_meta_graph=False)
                 print("Model saved in file: %s" % save_path)
+            prof.step(loss_d=loss_d, loss_g=loss_g,
+                      lr_d=this_lr_d, lr_g=this_lr_g)
     except tf.errors.OutOfRangeError:
         print('Done training -- epoch limit reached')
     finally:
         # One of the threads has issued an exception.  So let's tell all the
         # threads to shutdown.
+        prof.close()
         coord.request_stop()
 
     # Wait until all threads have finished.
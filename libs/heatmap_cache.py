@@ -0,0 +1,159 @@
+"""Precomputed landmark map cache for the 300-W training lists.
+
+The maps for a list such as 300w-gt-aug.txt never change between epochs, so
+they are rendered once with genBatchMaps and stored bit-packed along the
+landmark axis in an .npy file: 64 x 64 x 68 maps take 64 * 64 * 9 bytes per
+line instead of 64 * 64 * 68 * 8 bytes of float64.  At training time a
+FixedLengthRecordReader reads the rows in step with the TextLineReader that
+reads the list (tfpipeline.input_pipeline_cached), so the cache has one row
+per line of the list, blank lines included (their rows stay empty).
+"""
+import os
+import numpy as np
+from libs.tfpipeline import genBatchMaps
+
+
+def read_landmark_list(txt):
+    """Read a 300-W list file.
+
+    Parameters
+    ----------
+    txt : str
+        List with one `image_path x0 y0 x1 y1 ...` line per example.
+
+    Returns
+    -------
+    names : list of str
+        Image paths.
+    landmarks : np.ndarray
+        N x 2K float32 normalized landmarks.
+    """
+    names = []
+    landmarks = []
+    with open(txt) as f:
+        for line in f:
+            fields = line.split()
+            if not fields:
+                continue
+            names.append(fields[0])
+            landmarks.append([float(v) for v in fields[1:]])
+    return names, np.asarray(landmarks, dtype=np.float32)
+
+
+def _count_lines(txt):
+    with open(txt) as f:
+        return sum(1 for _ in f)
+
+
+def cache_path_for(txt):
+    """Default cache location for a list file."""
+    return txt + '.maps.npy'
+
+
+def build_heatmap_cache(txt, cache_path=None, shape=[64, 64], radius=3,
+                        chunk_size=64):
+    """Render every landmark map of `txt` once and store them bit-packed.
+
+    Parameters
+    ----------
+    txt : str
+        300-W list file.
+    cache_path : str, optional
+        Output .npy file, defaults to `txt + '.maps.npy'`.
+    shape : list, optional
+        [H, W] of the maps, same as input_pipeline.
+    radius : int, optional
+        Disk radius, same as input_pipeline.
+    chunk_size : int, optional
+        Number of lines rendered per genBatchMaps call.  genBatchMaps keeps
+        an int64 distance and a float32 map per pixel and landmark, about
+        12 * H * W * K bytes per line: 64 lines of 64 x 64 x 68 maps take
+        ~215 MB.
+
+    Returns
+    -------
+    cache_path : str
+        Location of the written cache.
+    """
+    cache_path = cache_path or cache_path_for(txt)
+    _, landmarks = read_landmark_list(txt)
+    # row of every non-blank line, read_landmark_list skips the blank ones
+    with open(txt) as f:
+        rows = np.asarray([i for i, line in enumerate(f) if line.split()])
+    n_lines = _count_lines(txt)
+    n_landmarks = landmarks.shape[1] // 2
+    n_bytes = (n_landmarks + 7) // 8
+    tmp_path = cache_path + '.tmp.npy'
+    out = np.lib.format.open_memmap(
+        tmp_path, mode='w+', dtype=np.uint8,
+        shape=(n_lines, shape[0], shape[1], n_bytes))
+    for start in range(0, len(landmarks), chunk_size):
+        maps = genBatchMaps(landmarks[start:start + chunk_size], shape, radius)
+        out[rows[start:start + len(maps)]] = np.packbits(maps.astype(bool),
+                                                         axis=-1)
+        print('rendered %d/%d' % (start + len(maps), len(landmarks)), end='\r')
+    out.flush()
+    del out
+    os.rename(tmp_path, cache_path)
+    print('\nwrote ' + cache_path)
+    return cache_path
+
+
+class HeatmapCache(object):
+    """Validated caches of a set of lists.
+
+    `paths`, `header_bytes` and `record_bytes` are what a
+    FixedLengthRecordReader needs to read the rows; lookup returns one row in
+    NumPy.
+
+    Parameters
+    ----------
+    TXTs : list of str
+        List files fed to string_input_producer.
+    cache_paths : list of str, optional
+        Matching cache files, defaults to `cache_path_for(txt)`.
+    n_landmarks : int, optional
+        Number of map channels to unpack.
+    shape : list, optional
+        Expected [H, W] of the maps.
+
+    Raises
+    ------
+    ValueError
+        If a cache is older than its list, has a different number of lines
+        or the wrong map shape; rebuild it with build_heatmap_cache.py.
+        Also if the caches have headers of different lengths.
+    """
+
+    def __init__(self, TXTs, cache_paths=None, n_landmarks=68, shape=None):
+        cache_paths = cache_paths or [cache_path_for(txt) for txt in TXTs]
+        self.n_landmarks = n_landmarks
+        self.maps = {}
+        for txt, path in zip(TXTs, cache_paths):
+            maps = np.load(path, mmap_mode='r')
+            if os.path.getmtime(path) < os.path.getmtime(txt):
+                raise ValueError('%s is older than %s' % (path, txt))
+            if len(maps) != _count_lines(txt):
+                raise ValueError('%s has %d rows, %s has %d lines' % (
+                    path, len(maps), txt, _count_lines(txt)))
+            expected = [maps.shape[1], maps.shape[2]] if shape is None \
+                else list(shape)
+            expected.append((n_landmarks + 7) // 8)
+            if list(maps.shape[1:]) != expected:
+                raise ValueError('%s has maps of shape %s, expected %s' % (
+                    path, list(maps.shape[1:]), expected))
+            self.maps[txt.encode()] = maps
+        self.paths = list(cache_paths)
+        first = self.maps[TXTs[0].encode()]
+        self.shape = first.shape[1:3]
+        self.header_bytes = first.offset
+        self.record_bytes = int(np.prod(first.shape[1:]))
+        if any(m.offset != self.header_bytes for m in self.maps.values()):
+            raise ValueError('caches of %s have headers of different '
+                             'lengths' % TXTs)
+
+    def lookup(self, key):
+        """Return the H x W x K uint8 map for a `filename:line` key."""
+        fname, line = key.rsplit(b':', 1)
+        row = self.maps[fname][int(line) - 1]
+        return np.unpackbits(row, axis=-1)[:, :, :self.n_landmarks]
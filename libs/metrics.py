@@ -0,0 +1,269 @@
+"""Vectorized landmark evaluation metrics.
+
+Everything works on [N, K, 2] arrays (flat [N, 2K] is accepted too) with
+one NumPy call per quantity, for any landmark count K.
+"""
+import numpy as np
+
+# (left, right) index sets whose pairwise distances define the normalizer.
+# 'ocular' for 68 points is what utils.evaluateError has always used: the
+# mean distance between corresponding points of the two eyes.
+NORMALIZERS = {
+    68: {'ocular': (list(range(36, 42)), list(range(42, 48))),
+         'corners': ([36], [45]),
+         'pupils': (list(range(36, 42)), list(range(42, 48)))},
+    5: {'ocular': ([0], [1]),
+        'corners': ([0], [1]),
+        'pupils': ([0], [1])},
+}
+
+# Index ranges of the 300-W test list (300w-gt-test.txt).
+SUBSETS_300W = {'LFPW': slice(0, 224),
+                'HELEN': slice(224, 554),
+                'IBUG': slice(554, 689),
+                'common': slice(0, 554),
+                'full': slice(0, 689)}
+
+
+def as_points(landmarks):
+    """Reshape [N, 2K] or [N, K, 2] (or a single [K, 2]) to [N, K, 2]."""
+    landmarks = np.asarray(landmarks, dtype=np.float64)
+    if landmarks.ndim == 2 and landmarks.shape[-1] != 2:
+        return landmarks.reshape((len(landmarks), -1, 2))
+    if landmarks.ndim == 2:
+        return landmarks[None]
+    return landmarks
+
+
+def normalizer(gt, norm='ocular'):
+    """Per-image normalizing distance.
+
+    Parameters
+    ----------
+    gt : np.ndarray
+        [N, K, 2] ground truth.
+    norm : str or tuple, optional
+        'ocular', 'corners' (outer eye corners) or 'pupils' (eye centers),
+        or an explicit (left_indices, right_indices) pair.
+
+    Returns
+    -------
+    d : np.ndarray
+        [N] distances.
+    """
+    gt = as_points(gt)
+    if isinstance(norm, str):
+        left, right = NORMALIZERS[gt.shape[1]][norm]
+    else:
+        left, right = norm
+    if norm == 'pupils':
+        return np.linalg.norm(gt[:, left].mean(axis=1) -
+                              gt[:, right].mean(axis=1), axis=-1)
+    return np.linalg.norm(gt[:, left] - gt[:, right], axis=-1).mean(axis=1)
+
+
+def normalized_errors(gt, pred, norm='ocular'):
+    """Point-to-point errors divided by the normalizer.
+
+    Returns
+    -------
+    errors : np.ndarray
+        [N, K] normalized errors.
+    """
+    gt = as_points(gt)
+    pred = as_points(pred)
+    e = np.linalg.norm(gt - pred, axis=-1)
+    return e / normalizer(gt, norm)[:, None]
+
+
+def nme(gt, pred, norm='ocular'):
+    """Per-image normalized mean error, [N]."""
+    return normalized_errors(gt, pred, norm).mean(axis=1)
+
+
+def nrmse(gt, pred, norm='corners'):
+    """Per-image error as computed by utils.normalized_rmse, [N]."""
+    return nme(gt, pred, norm)
+
+
+def per_landmark(errors):
+    """Mean error of every landmark over the images, [K]."""
+    return np.asarray(errors).mean(axis=0)
+
+
+def per_subset(values, subsets=SUBSETS_300W):
+    """Mean of `values` over every named subset.
+
+    Parameters
+    ----------
+    values : np.ndarray
+        [N] or [N, K] per-image values.
+    subsets : dict, optional
+        Name to index (slice, list or mask), defaults to the 300-W test
+        split.  Subsets that do not fit in `values` are skipped.
+
+    Returns
+    -------
+    means : dict
+        Name to mean value.
+    """
+    values = np.asarray(values)
+    means = {}
+    for name, idxs in subsets.items():
+        if isinstance(idxs, slice) and idxs.stop > len(values):
+            continue
+        means[name] = values[idxs].mean()
+    return means
+
+
+def ced(errors, thresholds):
+    """Cumulative error distribution: fraction of errors <= each threshold.
+
+    Parameters
+    ----------
+    errors : np.ndarray
+        Per-image errors.
+    thresholds : np.ndarray
+        Thresholds to evaluate at.
+
+    Returns
+    -------
+    fractions : np.ndarray
+        Same shape as `thresholds`.
+    """
+    errors = np.sort(np.ravel(errors))
+    return np.searchsorted(errors, thresholds, side='right') / float(len(errors))
+
+
+def auc(errors, threshold=0.08, step=0.0001):
+    """Area under the CED curve up to `threshold`, normalized to [0, 1]."""
+    thresholds = np.arange(0.0, threshold + step / 2, step)
+    curve = ced(errors, thresholds)
+    area = ((curve[1:] + curve[:-1]) * np.diff(thresholds)).sum() / 2
+    return area / threshold
+
+
+def failure_rate(errors, threshold=0.08):
+    """Fraction of errors above `threshold`."""
+    return (np.ravel(errors) > threshold).mean()
+
+
+def summary(errors, thresholds=(0.05, 0.08, 0.1)):
+    """Mean, AUC and failure rate at every threshold.
+
+    Returns
+    -------
+    stats : dict
+        {'mean': ..., 'auc@0.08': ..., 'failure@0.08': ..., ...}
+    """
+    stats = {'mean': np.mean(errors)}
+    for t in thresholds:
+        stats['auc@%g' % t] = auc(errors, t)
+        stats['failure@%g' % t] = failure_rate(errors, t)
+    return stats
+
+
+class ErrorAccumulator(object):
+    """Constant-memory running statistics of per-image errors.
+
+    Errors are counted into a fixed histogram per named subset, so the
+    running mean (exact), CED, AUC and failure rate can be read at any time
+    and shards evaluated in parallel can be merged.
+
+    Parameters
+    ----------
+    subsets : dict, optional
+        Name to index (slice, list or mask of stream positions), e.g.
+        SUBSETS_300W.  An 'all' subset covering everything is always kept.
+    max_error : float, optional
+        Upper edge of the histogram; larger errors land in an overflow bin.
+    n_bins : int, optional
+        Histogram resolution, the default bin width is 0.0001 (the AUC step).
+    """
+
+    def __init__(self, subsets=None, max_error=1.0, n_bins=10000):
+        self.subsets = dict(subsets or {})
+        self.subsets['all'] = slice(0, None)
+        self.max_error = max_error
+        self.n_bins = n_bins
+        self.width = max_error / float(n_bins)
+        self.n_seen = 0
+        self.hist = {name: np.zeros(n_bins + 1, dtype=np.int64)
+                     for name in self.subsets}
+        self.sum = dict.fromkeys(self.subsets, 0.0)
+
+    def _members(self, idxs, positions):
+        if isinstance(idxs, slice):
+            stop = np.inf if idxs.stop is None else idxs.stop
+            return (positions >= (idxs.start or 0)) & (positions < stop)
+        idxs = np.asarray(idxs)
+        if idxs.dtype == bool:
+            idxs = np.flatnonzero(idxs)
+        return np.isin(positions, idxs)
+
+    def update(self, errors, start=None):
+        """Add a batch of per-image errors.
+
+        Parameters
+        ----------
+        errors : np.ndarray
+            [N] errors, e.g. from nme.
+        start : int, optional
+            Stream position of the first error, defaults to the number of
+            errors seen so far.  Pass it when a shard covers a known range.
+        """
+        errors = np.ravel(errors).astype(np.float64)
+        start = self.n_seen if start is None else start
+        positions = start + np.arange(len(errors))
+        bins = np.minimum((errors / self.width).astype(np.int64), self.n_bins)
+        for name, idxs in self.subsets.items():
+            mask = self._members(idxs, positions)
+            self.hist[name] += np.bincount(bins[mask],
+                                           minlength=self.n_bins + 1)
+            self.sum[name] += errors[mask].sum()
+        self.n_seen += len(errors)
+
+    def merge(self, other):
+        """Add the counts of another accumulator with the same bins."""
+        if (other.n_bins, other.max_error) != (self.n_bins, self.max_error):
+            raise ValueError('Cannot merge accumulators with different bins')
+        for name in other.subsets:
+            if name not in self.subsets:
+                self.subsets[name] = other.subsets[name]
+                self.hist[name] = np.zeros(self.n_bins + 1, dtype=np.int64)
+                self.sum[name] = 0.0
+            self.hist[name] += other.hist[name]
+            self.sum[name] += other.sum[name]
+        self.n_seen += other.n_seen
+        return self
+
+    def count(self, name='all'):
+        return int(self.hist[name].sum())
+
+    def mean(self, name='all'):
+        return self.sum[name] / max(self.count(name), 1)
+
+    def ced(self, thresholds, name='all'):
+        """Fraction of errors below each threshold (to bin resolution)."""
+        cum = np.concatenate([[0], np.cumsum(self.hist[name])])
+        edges = np.clip(np.round(np.asarray(thresholds) / self.width),
+                        0, self.n_bins).astype(np.int64)
+        return cum[edges] / float(max(self.count(name), 1))
+
+    def auc(self, threshold=0.08, name='all'):
+        """Area under the CED curve up to `threshold`, as auc()."""
+        thresholds = np.arange(0.0, threshold + self.width / 2, self.width)
+        curve = self.ced(thresholds, name)
+        area = ((curve[1:] + curve[:-1]) * np.diff(thresholds)).sum() / 2
+        return area / threshold
+
+    def failure_rate(self, threshold=0.08, name='all'):
+        return 1.0 - self.ced([threshold], name)[0]
+
+    def summary(self, name='all', thresholds=(0.05, 0.08, 0.1)):
+        """Same keys as summary()."""
+        stats = {'mean': self.mean(name)}
+        for t in thresholds:
+            stats['auc@%g' % t] = self.auc(t, name)
+            stats['failure@%g' % t] = self.failure_rate(t, name)
+        return stats
@@ -0,0 +1,187 @@
+"""Parallel input engine for the 300-W list pipelines.
+
+Drop-in replacements for input_pipeline, input_pipeline_local,
+input_pipeline_reg and input_pipeline_reg_test from libs.tfpipeline, with
+the same return values.  Instead of one TextLineReader feeding one
+decode/batch thread, lines are read by `num_readers` readers into a shared
+line queue (interleaving the list files), decoded and augmented by
+`num_threads` workers, and batched into a queue that keeps `prefetch`
+batches ready.  Landmark maps are rendered once per batch after dequeueing.
+
+With deterministic=True (the default when is_training is False) a single
+reader and worker are used and nothing is shuffled, so eval batches come out
+in list order exactly like the original pipelines.
+
+With records=True the inputs are TFRecord shards written by
+libs.records.write_records instead of list files.
+
+With augment set every worker applies libs.augment (random flip, rotation,
+scale and translation of image and landmarks) to its examples, so online
+augmentation scales with num_threads.
+"""
+import tensorflow as tf
+from libs.tfpipeline import read_my_file_format
+from libs.tfpipeline import distort_color
+from libs.tfpipeline import landmark_maps
+from libs.records import parse_record
+from libs.augment import augment_example
+
+
+def line_queue(TXTs, is_training=False, num_readers=4, capacity=4096,
+               records=False, name='line_queue'):
+    """Read list lines (or records) with several readers into one queue.
+
+    Parameters
+    ----------
+    TXTs : list of str
+        List files.
+    is_training : bool, optional
+        Shuffle the file order and the lines in the queue.
+    num_readers : int, optional
+        Number of concurrent readers.
+    capacity : int, optional
+        Number of lines buffered.
+    records : bool, optional
+        TXTs are TFRecord files.
+
+    Returns
+    -------
+    queue : tf.QueueBase
+        Queue of raw list lines or serialized records.
+    """
+    with tf.name_scope(name):
+        filename_queue = tf.train.string_input_producer(
+            TXTs, shuffle=is_training)
+        if is_training:
+            queue = tf.RandomShuffleQueue(
+                capacity=capacity, min_after_dequeue=capacity // 2,
+                dtypes=[tf.string], shapes=[[]])
+        else:
+            queue = tf.FIFOQueue(capacity=capacity, dtypes=[tf.string],
+                                 shapes=[[]])
+        enqueue_ops = []
+        for _ in range(num_readers):
+            reader = tf.TFRecordReader() if records else tf.TextLineReader()
+            _, value = reader.read(filename_queue)
+            enqueue_ops.append(queue.enqueue([value]))
+        tf.train.queue_runner.add_queue_runner(
+            tf.train.queue_runner.QueueRunner(queue, enqueue_ops))
+    return queue
+
+
+def decode_example(value, shape, distort=False, thread_id=0, records=False,
+                   augment=None):
+    """Decode one list line (or record) into a standardized image and its
+    landmarks.  `augment` is True or a dict of libs.augment.random_affine
+    arguments."""
+    if records:
+        img, features = parse_record(value, shape)
+    else:
+        img, features = read_my_file_format(value)
+        img.set_shape(shape)
+        features = tf.stack(features)
+    img = tf.cast(img, tf.float32)
+    if distort:
+        img = distort_color(img, thread_id=thread_id)
+    if augment:
+        img, features = augment_example(
+            img, features, **(augment if isinstance(augment, dict) else {}))
+    return tf.image.per_image_standardization(img), features
+
+
+def batch_examples(TXTs, batch_size, shape, is_training=False, distort=False,
+                   num_readers=4, num_threads=4, prefetch=8,
+                   min_after_dequeue=800, deterministic=None, records=False,
+                   augment=None):
+    """Image and landmark coordinate batches from 300-W list files.
+
+    Parameters
+    ----------
+    TXTs : list of str
+        List files.
+    batch_size : int
+        Batch size.
+    shape : list
+        [height, width, channels] of the images.
+    is_training : bool, optional
+        Shuffle examples.
+    distort : bool, optional
+        Apply distort_color, with a different op ordering per worker.
+    num_readers : int, optional
+        Concurrent list readers.
+    num_threads : int, optional
+        Concurrent decode / augmentation workers.
+    prefetch : int, optional
+        Number of batches kept ready in the output queue.
+    min_after_dequeue : int, optional
+        Shuffle buffer of the output queue when training.
+    deterministic : bool, optional
+        Keep list order; defaults to `not is_training`.
+    records : bool, optional
+        TXTs are TFRecord shards from libs.records.write_records.
+    augment : bool or dict, optional
+        Random geometric augmentation, see decode_example.
+
+    Returns
+    -------
+    img_batch, locs_batch : tf.Tensor, tf.Tensor
+        [N, H, W, C] float images and [N, 2K] landmarks.
+    """
+    if deterministic is None:
+        deterministic = not is_training
+    if deterministic:
+        filename_queue = tf.train.string_input_producer(TXTs, shuffle=False)
+        reader = tf.TFRecordReader() if records else tf.TextLineReader()
+        _, value = reader.read(filename_queue)
+        example = decode_example(value, shape, distort, records=records,
+                                 augment=augment)
+        return tf.train.batch(list(example), batch_size=batch_size,
+                              capacity=prefetch * batch_size, num_threads=1)
+
+    queue = line_queue(TXTs, is_training=is_training, num_readers=num_readers,
+                       capacity=max(4 * num_threads * batch_size, 1024),
+                       records=records)
+    examples = [decode_example(queue.dequeue(), shape, distort, thread_id,
+                               records, augment)
+                for thread_id in range(num_threads)]
+    if is_training:
+        return tf.train.shuffle_batch_join(
+            examples, batch_size=batch_size,
+            capacity=min_after_dequeue + prefetch * batch_size,
+            min_after_dequeue=min_after_dequeue)
+    return tf.train.batch_join(examples, batch_size=batch_size,
+                               capacity=prefetch * batch_size)
+
+
+def input_pipeline(TXTs, batch_size, shape, is_training=False, **kwargs):
+    """Parallel version of tfpipeline.input_pipeline."""
+    img_batch, locs = batch_examples(TXTs, batch_size, shape, is_training,
+                                     distort=is_training, **kwargs)
+    return img_batch, landmark_maps(locs, shape=[64, 64], radius=3)
+
+
+def input_pipeline_local(TXTs, batch_size, shape, is_training=False, **kwargs):
+    """Parallel version of tfpipeline.input_pipeline_local."""
+    img_batch, locs = batch_examples(TXTs, batch_size, shape, is_training,
+                                     distort=is_training, **kwargs)
+    return img_batch, landmark_maps(locs, shape=[64, 64], radius=3), locs
+
+
+def input_pipeline_reg(TXTs, batch_size, shape, is_training=False, **kwargs):
+    """Parallel version of tfpipeline.input_pipeline_reg."""
+    return batch_examples(TXTs, batch_size, shape, is_training, **kwargs)
+
+
+def input_pipeline_reg_test(TXTs, batch_size, shape, is_training=False,
+                            **kwargs):
+    """Parallel version of tfpipeline.input_pipeline_reg_test."""
+    kwargs.setdefault('deterministic', True)
+    return batch_examples(TXTs, batch_size, shape, is_training, **kwargs)
+
+
+def input_pipeline_records(files, batch_size, shape, is_training=False,
+                           **kwargs):
+    """Image / landmark batches from TFRecord shards, same return values as
+    input_pipeline_reg."""
+    return batch_examples(files, batch_size, shape, is_training, records=True,
+                          **kwargs)
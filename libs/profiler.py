@@ -0,0 +1,239 @@
+"""Step-time instrumentation for the training loops.
+
+StepProfiler splits the wall time of every training step into
+
+    dequeue   sess.run(batch) for loops that pull batches to NumPy
+    compute   the training sess.run calls
+    host      everything else: feeding, Python, plotting, checkpoints
+
+and samples the fill level of every queue runner's queue, so a starved
+input pipeline (empty queues, high dequeue time) can be told apart from a
+compute-bound one (full queues).  Loops whose model reads the pipeline
+tensors directly wait for the queue inside the compute sess.run; on traced
+steps that wait is read from the QueueDequeue ops of the RunMetadata.
+
+Averages are reported at most every `report_every` steps and `min_interval`
+seconds, printed and, with a `logdir`, appended to logdir/profile.log as
+JSON lines and written as TensorBoard scalars.  With `trace_every` a Chrome
+trace (chrome://tracing) of one step is written to logdir every so often.
+
+    prof = StepProfiler(sess, 'logs/profile', trace_every=1000)
+    tf.get_default_graph().finalize()
+    ...
+    while training:
+        xs = prof.run_batch(batch)
+        cost = prof.run([ae['cost'], optimizer], feed_dict={...})[0]
+        prof.step(cost=cost)
+    prof.close()
+"""
+import os
+import json
+import time
+import contextlib
+import collections
+import numpy as np
+import tensorflow as tf
+from tensorflow.python.client import timeline
+
+
+def _capacity(queue):
+    try:
+        return queue.queue_ref.op.get_attr('capacity')
+    except ValueError:
+        return None
+
+
+class StepProfiler(object):
+    """Per-step timing, queue fill levels and Chrome traces.
+
+    Must be created before the graph is finalized, it adds a size op for
+    every queue.
+
+    Parameters
+    ----------
+    sess : tf.Session
+        Training session.
+    logdir : str, optional
+        Directory for profile.log, TensorBoard events and traces.  Nothing
+        is written when None.
+    report_every : int, optional
+        Least number of steps between reports.
+    min_interval : float, optional
+        Least number of seconds between reports.
+    trace_every : int, optional
+        Write a Chrome trace of every `trace_every`-th step, 0 disables.
+    queue_every : int, optional
+        Sample the queue sizes every `queue_every` steps, 0 disables.
+    queues : list, optional
+        Queues to watch, defaults to those of all queue runners.
+    verbose : bool, optional
+        Print the reports.
+    """
+
+    def __init__(self, sess, logdir=None, report_every=100, min_interval=10.0,
+                 trace_every=0, queue_every=10, queues=None, verbose=True):
+        self.sess = sess
+        self.logdir = logdir
+        self.report_every = report_every
+        self.min_interval = min_interval
+        self.trace_every = trace_every if logdir else 0
+        self.queue_every = queue_every
+        self.verbose = verbose
+
+        if queues is None:
+            queues = [qr.queue for qr in
+                      tf.get_collection(tf.GraphKeys.QUEUE_RUNNERS)]
+        self.queue_names = [q.name for q in queues]
+        self.capacities = [_capacity(q) for q in queues]
+        self.queue_sizes = [q.size() for q in queues]
+
+        self.log = None
+        self.writer = None
+        if logdir:
+            if not os.path.exists(logdir):
+                os.makedirs(logdir)
+            self.log = open(os.path.join(logdir, 'profile.log'), 'a')
+            self.writer = tf.summary.FileWriter(logdir)
+
+        self.step_i = 0
+        self.step_start = None
+        self.current = {'dequeue': 0.0, 'compute': 0.0}
+        self.run_metadata = None
+        self._reset()
+
+    def _reset(self):
+        self.window = collections.defaultdict(list)
+        self.last_report = time.time()
+        self.window_steps = 0
+
+    @contextlib.contextmanager
+    def _timed(self, kind):
+        t = time.time()
+        if self.step_start is None:
+            self.step_start = t
+        try:
+            yield
+        finally:
+            self.current[kind] += time.time() - t
+
+    def dequeue(self):
+        """Context timing a wait for input."""
+        return self._timed('dequeue')
+
+    def compute(self):
+        """Context timing a training sess.run."""
+        return self._timed('compute')
+
+    def run_batch(self, fetches, feed_dict=None):
+        """sess.run of pipeline outputs, timed as dequeue."""
+        with self.dequeue():
+            return self.sess.run(fetches, feed_dict=feed_dict)
+
+    def run(self, fetches, feed_dict=None):
+        """sess.run timed as compute, traced when a trace is due."""
+        kwargs = {}
+        # the first training sess.run of every trace_every-th step
+        if self.trace_every and self.run_metadata is None and \
+                (self.step_i + 1) % self.trace_every == 0:
+            self.run_metadata = tf.RunMetadata()
+            kwargs = {'options': tf.RunOptions(
+                          trace_level=tf.RunOptions.FULL_TRACE),
+                      'run_metadata': self.run_metadata}
+        with self.compute():
+            return self.sess.run(fetches, feed_dict=feed_dict, **kwargs)
+
+    def step(self, **scalars):
+        """End a step.
+
+        Parameters
+        ----------
+        **scalars
+            Values averaged into the report, e.g. cost=train_cost.
+        """
+        now = time.time()
+        if self.step_start is None:
+            self.step_start = now
+        wall = now - self.step_start
+        self.step_start = now
+        self.step_i += 1
+        self.window_steps += 1
+
+        window = self.window
+        window['step_ms'].append(wall * 1000)
+        window['dequeue_ms'].append(self.current['dequeue'] * 1000)
+        window['compute_ms'].append(self.current['compute'] * 1000)
+        window['host_ms'].append(
+            max(wall - self.current['dequeue'] - self.current['compute'],
+                0.0) * 1000)
+        self.current = {'dequeue': 0.0, 'compute': 0.0}
+        for name, value in scalars.items():
+            window[name].append(float(value))
+
+        if self.run_metadata is not None:
+            self._trace(self.run_metadata)
+            self.run_metadata = None
+        if self.queue_every and self.queue_sizes and \
+                self.step_i % self.queue_every == 0:
+            self._sample_queues()
+
+        if self.window_steps >= self.report_every and \
+                now - self.last_report >= self.min_interval:
+            self.report(now)
+
+    def _sample_queues(self):
+        sizes = self.sess.run(self.queue_sizes)
+        for name, capacity, size in zip(self.queue_names, self.capacities,
+                                        sizes):
+            fill = size / float(capacity) if capacity else size
+            self.window['queue/' + name].append(fill)
+
+    def _trace(self, run_metadata):
+        dequeue_us = 0
+        for device in run_metadata.step_stats.dev_stats:
+            for node in device.node_stats:
+                if 'QueueDequeue' in node.timeline_label:
+                    dequeue_us += node.op_end_rel_micros
+        self.window['in_graph_dequeue_ms'].append(dequeue_us / 1000.0)
+        trace = timeline.Timeline(run_metadata.step_stats)
+        path = os.path.join(self.logdir, 'timeline_%08d.json' % self.step_i)
+        with open(path, 'w') as f:
+            f.write(trace.generate_chrome_trace_format())
+
+    def report(self, now=None):
+        """Write and reset the averages of the steps since the last report.
+
+        Returns
+        -------
+        record : dict
+            The averaged values.
+        """
+        now = now or time.time()
+        elapsed = now - self.last_report
+        record = {'step': self.step_i,
+                  'steps_per_sec': self.window_steps / max(elapsed, 1e-9)}
+        for name, values in self.window.items():
+            record[name] = float(np.mean(values))
+        if self.verbose:
+            print(' '.join(
+                ['%d' % self.step_i] +
+                ['%s: %.4g' % (name, record[name])
+                 for name in sorted(record) if name != 'step']))
+        if self.log is not None:
+            self.log.write(json.dumps(record) + '\n')
+            self.log.flush()
+        if self.writer is not None:
+            self.writer.add_summary(tf.Summary(value=[
+                tf.Summary.Value(tag='profile/' + name, simple_value=value)
+                for name, value in record.items() if name != 'step']),
+                self.step_i)
+        self._reset()
+        return record
+
+    def close(self):
+        """Report the remaining steps and close the outputs."""
+        if self.window_steps:
+            self.report()
+        if self.log is not None:
+            self.log.close()
+        if self.writer is not None:
+            self.writer.close()
@@ -0,0 +1,124 @@
+"""Gradients that recompute activations instead of keeping them.
+
+A model marks blocks of its graph as segments, each (inputs, output).  The
+forward pass is unchanged, but recompute_gradients does not differentiate
+the original ops of a segment: in the backward pass every segment is copied
+(tf.contrib.graph_editor) from its stop_gradient'ed inputs and the copy is
+differentiated instead.  Only the segment outputs (and the outputs of
+stateful ops, see below) stay alive between the forward and the backward
+pass; the activations inside a segment are recomputed one segment at a time,
+for roughly one extra forward pass worth of FLOPs.
+
+Stateful ops are never copied: random ops (dropout masks, the variational
+noise) must give the backward pass the values the forward pass used, and
+variables, queues and assignments must not run twice.  Their outputs are
+used as they are.
+
+Segments with no variable of var_list in or above them are not recomputed
+at all, so with only the align head trained (the align_only variants)
+recompute_gradients costs the same as compute_gradients.
+
+Everything downstream of the segments (the tail, e.g. the align head and the
+loss) is differentiated normally.  The tail must read the segment outputs
+through its own tf.identity ops, `tail_inputs`, so that differentiating it
+does not walk back into the segments' original ops.
+"""
+import tensorflow as tf
+from tensorflow.contrib import graph_editor as ge
+
+
+def _segment_ops(inputs, output):
+    """Non-stateful ops between `inputs` and `output`, and every op the
+    output depends on without going through `inputs`."""
+    backward = ge.get_backward_walk_ops([output.op], stop_at_ts=inputs)
+    consumers = [op for t in inputs for op in t.consumers()]
+    forward = set(ge.get_forward_walk_ops(consumers))
+    ops = [op for op in backward
+           if op in forward and not op.op_def.is_stateful]
+    return ops, backward
+
+
+def _segment_variables(var_list, ops):
+    ops = set(ops)
+    return [v for v in var_list if v.op in ops]
+
+
+def _add(grads, t, g):
+    if g is None:
+        return
+    grads[t] = g if t not in grads else grads[t] + g
+
+
+def recompute_gradients(cost, segments, tail_inputs, var_list=None):
+    """compute_gradients of `cost`, recomputing the segments' activations.
+
+    Parameters
+    ----------
+    cost : tf.Tensor
+        Scalar to differentiate.
+    segments : list of (list of tf.Tensor, tf.Tensor)
+        (inputs, output) of every recomputed block, in forward order.  An
+        input is either the output of an earlier segment or a tensor that
+        needs no gradient (e.g. the images).
+    tail_inputs : list of tf.Tensor
+        tf.identity of segment outputs, the only way the tail reads them.
+    var_list : list of tf.Variable, optional
+        Defaults to the trainable variables.
+
+    Returns
+    -------
+    grads_and_vars : list of (tf.Tensor, tf.Variable)
+        Same as optimizer.compute_gradients, None for unused variables.
+    """
+    if var_list is None:
+        var_list = tf.trainable_variables()
+    var_grads = {}
+    grads = {}
+
+    # segment outputs with a variable of var_list in or above their
+    # segment; only those need a gradient, e.g. none when only the tail
+    # (the align head) is trained
+    seg_vars = {}
+    trained = set()
+    for inputs, output in segments:
+        seg_vars[output] = _segment_variables(
+            var_list, _segment_ops(inputs, output)[1])
+        if seg_vars[output] or any(t in trained for t in inputs):
+            trained.add(output)
+
+    # the tail, stopping at the identities of the segment outputs
+    _, tail_ops = _segment_ops(tail_inputs, cost)
+    tail_vars = _segment_variables(var_list, tail_ops)
+    tail_inputs = [t for t in tail_inputs if t.op.inputs[0] in trained]
+    tail_grads = tf.gradients(cost, tail_inputs + tail_vars)
+    for t, g in zip(tail_inputs, tail_grads[:len(tail_inputs)]):
+        _add(grads, t.op.inputs[0], g)
+    for v, g in zip(tail_vars, tail_grads[len(tail_inputs):]):
+        _add(var_grads, v, g)
+
+    for inputs, output in reversed(segments):
+        if output not in grads:
+            continue
+        ops, _ = _segment_ops(inputs, output)
+        with tf.name_scope('recompute'):
+            stopped = {t: tf.stop_gradient(t) for t in inputs}
+            _, info = ge.copy_with_input_replacements(ge.sgv(ops), stopped)
+        copied = [info.transformed(op) for op in ops]
+        copied_output = info.transformed(output)
+        # recompute only once the gradient reaches this segment
+        copied_set = set(copied)
+        for op in copied:
+            if not any(t.op in copied_set for t in op.inputs):
+                ge.add_control_inputs(op, [grads[output].op])
+
+        needed = [t for t in inputs if t in trained]
+        seg_grads = tf.gradients(copied_output,
+                                 [stopped[t] for t in needed] +
+                                 seg_vars[output],
+                                 grad_ys=grads[output])
+        for t, g in zip(needed, seg_grads[:len(needed)]):
+            _add(grads, t, g)
+        for v, g in zip(seg_vars[output], seg_grads[len(needed):]):
+            _add(var_grads, v, g)
+
+    return [(var_grads.get(v), v) for v in var_list]
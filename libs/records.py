@@ -0,0 +1,102 @@
+"""Sharded TFRecord version of the 300-W list files.
+
+Each record holds the raw uint8 pixels of one image and its landmarks as
+float32, so the input pipeline reads a handful of large files sequentially
+instead of parsing 137 text fields and opening one PNG per example.
+"""
+import os
+import numpy as np
+import tensorflow as tf
+from libs.heatmap_cache import read_landmark_list
+
+
+def record_files(prefix, n_shards):
+    """Shard file names for `prefix`."""
+    return ['%s-%05d-of-%05d.tfrecords' % (prefix, i, n_shards)
+            for i in range(n_shards)]
+
+
+def decode_pngs(names, channels=1):
+    """Decode PNG files to uint8 arrays with the same decoder as the
+    pipelines.
+
+    Parameters
+    ----------
+    names : list of str
+        Image paths.
+    channels : int, optional
+        Number of channels to decode to.
+
+    Yields
+    ------
+    img : np.ndarray
+        H x W x channels uint8 image.
+    """
+    g = tf.Graph()
+    with g.as_default():
+        contents = tf.placeholder(tf.string)
+        img = tf.image.decode_png(contents, channels=channels)
+        with tf.Session(graph=g) as sess:
+            for name in names:
+                with open(name, 'rb') as f:
+                    yield sess.run(img, feed_dict={contents: f.read()})
+
+
+def write_records(txt, prefix=None, n_shards=16, shape=[128, 128, 1]):
+    """Convert a 300-W list file into `n_shards` TFRecord files.
+
+    Lines are distributed round-robin, so every shard covers the whole list
+    and shards can be read in parallel.
+
+    Parameters
+    ----------
+    txt : str
+        300-W list file.
+    prefix : str, optional
+        Output prefix, defaults to `txt` without its extension.
+    n_shards : int, optional
+        Number of output files.
+    shape : list, optional
+        Expected [height, width, channels] of every image.
+
+    Returns
+    -------
+    files : list of str
+        The written shards.
+    """
+    prefix = prefix or os.path.splitext(txt)[0]
+    names, landmarks = read_landmark_list(txt)
+    files = record_files(prefix, n_shards)
+    writers = [tf.python_io.TFRecordWriter(f + '.tmp') for f in files]
+    for i, img in enumerate(decode_pngs(names, channels=shape[2])):
+        if list(img.shape) != list(shape):
+            raise ValueError('%s has shape %s, expected %s' % (
+                names[i], img.shape, shape))
+        example = tf.train.Example(features=tf.train.Features(feature={
+            'image': tf.train.Feature(bytes_list=tf.train.BytesList(
+                value=[img.tobytes()])),
+            'landmarks': tf.train.Feature(float_list=tf.train.FloatList(
+                value=landmarks[i].astype(np.float32).tolist()))}))
+        writers[i % n_shards].write(example.SerializeToString())
+        if i % 1000 == 0:
+            print('converted %d/%d' % (i, len(names)), end='\r')
+    for writer, f in zip(writers, files):
+        writer.close()
+        os.rename(f + '.tmp', f)
+    print('\nwrote %d examples to %d shards' % (len(names), n_shards))
+    return files
+
+
+def parse_record(serialized, shape, n_landmarks=68):
+    """Parse one serialized record.
+
+    Returns
+    -------
+    img, landmarks : tf.Tensor, tf.Tensor
+        `shape` uint8 image and [2 * n_landmarks] float32 landmarks.
+    """
+    features = tf.parse_single_example(serialized, features={
+        'image': tf.FixedLenFeature([], tf.string),
+        'landmarks': tf.FixedLenFeature([n_landmarks * 2], tf.float32)})
+    img = tf.reshape(tf.decode_raw(features['image'], tf.uint8), shape)
+    return img, features['landmarks']
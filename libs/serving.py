@@ -0,0 +1,255 @@
+"""Landmark inference service around a frozen aligner (libs.export).
+
+Requests are decoded and standardized by a thread pool, then coalesced by a
+DynamicBatcher into batches of up to `max_batch` images, waiting at most
+`max_latency` seconds for a batch to fill, so concurrent clients share one
+forward pass.  serve() exposes it over HTTP:
+
+    POST /predict   body: PNG bytes       -> {"landmarks": [[x, y], ...]}
+    POST /predict   body: .npy N x H x W x C uint8 array
+                                          -> {"landmarks": N x 68 x 2}
+    GET  /stats                           -> latency / throughput counters
+"""
+import io
+import json
+import time
+import threading
+import collections
+from concurrent.futures import Future
+from concurrent.futures import ThreadPoolExecutor
+from http.server import BaseHTTPRequestHandler
+from http.server import HTTPServer
+from socketserver import ThreadingMixIn
+import queue
+import numpy as np
+import tensorflow as tf
+from libs.dataset_utils import standardize_images
+from libs.export import LandmarkPredictor
+
+
+class DynamicBatcher(object):
+    """Coalesce concurrent predict calls into batched ones.
+
+    Parameters
+    ----------
+    predict_fn : callable
+        N x ... array -> N x ... array, e.g. LandmarkPredictor.predict.
+    max_batch : int, optional
+        Largest batch passed to `predict_fn`.
+    max_latency : float, optional
+        Seconds to wait for more requests once the first one arrived.
+    history : int, optional
+        Number of request latencies kept for the percentiles.
+    """
+
+    def __init__(self, predict_fn, max_batch=32, max_latency=0.005,
+                 history=10000):
+        self.predict_fn = predict_fn
+        self.max_batch = max_batch
+        self.max_latency = max_latency
+        self.requests = queue.Queue()
+        self.latencies = collections.deque(maxlen=history)
+        self.n_images = 0
+        self.n_batches = 0
+        self.started = time.time()
+        self.lock = threading.Lock()
+        self.thread = threading.Thread(target=self._loop, name='batcher')
+        self.thread.daemon = True
+        self.thread.start()
+
+    def submit(self, images):
+        """Queue N images, returns a Future of their N predictions."""
+        future = Future()
+        self.requests.put((np.asarray(images), future, time.time()))
+        return future
+
+    def predict(self, images):
+        """Predictions of N images, split into requests of at most
+        `max_batch`."""
+        futures = [self.submit(images[i:i + self.max_batch])
+                   for i in range(0, len(images), self.max_batch)]
+        return np.concatenate([f.result() for f in futures])
+
+    def _loop(self):
+        pending = None
+        while True:
+            batch = [pending or self.requests.get()]
+            pending = None
+            size = len(batch[0][0])
+            deadline = time.time() + self.max_latency
+            while size < self.max_batch:
+                timeout = deadline - time.time()
+                if timeout <= 0:
+                    break
+                try:
+                    request = self.requests.get(timeout=timeout)
+                except queue.Empty:
+                    break
+                if size + len(request[0]) > self.max_batch:
+                    pending = request
+                    break
+                batch.append(request)
+                size += len(request[0])
+            self._run(batch)
+
+    def _run(self, batch):
+        try:
+            preds = self.predict_fn(np.concatenate([r[0] for r in batch]))
+        except Exception as e:
+            if len(batch) > 1:
+                # one bad request must not fail the others, retry alone
+                for request in batch:
+                    self._run([request])
+                return
+            batch[0][1].set_exception(e)
+            return
+        now = time.time()
+        start = 0
+        with self.lock:
+            for images, future, t in batch:
+                future.set_result(preds[start:start + len(images)])
+                start += len(images)
+                self.latencies.append(now - t)
+            self.n_images += start
+            self.n_batches += 1
+
+    def stats(self):
+        """p50 / p99 request latency (ms), images/sec and mean batch size."""
+        with self.lock:
+            latencies = np.asarray(self.latencies) * 1000
+            elapsed = time.time() - self.started
+            stats = {'requests': len(latencies),
+                     'images': self.n_images,
+                     'batches': self.n_batches,
+                     'images_per_sec': self.n_images / elapsed,
+                     'mean_batch': self.n_images / max(self.n_batches, 1)}
+        if len(latencies):
+            stats['p50_ms'] = float(np.percentile(latencies, 50))
+            stats['p99_ms'] = float(np.percentile(latencies, 99))
+        return stats
+
+
+class PngDecoder(object):
+    """Thread-safe PNG bytes -> standardized H x W x C float32 image."""
+
+    def __init__(self, shape=[128, 128, 1]):
+        self.graph = tf.Graph()
+        with self.graph.as_default():
+            self.contents = tf.placeholder(tf.string)
+            img = tf.image.decode_png(self.contents, channels=shape[2])
+            img = tf.image.resize_images(img, shape[:2])
+            self.img = tf.image.per_image_standardization(img)
+        self.graph.finalize()
+        self.sess = tf.Session(graph=self.graph)
+
+    def __call__(self, contents):
+        return self.sess.run(self.img, feed_dict={self.contents: contents})
+
+
+class LandmarkService(object):
+    """Decode pool + dynamic batcher + frozen aligner.
+
+    Parameters
+    ----------
+    path : str
+        Frozen graph from export_aligner.
+    max_batch, max_latency : optional
+        See DynamicBatcher.
+    decode_threads : int, optional
+        Threads decoding and standardizing request images.
+    shape : list, optional
+        [H, W, C] the aligner takes, .npy requests must match it.
+    """
+
+    def __init__(self, path, max_batch=32, max_latency=0.005,
+                 decode_threads=4, shape=[128, 128, 1]):
+        self.shape = list(shape)
+        config = tf.ConfigProto(inter_op_parallelism_threads=2)
+        self.predictor = LandmarkPredictor(path, config=config)
+        self.batcher = DynamicBatcher(
+            lambda x: self.predictor.predict(x, standardized=True),
+            max_batch, max_latency)
+        self.decoder = PngDecoder(self.shape)
+        self.pool = ThreadPoolExecutor(decode_threads)
+
+    def _standardize(self, body):
+        if body[:6] == b'\x93NUMPY':
+            images = np.load(io.BytesIO(body), allow_pickle=False)
+            if images.dtype != np.uint8 or images.ndim != 4 or \
+                    list(images.shape[1:]) != self.shape or not len(images):
+                raise ValueError('expected N x %s uint8 images, got %s %s' % (
+                    ' x '.join(map(str, self.shape)), images.dtype,
+                    ' x '.join(map(str, images.shape))))
+            return standardize_images(images)
+        return self.decoder(body)[None]
+
+    def predict(self, body):
+        """PNG or .npy request body -> N x 68 x 2 landmarks."""
+        images = self.pool.submit(self._standardize, body).result()
+        return self.batcher.predict(images)
+
+
+def make_handler(service):
+
+    class Handler(BaseHTTPRequestHandler):
+
+        def _reply(self, code, obj):
+            body = json.dumps(obj).encode()
+            self.send_response(code)
+            self.send_header('Content-Type', 'application/json')
+            self.send_header('Content-Length', str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+        def do_GET(self):
+            if self.path == '/stats':
+                self._reply(200, service.batcher.stats())
+            else:
+                self._reply(404, {'error': 'not found'})
+
+        def do_POST(self):
+            if self.path != '/predict':
+                return self._reply(404, {'error': 'not found'})
+            if self.headers['Content-Length'] is None:
+                return self._reply(411, {'error': 'Content-Length required'})
+            try:
+                body = self.rfile.read(int(self.headers['Content-Length']))
+                landmarks = service.predict(body)
+            except Exception as e:
+                return self._reply(400, {'error': str(e)})
+            if body[:6] != b'\x93NUMPY':
+                landmarks = landmarks[0]
+            self._reply(200, {'landmarks': landmarks.tolist()})
+
+        def log_message(self, *args):
+            pass
+
+    return Handler
+
+
+class ThreadingHTTPServer(ThreadingMixIn, HTTPServer):
+    daemon_threads = True
+
+
+def serve(path, host='127.0.0.1', port=8000, **kwargs):
+    """Serve a frozen aligner over HTTP until interrupted.
+
+    Parameters
+    ----------
+    path : str
+        Frozen graph from export_aligner.
+    host, port : optional
+        Address to listen on.
+    **kwargs
+        LandmarkService arguments.
+    """
+    service = LandmarkService(path, **kwargs)
+    server = ThreadingHTTPServer((host, port), make_handler(service))
+    print('serving %s on http://%s:%d' % (path, host, port))
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+        print(json.dumps(service.batcher.stats()))
@@ -27,6 +27,78 @@ def genMultipleMaps(landmarks, shape, radius):
     ret = [f(landmark) for landmark in landmarks]
     return np.asarray(ret).swapaxes(0,1).swapaxes(1,2)
 
+def genBatchMaps(landmarks, shape, radius):
+    """Vectorized version of genMultipleMaps for a whole batch.
+
+    Produces exactly the same disks as genOneMap (same truncation, same
+    out-of-range rule) with one broadcasted comparison instead of a Python
+    loop per landmark.
+
+    Parameters
+    ----------
+    landmarks : np.ndarray
+        N x 2K (or 2K for a single example) normalized (x, y) pairs.
+    shape : list
+        [H, W] of the output maps.
+    radius : int
+        Disk radius in pixels.
+
+    Returns
+    -------
+    maps : np.ndarray
+        N x H x W x K float32 binary maps (H x W x K for a single example).
+    """
+    landmarks = np.asarray(landmarks, dtype=np.float64)
+    single = landmarks.ndim == 1
+    pts = landmarks.reshape((-1, landmarks.shape[-1] // 2, 2))
+    # int() truncates towards zero, and so does astype
+    x = (pts[:, :, 0] * shape[1]).astype(np.int64)[:, None, None, :]
+    y = (pts[:, :, 1] * shape[0]).astype(np.int64)[:, None, None, :]
+    valid = (x >= -2) & (y >= -2) & (x <= shape[1] + 1) & (y <= shape[0] + 1)
+    xs = np.arange(shape[1]).reshape((1, 1, -1, 1))
+    ys = np.arange(shape[0]).reshape((1, -1, 1, 1))
+    ret = (((xs - x) ** 2 + (ys - y) ** 2 <= radius ** 2) & valid)
+    ret = ret.astype(np.float32)
+    return ret[0] if single else ret
+
+def landmark_maps(landmarks, shape=[64, 64], radius=3, name='landmark_maps'):
+    """Graph op equivalent of genBatchMaps.
+
+    Runs entirely in the TF runtime, so the input threads are not serialized
+    on the Python GIL the way tf.py_func(genMultipleMaps) is.
+
+    Parameters
+    ----------
+    landmarks : tf.Tensor
+        [2K] or [N, 2K] normalized (x, y) pairs, K must be known statically.
+    shape : list
+        [H, W] of the output maps.
+    radius : int
+        Disk radius in pixels.
+
+    Returns
+    -------
+    maps : tf.Tensor
+        [H, W, K] or [N, H, W, K] float32 binary maps.
+    """
+    with tf.name_scope(name):
+        landmarks = tf.to_float(landmarks)
+        single = landmarks.get_shape().ndims == 1
+        n_landmarks = landmarks.get_shape().as_list()[-1] // 2
+        pts = tf.reshape(landmarks, [-1, 1, 1, n_landmarks, 2])
+        x = tf.cast(pts[:, :, :, :, 0] * shape[1], tf.int32)
+        y = tf.cast(pts[:, :, :, :, 1] * shape[0], tf.int32)
+        valid = tf.logical_and(
+            tf.logical_and(x >= -2, y >= -2),
+            tf.logical_and(x <= shape[1] + 1, y <= shape[0] + 1))
+        xs = tf.reshape(tf.range(shape[1]), [1, 1, -1, 1])
+        ys = tf.reshape(tf.range(shape[0]), [1, -1, 1, 1])
+        dist = tf.square(xs - x) + tf.square(ys - y)
+        maps = tf.to_float(tf.logical_and(dist <= radius ** 2, valid))
+        if single:
+            maps = tf.reshape(maps, shape + [n_landmarks])
+        return maps
+
 def genLandmarkMap(landmarks, shape=[39, 39], radius=1):
     '''Generate landmark map according to landmarks.
     Input params:
@@ -72,7 +144,14 @@ def processImage(img):
     img = (img - m) / s
     return img
 
-def input_pipeline(TXTs, batch_size, shape, is_training=False):
+def input_pipeline(TXTs, batch_size, shape, is_training=False, sparse=False):
+    """Image / landmark map batches from 300-W list files.
+
+    With sparse=True only the 2K landmark coordinates go through the batch
+    queue and the dense maps are rendered for the whole batch by a single
+    landmark_maps op on the dequeue side, instead of queueing a
+    64 x 64 x 68 volume per example.
+    """
 
     filename_queue = tf.train.string_input_producer(TXTs, shuffle=is_training)
     reader = tf.TextLineReader()
@@ -85,9 +164,9 @@ def input_pipeline(TXTs, batch_size, shape, is_training=False):
     if is_training:
         img_reshape = distort_color(img_reshape)
     float_image = tf.image.per_image_standardization(img_reshape)
-    landmarkMap = tf.py_func(partial(genMultipleMaps, shape=[64, 64], radius=3), [features], [tf.float64])[0]
-    landmarkMap.set_shape([64, 64, 68])
-    landmarkMap = tf.to_float(landmarkMap)
+    features = tf.stack(features)
+    if not sparse:
+        landmarkMap = landmark_maps(features, shape=[64, 64], radius=3)
     # if is_training:
     #     float_image = distort_color(float_image)
     # img_batch, label_batch = tf.train.batch([float_image, features], batch_size=batch_size)
@@ -105,10 +184,80 @@ def input_pipeline(TXTs, batch_size, shape, is_training=False):
     #                                capacity=capacity,
     #                                min_after_dequeue=min_after_dequeue,
     #                                num_threads=2)
-    img_batch, label_batch = tf.train.batch([float_image, landmarkMap], batch_size=batch_size)
+    if sparse:
+        img_batch, locs = tf.train.batch([float_image, features], batch_size=batch_size)
+        label_batch = landmark_maps(locs, shape=[64, 64], radius=3)
+    else:
+        img_batch, label_batch = tf.train.batch([float_image, landmarkMap], batch_size=batch_size)
     return img_batch, label_batch
     
-def input_pipeline_local(TXTs, batch_size, shape, is_training=False):
+def unpack_maps(packed, n_landmarks=68, name='unpack_maps'):
+    """Graph op equivalent of np.unpackbits(packed, axis=-1)[..., :K].
+
+    Every byte is looked up in a 256 x 8 table, so a whole batch of
+    bit-packed maps is unpacked by one gather.
+
+    Parameters
+    ----------
+    packed : tf.Tensor
+        N x H x W x ceil(K / 8) uint8 maps, as written by
+        build_heatmap_cache.
+    n_landmarks : int, optional
+        K, number of maps kept.
+
+    Returns
+    -------
+    maps : tf.Tensor
+        N x H x W x K float32 binary maps.
+    """
+    bits = np.unpackbits(np.arange(256, dtype=np.uint8)[:, None], axis=1)
+    with tf.name_scope(name):
+        maps = tf.gather(tf.constant(bits.astype(np.float32)),
+                         tf.to_int32(packed))
+        h, w, n_bytes = packed.get_shape().as_list()[1:]
+        return tf.reshape(maps, [-1, h, w, n_bytes * 8])[:, :, :, :n_landmarks]
+
+def input_pipeline_cached(TXTs, batch_size, shape, is_training=False,
+                          cache_paths=None):
+    """Same as input_pipeline, but reads the landmark maps from the caches
+    written by libs.heatmap_cache.build_heatmap_cache instead of rendering
+    them.  A FixedLengthRecordReader reads the packed row of every line in
+    step with the TextLineReader: one queue runner hands both readers the
+    list and its cache together, both return one record per line and the
+    single thread of tf.train.batch runs both reads once per example.  Maps
+    travel through the queue packed and are unpacked once per batch."""
+    from libs.heatmap_cache import HeatmapCache
+    cache = HeatmapCache(TXTs, cache_paths, shape=[64, 64])
+
+    # one (list, cache) pair per file, fed to a queue per reader
+    txt, cache_path = tf.train.slice_input_producer(
+        [TXTs, cache.paths], shuffle=is_training)
+    txt_queue = tf.FIFOQueue(32, tf.string)
+    cache_queue = tf.FIFOQueue(32, tf.string)
+    tf.train.add_queue_runner(tf.train.QueueRunner(
+        txt_queue, [tf.group(txt_queue.enqueue(txt),
+                             cache_queue.enqueue(cache_path))]))
+
+    reader = tf.TextLineReader()
+    _, value = reader.read(txt_queue)
+    cache_reader = tf.FixedLengthRecordReader(
+        record_bytes=cache.record_bytes, header_bytes=cache.header_bytes)
+    _, row = cache_reader.read(cache_queue)
+    packed = tf.reshape(tf.decode_raw(row, tf.uint8),
+                        list(cache.shape) + [(cache.n_landmarks + 7) // 8])
+    img, features = read_my_file_format(value)
+    img.set_shape(shape)
+    img_reshape = tf.cast(img, tf.float32)
+    if is_training:
+        img_reshape = distort_color(img_reshape)
+    float_image = tf.image.per_image_standardization(img_reshape)
+    img_batch, packed_batch = tf.train.batch([float_image, packed], batch_size=batch_size)
+    return img_batch, unpack_maps(packed_batch, cache.n_landmarks)
+
+def input_pipeline_local(TXTs, batch_size, shape, is_training=False,
+                         sparse=False):
+    """Like input_pipeline, but also returns the landmark coordinates.
+    See input_pipeline for `sparse`."""
 
     filename_queue = tf.train.string_input_producer(TXTs, shuffle=is_training)
     reader = tf.TextLineReader()
@@ -121,9 +270,9 @@ def input_pipeline_local(TXTs, batch_size, shape, is_training=False):
     if is_training:
         img_reshape = distort_color(img_reshape)
     float_image = tf.image.per_image_standardization(img_reshape)
-    landmarkMap = tf.py_func(partial(genMultipleMaps, shape=[64, 64], radius=3), [features], [tf.float64])[0]
-    landmarkMap.set_shape([64, 64, 68])
-    landmarkMap = tf.to_float(landmarkMap)
+    features = tf.stack(features)
+    if not sparse:
+        landmarkMap = landmark_maps(features, shape=[64, 64], radius=3)
     # if is_training:
     #     float_image = distort_color(float_image)
     # img_batch, label_batch = tf.train.batch([float_image, features], batch_size=batch_size)
@@ -141,7 +290,11 @@ def input_pipeline_local(TXTs, batch_size, shape, is_training=False):
     #                                capacity=capacity,
     #                                min_after_dequeue=min_after_dequeue,
     #                                num_threads=2)
-    img_batch, label_batch, locs = tf.train.batch([float_image, landmarkMap, features], batch_size=batch_size)
+    if sparse:
+        img_batch, locs = tf.train.batch([float_image, features], batch_size=batch_size)
+        label_batch = landmark_maps(locs, shape=[64, 64], radius=3)
+    else:
+        img_batch, label_batch, locs = tf.train.batch([float_image, landmarkMap, features], batch_size=batch_size)
     return img_batch, label_batch, locs
 
 def input_pipeline_reg(TXTs, batch_size, shape, is_training=False):
@@ -0,0 +1,254 @@
+"""Data-parallel model replicas (towers) in one graph.
+
+Every tower builds the model on its own slice of one large input batch with
+the variables shared through variable scope reuse.  The gradients of the
+towers are averaged and applied once, so one step trains on
+n_towers * batch_size examples.  The towers have no data dependencies on each
+other and the session runs them concurrently on its inter-op thread pool
+(or on separate devices).
+
+    towers = build_towers(lambda batch: VAE_ALIGN1(..., batch=batch),
+                          parallel_pipeline.input_pipeline_reg(
+                              ..., batch_size=4 * 64), 4)
+    train_op, cost = minimize_towers(tf.train.AdamOptimizer(lr), towers)
+    sess.run([cost, train_op], feed_dict=tower_feed(
+        towers, {'train': True, 'keep_prob': 0.8}))
+
+accumulate_gradients goes the other way and spreads one update over several
+sess.run calls: the gradients of M micro-batches are summed into
+non-trainable accumulators and applied once, for M times the batch at the
+memory cost of one.
+
+Tower 0 is built in the caller's name scope and keeps the variable names of
+a single model, so checkpoints work either way.  The other towers get tower
+0's variables through a custom getter instead of reuse=True, because
+batch_norm's ExponentialMovingAverage.apply creates its averages with
+get_variable, which fails in a reusing scope.  So the batch norm moving
+averages are not shared: those of the other towers are named after their
+'tower_<i>' ops and are left out of checkpoints by checkpoint_variables().
+"""
+import tensorflow as tf
+from libs.recompute import recompute_gradients
+
+
+def split_batch(batch, n_towers):
+    """Slice every tensor of `batch` into `n_towers` equal parts.
+
+    Parameters
+    ----------
+    batch : list of tf.Tensor
+        Pipeline outputs with n_towers * batch_size rows.
+    n_towers : int
+        Number of slices.
+
+    Returns
+    -------
+    shards : list of list of tf.Tensor
+        One list of tensors per tower.
+    """
+    if n_towers == 1:
+        return [list(batch)]
+    size = batch[0].get_shape().as_list()[0] // n_towers
+    return [[t[i * size:(i + 1) * size] for t in batch]
+            for i in range(n_towers)]
+
+
+def build_towers(model_fn, batch, n_towers, devices=None):
+    """Build `n_towers` replicas of a model sharing variables.
+
+    Parameters
+    ----------
+    model_fn : callable
+        list of batch tensors -> model dict with a 'cost'.
+    batch : list of tf.Tensor
+        Pipeline outputs, split with split_batch.
+    n_towers : int
+        Number of replicas.
+    devices : list of str, optional
+        Device of every tower, e.g. ['/gpu:0', '/gpu:1'].
+
+    Returns
+    -------
+    towers : list of dict
+        The model dicts, towers[0] is the unscoped one.
+    """
+    towers = []
+    for i, shard in enumerate(split_batch(batch, n_towers)):
+        with tf.device(devices[i] if devices else None):
+            if i == 0:
+                towers.append(model_fn(shard))
+                continue
+            with tf.variable_scope(tf.get_variable_scope(),
+                                   custom_getter=_shared_getter()), \
+                    tf.name_scope('tower_%d' % i):
+                towers.append(model_fn(shard))
+    return towers
+
+
+def _shared_getter():
+    """get_variable getter returning the variables that already exist and
+    creating the rest (the tower's batch norm moving averages)."""
+    existing = {v.op.name: v for v in tf.global_variables()}
+
+    def getter(get, name, *args, **kwargs):
+        if name in existing:
+            return existing[name]
+        return get(name, *args, **kwargs)
+    return getter
+
+
+def average_gradients(tower_grads):
+    """Average (gradient, variable) lists of several towers.
+
+    Parameters
+    ----------
+    tower_grads : list of list of (tf.Tensor, tf.Variable)
+        optimizer.compute_gradients of every tower, same variable order.
+
+    Returns
+    -------
+    grads_and_vars : list of (tf.Tensor, tf.Variable)
+    """
+    if len(tower_grads) == 1:
+        return tower_grads[0]
+    averaged = []
+    for grads_and_vars in zip(*tower_grads):
+        var = grads_and_vars[0][1]
+        grads = [g for g, _ in grads_and_vars if g is not None]
+        if not grads:
+            averaged.append((None, var))
+            continue
+        averaged.append((tf.add_n(grads) / float(len(grads)), var))
+    return averaged
+
+
+def tower_gradients(optimizer, towers, var_list=None, devices=None):
+    """Averaged gradients and mean cost of all towers.
+
+    Towers with 'segments' (e.g. VAE_ALIGN1(recompute=True)) are
+    differentiated with recompute.recompute_gradients.
+
+    Parameters
+    ----------
+    optimizer : tf.train.Optimizer
+        Optimizer.
+    towers : list of dict
+        Output of build_towers.
+    var_list : list of tf.Variable, optional
+        Variables to train, defaults to all trainable ones.
+    devices : list of str, optional
+        Same as build_towers, the gradients are computed next to their tower.
+
+    Returns
+    -------
+    grads_and_vars : list of (tf.Tensor, tf.Variable)
+        Averaged gradients.
+    cost : tf.Tensor
+        Mean cost over the towers.
+    """
+    tower_grads = []
+    for i, tower in enumerate(towers):
+        with tf.device(devices[i] if devices else None):
+            if tower.get('segments'):
+                tower_grads.append(recompute_gradients(
+                    tower['cost'], tower['segments'], tower['tail_inputs'],
+                    var_list))
+            else:
+                tower_grads.append(optimizer.compute_gradients(
+                    tower['cost'], var_list=var_list))
+    cost = tf.add_n([t['cost'] for t in towers]) / float(len(towers))
+    return average_gradients(tower_grads), cost
+
+
+def minimize_towers(optimizer, towers, var_list=None, global_step=None,
+                    devices=None):
+    """One optimizer step on the averaged gradients of all towers.
+
+    Parameters
+    ----------
+    optimizer, towers, var_list, devices
+        See tower_gradients.
+    global_step : tf.Variable, optional
+        Incremented once per step.
+
+    Returns
+    -------
+    train_op : tf.Operation
+        Applies the averaged gradients.
+    cost : tf.Tensor
+        Mean cost over the towers.
+    """
+    grads_and_vars, cost = tower_gradients(optimizer, towers, var_list,
+                                           devices)
+    return optimizer.apply_gradients(grads_and_vars,
+                                     global_step=global_step), cost
+
+
+def accumulate_gradients(optimizer, grads_and_vars, n_steps,
+                         global_step=None):
+    """Apply the mean gradient of `n_steps` micro-batches at once.
+
+    The accumulators are local variables (tf.local_variables_initializer),
+    so they stay out of checkpoints.
+
+    Parameters
+    ----------
+    optimizer : tf.train.Optimizer
+        Optimizer.
+    grads_and_vars : list of (tf.Tensor, tf.Variable)
+        Gradients of one micro-batch, e.g. from tower_gradients.
+    n_steps : int
+        Micro-batches per update.
+    global_step : tf.Variable, optional
+        Incremented once per update.
+
+    Returns
+    -------
+    accumulate_op : tf.Operation
+        Adds the gradients of the current micro-batch, run once per
+        micro-batch.
+    apply_op : tf.Operation
+        Applies the mean of the accumulated gradients and resets them, run
+        after every `n_steps` accumulate_op.
+    """
+    grads_and_vars = [(g, v) for g, v in grads_and_vars if g is not None]
+    with tf.name_scope('accumulate'):
+        accumulators = [
+            tf.Variable(tf.zeros(v.get_shape(), v.dtype.base_dtype),
+                        trainable=False, name=v.op.name.replace('/', '_'),
+                        collections=[tf.GraphKeys.LOCAL_VARIABLES])
+            for _, v in grads_and_vars]
+        accumulate_op = tf.group(*[a.assign_add(g) for a, (g, _) in
+                                   zip(accumulators, grads_and_vars)])
+        update = optimizer.apply_gradients(
+            [(a / float(n_steps), v)
+             for a, (_, v) in zip(accumulators, grads_and_vars)],
+            global_step=global_step)
+        with tf.control_dependencies([update]):
+            apply_op = tf.group(*[a.assign(tf.zeros_like(a))
+                                  for a in accumulators])
+    return accumulate_op, apply_op
+
+
+def tower_feed(towers, values):
+    """feed_dict giving every tower's placeholders the same values.
+
+    Parameters
+    ----------
+    towers : list of dict
+        Output of build_towers.
+    values : dict
+        Model dict key -> value, e.g. {'train': True, 'keep_prob': 0.8}.
+
+    Returns
+    -------
+    feed_dict : dict
+    """
+    return {tower[key]: value
+            for tower in towers for key, value in values.items()}
+
+
+def checkpoint_variables():
+    """Global variables without the towers' private copies."""
+    return [v for v in tf.global_variables()
+            if 'tower_' not in v.op.name]
@@ -13,7 +13,9 @@ import numpy as np
 from numpy.linalg import norm
 import zipfile
 import os
+import contextlib
 from scipy.io import wavfile
+from libs import metrics
 
 
 def download(path):
@@ -567,6 +569,76 @@ def binary_cross_entropy(z, x, name=None):
                   (1. - x) * tf.log(1. - z + eps)))
 
 
+def as_compute(v, x):
+    """Cast a float32 master variable to the dtype of the activations `x`,
+    for mixed precision layers; a no-op in float32 graphs."""
+    return tf.cast(v, x.dtype.base_dtype)
+
+
+def dropout(x, keep_prob):
+    """tf.nn.dropout for activations of any dtype.  The mask is drawn in
+    float32, there are no bfloat16 random kernels, and cast to x's dtype.
+
+    Parameters
+    ----------
+    x : tf.Tensor
+        Activations.
+    keep_prob : tf.Tensor
+        float32 probability of keeping an element.
+
+    Returns
+    -------
+    dropped : tf.Tensor
+        Same dtype and shape as `x`.
+    """
+    if x.dtype.base_dtype == tf.float32:
+        return tf.nn.dropout(x, keep_prob)
+    keep_prob = tf.cast(keep_prob, tf.float32)
+    mask = tf.floor(keep_prob + tf.random_uniform(tf.shape(x))) / keep_prob
+    return x * tf.cast(mask, x.dtype.base_dtype)
+
+
+def check_compute_dtype(dtype, device=None):
+    """Raise ValueError if this TensorFlow build cannot run a Conv2D in
+    `dtype` (e.g. bfloat16 on a stock CPU build).
+
+    Parameters
+    ----------
+    dtype : tf.DType
+        Activation dtype, e.g. VAE_ALIGN1's compute_dtype.
+    device : str, optional
+        Device to check, defaults to the default placement.
+    """
+    if dtype == tf.float32:
+        return
+    with tf.Graph().as_default() as g, tf.device(device):
+        x = tf.zeros([1, 4, 4, 1], dtype)
+        y = tf.nn.conv2d(x, tf.zeros([3, 3, 1, 1], dtype), [1, 1, 1, 1],
+                         'SAME')
+        try:
+            with tf.Session(graph=g) as sess:
+                sess.run(y)
+        except (tf.errors.InvalidArgumentError,
+                tf.errors.NotFoundError) as e:
+            raise ValueError('compute_dtype=%s: this TensorFlow build has no '
+                             '%s Conv2D kernel (%s)' % (
+                                 dtype.name, dtype.name,
+                                 e.message.split('\n')[0]))
+
+
+def jit_scope(xla=True):
+    """Context marking the ops built inside it (and their gradients) for
+    XLA compilation, or doing nothing when `xla` is False.
+
+    The session's global_jit_level only clusters GPU ops; without
+    TF_XLA_FLAGS=--tf_xla_cpu_global_jit it leaves a CPU graph alone, while
+    ops in this scope are compiled on either device.
+    """
+    if xla:
+        return tf.contrib.compiler.jit.experimental_jit_scope()
+    return contextlib.ExitStack()
+
+
 def conv2d(x, n_output,
            k_h=5, k_w=5, d_h=2, d_w=2,
            padding='SAME', name='conv2d', reuse=None):
@@ -606,7 +678,7 @@ def conv2d(x, n_output,
         conv = tf.nn.conv2d(
             name='conv',
             input=x,
-            filter=W,
+            filter=as_compute(W, x),
             strides=[1, d_h, d_w, 1],
             padding=padding)
 
@@ -618,7 +690,7 @@ def conv2d(x, n_output,
         h = tf.nn.bias_add(
             name='h',
             value=conv,
-            bias=b)
+            bias=as_compute(b, x))
 
     return h, W
 
@@ -665,7 +737,7 @@ def deconv2d(x, n_output_h, n_output_w, n_output_ch, n_input_ch=None,
         conv = tf.nn.conv2d_transpose(
             name='conv_t',
             value=x,
-            filter=W,
+            filter=as_compute(W, x),
             output_shape=tf.stack(
                 [tf.shape(x)[0], n_output_h, n_output_w, n_output_ch]),
             strides=[1, d_h, d_w, 1],
@@ -678,7 +750,7 @@ def deconv2d(x, n_output_h, n_output_w, n_output_ch, n_input_ch=None,
             shape=[n_output_ch],
             initializer=tf.constant_initializer(0.0))
 
-        h = tf.nn.bias_add(name='h', value=conv, bias=b)
+        h = tf.nn.bias_add(name='h', value=conv, bias=as_compute(b, x))
 
     return h, W
 
@@ -741,8 +813,8 @@ def linear(x, n_output, name=None, activation=None, reuse=None):
 
         h = tf.nn.bias_add(
             name='h',
-            value=tf.matmul(x, W),
-            bias=b)
+            value=tf.matmul(x, as_compute(W, x)),
+            bias=as_compute(b, x))
 
         if activation:
             h = activation(h)
@@ -847,34 +919,106 @@ def getLocation(landmarkMaps, K=68):
     Output:
     locations: N x K x 2 float.'''
 
-    location = []
-    locations = []
-    for landmarkMap in landmarkMaps:
-        for i in range(K):
-            tmp = landmarkMap[:,:,i]
-            index = np.unravel_index(np.argsort(tmp, axis=None)[-10:][::-1], tmp.shape)
-            al = np.array(index)
-            al = al.mean(axis=1)
-            al = al / tmp.shape[0]
-            al = al[::-1]
-            location.append(al)
-        locations.append(np.array(location))
-        location = []
-    return np.array(locations)
+    return decode_heatmaps(np.asarray(landmarkMaps)[..., :K], mode='topk', k=10)
+
+def decode_heatmaps(landmarkMaps, mode='topk', k=10, beta=100.0):
+    '''Batched heatmap to coordinate decoder.
+    Input params:
+    landmarkMaps: N x H x W x K float
+    mode: 'topk' (mean position of the k highest pixels, what getLocation
+          has always done), 'softargmax' (softmax(beta * map) weighted
+          mean position) or 'quadratic' (argmax refined to sub-pixel
+          precision with a 1-D parabola fit along each axis)
+    Output:
+    locations: N x K x 2 float (x, y), normalized by W and H.'''
+
+    maps = np.asarray(landmarkMaps, dtype=np.float64)
+    n, h, w, n_landmarks = maps.shape
+    flat = maps.transpose((0, 3, 1, 2)).reshape((n, n_landmarks, h * w))
+    if mode == 'topk':
+        idx = np.argpartition(flat, -k, axis=-1)[..., -k:]
+        x = (idx % w).mean(axis=-1)
+        y = (idx // w).mean(axis=-1)
+    elif mode == 'softargmax':
+        p = np.exp(beta * (flat - flat.max(axis=-1, keepdims=True)))
+        p /= p.sum(axis=-1, keepdims=True)
+        x = (p * (np.arange(h * w) % w)).sum(axis=-1)
+        y = (p * (np.arange(h * w) // w)).sum(axis=-1)
+    elif mode == 'quadratic':
+        idx = flat.argmax(axis=-1)
+        col = idx % w
+        row = idx // w
+
+        def offset(center, pos, size, stride):
+            inner = (pos > 0) & (pos < size - 1)
+            lo = np.take_along_axis(flat, (idx - stride * inner)[..., None], -1)[..., 0]
+            hi = np.take_along_axis(flat, (idx + stride * inner)[..., None], -1)[..., 0]
+            denom = lo - 2 * center + hi
+            safe = inner & (denom < 0)
+            d = np.where(safe, 0.5 * (lo - hi) / np.where(safe, denom, 1), 0)
+            return np.clip(d, -0.5, 0.5)
+
+        center = flat.max(axis=-1)
+        x = col + offset(center, col, w, 1)
+        y = row + offset(center, row, h, w)
+    else:
+        raise ValueError('Unknown decode mode: ' + mode)
+    return np.stack([x / w, y / h], axis=-1)
+
+def heatmap_locations(landmarkMaps, mode='topk', k=10, beta=100.0,
+                      name='heatmap_locations'):
+    '''Graph op version of decode_heatmaps, so only N x K x 2 locations
+    have to be fetched instead of the full maps.
+    Input params:
+    landmarkMaps: N x H x W x K float Tensor, H, W and K known statically
+    Output:
+    locations: N x K x 2 float Tensor (x, y).'''
+
+    with tf.name_scope(name):
+        _, h, w, n_landmarks = landmarkMaps.get_shape().as_list()
+        flat = tf.reshape(tf.transpose(landmarkMaps, [0, 3, 1, 2]),
+                          [-1, n_landmarks, h * w])
+        if mode == 'topk':
+            idx = tf.nn.top_k(flat, k=k, sorted=False)[1]
+            x = tf.reduce_mean(tf.to_float(idx % w), -1)
+            y = tf.reduce_mean(tf.to_float(idx // w), -1)
+        elif mode == 'softargmax':
+            p = tf.nn.softmax(beta * flat)
+            pos = tf.range(h * w)
+            x = tf.reduce_sum(p * tf.to_float(pos % w), -1)
+            y = tf.reduce_sum(p * tf.to_float(pos // w), -1)
+        elif mode == 'quadratic':
+            idx = tf.to_int32(tf.argmax(flat, 2))
+            col = idx % w
+            row = idx // w
+            center = tf.reduce_max(flat, 2)
+
+            def pick(i):
+                return tf.reduce_sum(flat * tf.one_hot(i, h * w), 2)
+
+            def offset(pos, size, stride):
+                inner = tf.logical_and(pos > 0, pos < size - 1)
+                step = stride * tf.to_int32(inner)
+                lo = pick(idx - step)
+                hi = pick(idx + step)
+                denom = lo - 2 * center + hi
+                safe = tf.logical_and(inner, denom < 0)
+                d = tf.where(safe, 0.5 * (lo - hi) / tf.where(
+                    safe, denom, tf.ones_like(denom)), tf.zeros_like(denom))
+                return tf.clip_by_value(d, -0.5, 0.5)
+
+            x = tf.to_float(col) + offset(col, w, 1)
+            y = tf.to_float(row) + offset(row, h, w)
+        else:
+            raise ValueError('Unknown decode mode: ' + mode)
+        return tf.stack([x / w, y / h], axis=2)
 
 def evaluateError(landmarkGt, landmarkP):
-    e = np.zeros(68)
-    ocular_dist = np.mean(norm(landmarkGt[36:42] - landmarkGt[42:48], axis=1))
-    for i in range(68):
-        e[i] = norm(landmarkGt[i] - landmarkP[i])
-    e = e / ocular_dist
-    return e
+    return metrics.normalized_errors(landmarkGt, landmarkP)[0]
 
 def evaluateBatchError(landmarkGt, landmarkP, batch_size):
-    e = np.zeros([batch_size, 68])
-    for i in range(batch_size):
-        e[i] = evaluateError(landmarkGt[i], landmarkP[i])
-    mean_err = e[:,:].mean()#axis=0)
+    e = metrics.normalized_errors(landmarkGt[:batch_size], landmarkP[:batch_size])
+    mean_err = e.mean()
     return mean_err
 
 def normalized_rmse(pred, gt_truth):
@@ -887,42 +1031,70 @@ def normalized_rmse(pred, gt_truth):
 def flip_img(img):
     return img[:, ::-1]
 
-def flip_landmarks(landmark):
-    landmark_ = np.asarray([(1-lmk[0], lmk[1]) for lmk in landmark])
-    if len(landmark) == 106:
+def _flip_permutation(n_landmarks):
+    """Index order of the mirrored landmarks of a 68 or 106 point scheme."""
+    landmark_ = np.arange(n_landmarks)
+    if n_landmarks == 106:
         # Make sure that the flipped landmarks are in the right order #
         # face contour
         landmark_[:29] = landmark_[28::-1]
         # eyebrows
-        landmark_[29:53] = landmark_[range(41,53) + range(29,41)]
-        # landmark_[41:53] = landmark_[29:41]
+        landmark_[29:53] = landmark_[list(range(41, 53)) + list(range(29, 41))]
         # eye
-        landmark_[53:71] = landmark_[range(62,71) + range(53,62)]
+        landmark_[53:71] = landmark_[list(range(62, 71)) + list(range(53, 62))]
         # nose
         landmark_[71:86] = landmark_[85:70:-1]
         # mouth
-        landmark_[87:105] = landmark_[range(93,86,-1) + range(98,93,-1) + range(101,98,-1)
-                                        + range(104,101,-1)]
-    elif len(landmark) == 68:
+        landmark_[87:105] = landmark_[list(range(93, 86, -1)) + list(range(98, 93, -1)) +
+                                      list(range(101, 98, -1)) + list(range(104, 101, -1))]
+    elif n_landmarks == 68:
         # face contour
         landmark_[:17] = landmark_[16::-1]
         # eyebrows
         landmark_[17:27] = landmark_[26:16:-1]
-        # eyes
+        # nose bottom and eyes
         landmark_[31:48] = landmark_[list(range(35, 30, -1)) + list(range(45, 41, -1)) + list(range(47, 45, -1)) + list(range(39, 35, -1)) + list(range(41, 39, -1))]
-        #landmark_[31:36] = landmark_[35:30:-1]
-        #landmark_[36:40] = landmark_[45:41:-1]
-        #landmark_[40:42] = landmark_[47:45:-1]
-        #landmark_[42:46] = landmark_[39:35:-1]
-        #landmark_[46:48] = landmark_[41:39:-1]
         # mouth
         landmark_[48:55] = landmark_[54:47:-1]
         landmark_[55:60] = landmark_[59:54:-1]
 
         landmark_[60:65] = landmark_[64:59:-1]
         landmark_[65:68] = landmark_[67:64:-1]
+    return landmark_
+
+# flipped[i] = mirrored(landmarks[FLIP_PERMUTATIONS[K][i]])
+FLIP_PERMUTATIONS = {68: _flip_permutation(68), 106: _flip_permutation(106)}
 
-    # landmark_[]
-    # landmark_1[[3, 4]] = landmark_[[4, 3]]
+def flip_landmarks(landmark):
+    """Mirror K x 2 (or N x K x 2) normalized landmarks horizontally and
+    reorder them so left and right points swap."""
+    landmark = np.asarray(landmark)
+    perm = FLIP_PERMUTATIONS.get(landmark.shape[-2])
+    landmark_ = landmark if perm is None else landmark[..., perm, :]
+    landmark_ = np.array(landmark_, dtype=np.float64)
+    landmark_[..., 0] = 1 - landmark_[..., 0]
     return landmark_
 
+def flip_landmarks_tf(landmarks, n_landmarks=68):
+    """Graph op version of flip_landmarks for N x 2K or N x K x 2."""
+    shape = tf.shape(landmarks)
+    points = tf.reshape(landmarks, [-1, n_landmarks, 2])
+    # tf.gather only works on the first axis
+    points = tf.transpose(tf.gather(tf.transpose(points, [1, 0, 2]),
+                                    FLIP_PERMUTATIONS[n_landmarks]), [1, 0, 2])
+    points = points * [-1.0, 1.0] + [1.0, 0.0]
+    return tf.reshape(points, shape)
+
+def flip_batch(images, landmarks, n_landmarks=68):
+    """Append the mirrored copy of every example to a batch: 2N images and
+    2N landmarks, originals first."""
+    images = tf.concat_v2([images, tf.reverse_v2(images, [2])], 0)
+    landmarks = tf.concat_v2([landmarks, flip_landmarks_tf(landmarks, n_landmarks)], 0)
+    return images, landmarks
+
+def merge_flipped(pred, n_landmarks=68):
+    """Average the predictions of a flip_batch batch: 2N -> N, with the
+    mirrored half unflipped."""
+    n = tf.shape(pred)[0] // 2
+    return (pred[:n] + flip_landmarks_tf(pred[n:], n_landmarks)) / 2
+
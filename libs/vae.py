@@ -9,13 +9,63 @@ import numpy as np
 import os
 import pickle
 from libs.dataset_utils import create_input_pipeline
+from libs.dataset_utils import LandmarkDataset
 #from libs.datasets import CELEB, MNIST
 from libs.batch_norm import batch_norm
+from libs.checkpoint import AsyncCheckpointer
+from libs.profiler import StepProfiler
+from libs.towers import build_towers
+from libs.towers import tower_gradients
+from libs.towers import accumulate_gradients
+from libs.towers import tower_feed
+from libs.towers import checkpoint_variables
 from libs import utils
+from libs import metrics
 from libs.tfpipeline import input_pipeline
 from libs.tfpipeline import input_pipeline_reg
 from libs.tfpipeline import input_pipeline_reg_test
 from libs.tfpipeline import input_pipeline_local
+from libs.tfpipeline import input_pipeline_cached
+from libs.tfpipeline import genBatchMaps
+from libs import parallel_pipeline
+
+# The model / training options that used to be separate copies of this
+# module: vae_cft.py (batch-normalized VAE, jaw-weighted alignment loss,
+# fine-tunes everything from a full checkpoint) and vae_e2e.py (alignment
+# trained end to end with the trunk).  Pick one with variant=... in the
+# train / eval functions below.
+VARIANTS = {
+    'base': dict(use_bn=False,
+                 loss_weights=None,
+                 align_only=True,
+                 learning_rate=0.0006,
+                 restore_all=False,
+                 align_dir='models/',
+                 vae_dir='models/',
+                 predictions_file=None,
+                 gpu_fraction=0.2,
+                 plot_manifold=False),
+    'cft': dict(use_bn=True,
+                loss_weights=(2, 0),
+                align_only=True,
+                learning_rate=0.32,
+                restore_all=True,
+                align_dir='models_cft/',
+                vae_dir='models_vae/',
+                predictions_file='0518.pkl',
+                gpu_fraction=0.35,
+                plot_manifold=True),
+    'e2e': dict(use_bn=False,
+                loss_weights=None,
+                align_only=False,
+                learning_rate=0.0006,
+                restore_all=False,
+                align_dir='models_e2e/',
+                vae_dir='models/',
+                predictions_file=None,
+                gpu_fraction=0.2,
+                plot_manifold=False),
+}
 
 def VAE(input_shape=[None, 784],
         n_filters=[64, 64, 64],
@@ -26,7 +76,9 @@ def VAE(input_shape=[None, 784],
         dropout=False,
         denoising=False,
         convolutional=False,
-        variational=False):
+        variational=False,
+        batch=None,
+        use_bn=False):
     """(Variational) (Convolutional) (Denoising) Autoencoder.
 
     Uses tied weights.
@@ -77,6 +129,13 @@ def VAE(input_shape=[None, 784],
         layer, then another fully connected layer.  The size of the fully
         connected layers are determined by `n_hidden`, and the size of the
         sampling layer is determined by `n_code`.
+    batch : tuple of tf.Tensor, optional
+        (images, labels) from an input pipeline.  'x' and 'label' then
+        default to these tensors, so a training step needs no feed_dict
+        for them, but they can still be fed for interactive use.
+    use_bn : bool, optional
+        Batch normalize the encoder, the fully connected layers around the
+        embedding and the decoder (the 'cft' variant).
 
     Returns
     -------
@@ -93,8 +152,13 @@ def VAE(input_shape=[None, 784],
         }
     """
     # network input / placeholders for train (bn) and dropout
-    x = tf.placeholder(tf.float32, input_shape, 'x')
-    label = tf.placeholder(tf.float32, [None, 64, 64, 68], 'y')
+    if batch is None:
+        x = tf.placeholder(tf.float32, input_shape, 'x')
+        label = tf.placeholder(tf.float32, [None, 64, 64, 68], 'y')
+    else:
+        # read straight from the input pipeline, still feedable
+        x = tf.placeholder_with_default(batch[0], input_shape, 'x')
+        label = tf.placeholder_with_default(batch[1], [None, 64, 64, 68], 'y')
     phase_train = tf.placeholder(tf.bool, name='phase_train')
     keep_prob = tf.placeholder(tf.float32, name='keep_prob')
     corrupt_prob = tf.placeholder(tf.float32, [1])
@@ -121,7 +185,8 @@ def VAE(input_shape=[None, 784],
             else:
                 h, W = utils.linear(x=current_input,
                                     n_output=n_output)
-            #h = activation(batch_norm(h, phase_train, 'bn' + str(layer_i)))
+            if use_bn:
+                h = batch_norm(h, phase_train, 'bn' + str(layer_i))
             h = activation(h)
             if dropout:
                 h = tf.nn.dropout(h, keep_prob)
@@ -137,7 +202,8 @@ def VAE(input_shape=[None, 784],
 
             if n_hidden:
                 h = utils.linear(flattened, n_hidden, name='W_fc')[0]
-                #h = activation(batch_norm(h, phase_train, 'fc/bn'))
+                if use_bn:
+                    h = batch_norm(h, phase_train, 'fc/bn')
                 h = activation(h)
                 if dropout:
                     h = tf.nn.dropout(h, keep_prob)
@@ -156,8 +222,9 @@ def VAE(input_shape=[None, 784],
 
             if n_hidden:
                 h = utils.linear(z, n_hidden, name='fc_t')[0]
+                if use_bn:
+                    h = batch_norm(h, phase_train, 'fc_t/bn')
                 h = activation(h)
-                #h = activation(batch_norm(h, phase_train, 'fc_t/bn'))
                 if dropout:
                     h = tf.nn.dropout(h, keep_prob)
             else:
@@ -202,7 +269,8 @@ def VAE(input_shape=[None, 784],
             else:
                 h, W = utils.linear(x=current_input,
                                     n_output=n_output)
-            #h = activation(batch_norm(h, phase_train, 'dec/bn' + str(layer_i)))
+            if use_bn:
+                h = batch_norm(h, phase_train, 'dec/bn' + str(layer_i))
             h = activation(h)
             if dropout:
                 h = tf.nn.dropout(h, keep_prob)
@@ -244,13 +312,19 @@ def VAE_ALIGN(input_shape=[None, 784],
         dropout=False,
         denoising=False,
         convolutional=False,
-        variational=False):
+        variational=False,
+        batch=None):
     """(Variational) (Convolutional) (Denoising) Autoencoder.
 
     """
     # network input / placeholders for train (bn) and dropout
-    x = tf.placeholder(tf.float32, input_shape, 'x')
-    label = tf.placeholder(tf.float32, [None, 136], 'y')
+    if batch is None:
+        x = tf.placeholder(tf.float32, input_shape, 'x')
+        label = tf.placeholder(tf.float32, [None, 136], 'y')
+    else:
+        # read straight from the input pipeline, still feedable
+        x = tf.placeholder_with_default(batch[0], input_shape, 'x')
+        label = tf.placeholder_with_default(batch[1], [None, 136], 'y')
     phase_train = tf.placeholder(tf.bool, name='phase_train')
     phase_keep = tf.placeholder(tf.bool, name='phase_keep')
     keep_prob = tf.placeholder(tf.float32, name='keep_prob')
@@ -435,6 +509,10 @@ def VAE_ALIGN(input_shape=[None, 784],
             'train': phase_train,
             'keep': phase_keep}
 
+# (conv, batch norm) variable scopes of the VAE_ALIGN1 align head.
+ALIGN_BN_PAIRS = [('align/conv%s' % n, 'align/bn%s' % n)
+                  for n in ['1', '11', '2', '22', '3', '33', '4', '44']]
+
 def VAE_ALIGN1(input_shape=[None, 784],
         n_filters=[64, 64, 64],
         filter_sizes=[4, 4, 4],
@@ -444,13 +522,44 @@ def VAE_ALIGN1(input_shape=[None, 784],
         dropout=False,
         denoising=False,
         convolutional=False,
-        variational=False):
+        variational=False,
+        batch=None,
+        loss_weights=None,
+        fused_bn=False,
+        folded_bn=False,
+        compute_dtype=tf.float32,
+        recompute=False,
+        maps=None):
     """(Variational) (Convolutional) (Denoising) Autoencoder.
 
+    loss_weights : (cheek, inner) weights of the squared error on the 17 jaw
+    line points and the 51 inner points; None weights every point equally.
+    fused_bn : use batch_norm(fused=True) in the align head.
+    folded_bn : build the align head without batch norm, for inference with
+    weights from batch_norm.fold_checkpoint(ckpt, ALIGN_BN_PAIRS).
+    compute_dtype : activation dtype, e.g. tf.bfloat16; variables, batch norm,
+    random numbers and the loss stay float32.  Needs a TensorFlow build with
+    kernels for it: stock CPU builds register Conv2D only for half, float and
+    double, see utils.check_compute_dtype.
+    recompute : mark the first encoder layer, the rest of the encoder, the
+    variational layers and the decoder as segments for
+    recompute.recompute_gradients ('segments' / 'tail_inputs').
+    maps : N x 64 x 64 x 68 landmark maps the align head reads instead of
+    the decoder output y ('maps'), e.g. from feature_cache.  The head still
+    reads the first encoder layer; the rest of the trunk is built, so
+    checkpoints keep all variables, but never runs.
     """
+    # reversed and extended below, keep the caller's list intact
+    n_filters = list(n_filters)
+
     # network input / placeholders for train (bn) and dropout
-    x = tf.placeholder(tf.float32, input_shape, 'x')
-    label = tf.placeholder(tf.float32, [None, 136], 'y')
+    if batch is None:
+        x = tf.placeholder(tf.float32, input_shape, 'x')
+        label = tf.placeholder(tf.float32, [None, 136], 'y')
+    else:
+        # read straight from the input pipeline, still feedable
+        x = tf.placeholder_with_default(batch[0], input_shape, 'x')
+        label = tf.placeholder_with_default(batch[1], [None, 136], 'y')
     phase_train = tf.placeholder(tf.bool, name='phase_train')
     phase_keep = tf.placeholder(tf.bool, name='phase_keep')
     keep_prob = tf.placeholder(tf.float32, name='keep_prob')
@@ -462,7 +571,9 @@ def VAE_ALIGN1(input_shape=[None, 784],
 
     # 2d -> 4d if convolution
     x_tensor = utils.to_tensor(x) if convolutional else x
-    current_input = x_tensor
+    current_input = tf.cast(x_tensor, compute_dtype)
+    segments = []
+    segment_input = current_input
 
     Ws = []
     shapes = []
@@ -483,11 +594,18 @@ def VAE_ALIGN1(input_shape=[None, 784],
             #h = activation(batch_norm(h, phase_train, 'bn' + str(layer_i)))
             h = activation(h)
             if dropout:
-                h = tf.nn.dropout(h, keep_prob)
+                h = utils.dropout(h, keep_prob)
             Ws.append(W)
             hs.append(h)
             current_input = h
-
+            if layer_i == 0:
+                # read by the align head, so a segment boundary
+                segments.append(([segment_input], h))
+                segment_input = h
+
+    if current_input is not segment_input:
+        segments.append(([segment_input], current_input))
+        segment_input = current_input
     shapes.append(current_input.get_shape().as_list())
 
     with tf.variable_scope('variational'):
@@ -500,7 +618,7 @@ def VAE_ALIGN1(input_shape=[None, 784],
                 #h = activation(batch_norm(h, phase_train, 'fc/bn'))
                 h = activation(h)
                 if dropout:
-                    h = tf.nn.dropout(h, keep_prob)
+                    h = utils.dropout(h, keep_prob)
             else:
                 h = flattened
 
@@ -508,8 +626,9 @@ def VAE_ALIGN1(input_shape=[None, 784],
             z_log_sigma = 0.5 * utils.linear(h, n_code, name='log_sigma')[0]
 
             # Sample from noise distribution p(eps) ~ N(0, 1)
-            epsilon = tf.random_normal(
-                tf.stack([tf.shape(x)[0], n_code]))
+            # float32 and cast, there is no bfloat16 random_normal kernel
+            epsilon = tf.cast(tf.random_normal(
+                tf.stack([tf.shape(x)[0], n_code])), compute_dtype)
 
             # Sample from posterior
             if dropout:
@@ -522,7 +641,7 @@ def VAE_ALIGN1(input_shape=[None, 784],
                 h = activation(h)
                 #h = activation(batch_norm(h, phase_train, 'fc_t/bn'))
                 if dropout:
-                    h = tf.nn.dropout(h, keep_prob)
+                    h = utils.dropout(h, keep_prob)
             else:
                 h = z
 
@@ -531,7 +650,7 @@ def VAE_ALIGN1(input_shape=[None, 784],
             #current_input = activation(batch_norm(h, phase_train, 'fc_t2/bn'))
             current_input = activation(h)
             if dropout:
-                current_input = tf.nn.dropout(current_input, keep_prob)
+                current_input = utils.dropout(current_input, keep_prob)
 
             if convolutional:
                 current_input = tf.reshape(
@@ -542,6 +661,9 @@ def VAE_ALIGN1(input_shape=[None, 784],
                         dims[3]]))
         else:
             z = current_input
+    if current_input is not segment_input:
+        segments.append(([segment_input], current_input))
+        segment_input = current_input
 
     shapes.reverse()
     n_filters.reverse()
@@ -568,65 +690,80 @@ def VAE_ALIGN1(input_shape=[None, 784],
             #h = activation(batch_norm(h, phase_train, 'dec/bn' + str(layer_i)))
             h = activation(h)
             if dropout:
-                h = tf.nn.dropout(h, keep_prob)
+                h = utils.dropout(h, keep_prob)
             current_input = h
     current_input, W = utils.conv2d(current_input, 68, k_h=3, k_w=3, d_h=2, d_w=2, padding='SAME', name='final_conv')
 
     y = tf.nn.sigmoid(current_input)
-    h = tf.concat_v2([hs[0], y], 3)
+    segments.append(([segment_input], y))
+    if maps is not None:
+        segments, tail_inputs = [], [hs[0], tf.cast(maps, compute_dtype)]
+    elif recompute:
+        # the head reads the segment outputs only through these
+        tail_inputs = [tf.identity(hs[0]), tf.identity(y)]
+    else:
+        segments, tail_inputs = [], [hs[0], y]
+    h = tf.concat_v2(tail_inputs, 3)
+
+    def bn(h, name):
+        if folded_bn:
+            return h
+        normed = batch_norm(tf.cast(h, tf.float32), phase_train, name,
+                            fused=fused_bn)
+        return tf.cast(normed, compute_dtype)
 
     with tf.variable_scope('align/'):
         #h = tf.concat(3, [batch_norm(hs[0], phase_train, affine=False), y])
         h, W = utils.conv2d(h, 48, k_h=3, k_w=3, d_h=1, d_w=1, padding='SAME', name='conv1')
-        h = activation(batch_norm(h, phase_train, 'bn1'))
+        h = activation(bn(h, 'bn1'))
         #h = activation(h)
         if dropout:
-            h = tf.nn.dropout(h, keep_prob1)
+            h = utils.dropout(h, keep_prob1)
         h, W = utils.conv2d(h, 48, k_h=3, k_w=3, d_h=2, d_w=2, padding='SAME', name='conv11')
-        h = activation(batch_norm(h, phase_train, 'bn11'))
+        h = activation(bn(h, 'bn11'))
         #h = activation(h)
         if dropout:
-            h = tf.nn.dropout(h, keep_prob1)
+            h = utils.dropout(h, keep_prob1)
         # loss 1
         #loss1h, wloss1 = utils.linear(h, 136, name='loss1')
 
         h, W = utils.conv2d(h, 64, k_h=3, k_w=3, d_h=1, d_w=1, padding='SAME', name='conv2')
-        h = activation(batch_norm(h, phase_train, 'bn2'))
+        h = activation(bn(h, 'bn2'))
         #h = activation(h)
         if dropout:
-            h = tf.nn.dropout(h, keep_prob1)
+            h = utils.dropout(h, keep_prob1)
         h, W = utils.conv2d(h, 64, k_h=3, k_w=3, d_h=2, d_w=2, padding='SAME', name='conv22')
-        h = activation(batch_norm(h, phase_train, 'bn22'))
+        h = activation(bn(h, 'bn22'))
         #h = activation(h)
         if dropout:
-            h = tf.nn.dropout(h, keep_prob1)
+            h = utils.dropout(h, keep_prob1)
         # loss 2
         #loss2h, wloss2 = utils.linear(h, 136, name='loss2')
 
         h, W = utils.conv2d(h, 96, k_h=3, k_w=3, d_h=1, d_w=1, padding='SAME', name='conv3')
-        h = activation(batch_norm(h, phase_train, 'bn3'))
+        h = activation(bn(h, 'bn3'))
         #h = activation(h)
         if dropout:
-            h = tf.nn.dropout(h, keep_prob)
+            h = utils.dropout(h, keep_prob)
 
         h, W = utils.conv2d(h, 96, k_h=3, k_w=3, d_h=2, d_w=2, padding='SAME', name='conv33')
-        h3 = activation(batch_norm(h, phase_train, 'bn33'))
+        h3 = activation(bn(h, 'bn33'))
         #h3 = activation(h)
         if dropout:
-            h = tf.nn.dropout(h, keep_prob)
+            h = utils.dropout(h, keep_prob)
         # loss 3
         #loss3h, wloss3 = utils.linear(h, 136, name='loss3')
 
         h, W = utils.conv2d(h3, 128, k_h=3, k_w=3, d_h=1, d_w=1, padding='SAME', name='conv4')
-        h = activation(batch_norm(h, phase_train, 'bn4'))
+        h = activation(bn(h, 'bn4'))
         #h = activation(h)
         if dropout:
-            h = tf.nn.dropout(h, keep_prob2)
+            h = utils.dropout(h, keep_prob2)
         h, W = utils.conv2d(h3, 128, k_h=3, k_w=3, d_h=2, d_w=2, padding='SAME', name='conv44')
-        h = activation(batch_norm(h, phase_train, 'bn44'))
+        h = activation(bn(h, 'bn44'))
         #h = activation(h)
         if dropout:
-            h = tf.nn.dropout(h, keep_prob2)
+            h = utils.dropout(h, keep_prob2)
         #h = activation(h)
         h3_flat = utils.flatten(h3)
         h_flat = utils.flatten(h)
@@ -634,17 +771,23 @@ def VAE_ALIGN1(input_shape=[None, 784],
         ip1, W1 = utils.linear(concat, 256, name='ip1')
         ip1 = activation(ip1)
         if dropout:
-            ip1 = tf.nn.dropout(ip1, keep_prob1)
+            ip1 = utils.dropout(ip1, keep_prob1)
         ip2, W2 = utils.linear(ip1, 192, name='ip2')
         ip2 = activation(ip2)
         if dropout:
-            ip2 = tf.nn.dropout(ip2, keep_prob1)
+            ip2 = utils.dropout(ip2, keep_prob1)
         ip3, W3 = utils.linear(ip2, 136, name='ip3')
 
-    p_flat = utils.flatten(ip3)
+    p_flat = utils.flatten(tf.cast(ip3, tf.float32))
     y_flat = utils.flatten(label)
     regularizers = 5e-4 *(tf.nn.l2_loss(W1) + tf.nn.l2_loss(W2))
-    loss_x = tf.reduce_sum(tf.squared_difference(p_flat, y_flat), 1)
+    if loss_weights is None:
+        loss_x = tf.reduce_sum(tf.squared_difference(p_flat, y_flat), 1)
+    else:
+        cheek_weight, inner_weight = loss_weights
+        loss_cheek = tf.reduce_sum(tf.squared_difference(p_flat[:, :34], y_flat[:, :34]), 1)
+        loss_inner = tf.reduce_sum(tf.squared_difference(p_flat[:, 34:], y_flat[:, 34:]), 1)
+        loss_x = cheek_weight * loss_cheek + inner_weight * loss_inner
     #loss1 = tf.reduce_sum(tf.squared_difference(loss1h, y_flat), 1)
     #loss2 = tf.reduce_sum(tf.squared_difference(loss2h, y_flat), 1)
     #loss3 = tf.reduce_sum(tf.squared_difference(loss3h, y_flat), 1)
@@ -660,7 +803,10 @@ def VAE_ALIGN1(input_shape=[None, 784],
             'keep_prob2': keep_prob2,
             'corrupt_prob': corrupt_prob,
             'train': phase_train,
-            'keep': phase_keep}
+            'keep': phase_keep,
+            'segments': segments,
+            'tail_inputs': tail_inputs,
+            'maps': y}
 
 def eval_vae_align(files,
               input_shape,
@@ -680,10 +826,28 @@ def eval_vae_align(files,
               activation=tf.nn.relu,
               img_step=1,
               save_step=5000,
-              ckpt_name="vae.ckpt"):
+              ckpt_name="vae.ckpt",
+              in_memory=False,
+              variant='base',
+              tta=False):
     
     
-    batch = input_pipeline_reg_test(['300w-gt-test.txt'], batch_size=batch_size, shape=[128, 128, 1], is_training=False)
+    opts = VARIANTS[variant]
+    if in_memory:
+        # decoded once and memory-mapped, no queue runners or per-file reads
+        data = LandmarkDataset.load('300w-gt-test.txt', shape=[128, 128, 1])
+        batches = data.batches(batch_size)
+        batch = None
+    else:
+        batch = input_pipeline_reg_test(['300w-gt-test.txt'], batch_size=batch_size, shape=[128, 128, 1], is_training=False)
+    if tta:
+        # mirrored copies go through the same forward pass (2N images) and
+        # are unflipped and averaged with the originals afterwards
+        if batch is None:
+            batch = (tf.placeholder(tf.float32, [None] + crop_shape, 'x_in'),
+                     tf.placeholder(tf.float32, [None, 136], 'y_in'))
+        inputs = batch
+        batch = utils.flip_batch(*batch)
     ae = VAE_ALIGN1(input_shape=[None] + crop_shape,
              convolutional=convolutional,
              variational=variational,
@@ -692,7 +856,9 @@ def eval_vae_align(files,
              n_code=n_code,
              dropout=dropout,
              filter_sizes=filter_sizes,
-             activation=activation)
+             activation=activation,
+             batch=batch,
+             loss_weights=opts['loss_weights'])
 
     
     # opt_vars = [v for v in tf.trainable_variables() if v.name.startswith("align/")]
@@ -702,8 +868,9 @@ def eval_vae_align(files,
     # optimizer = tf.train.AdamOptimizer(
     #     learning_rate=learning_rate).minimize(ae['cost'], var_list=opt_vars, global_step=batch_idx)
 
-    avg_pred = ae['y']
-    gt_truth = ae['label']
+    avg_pred = utils.merge_flipped(ae['y']) if tta else ae['y']
+    label = inputs[1] if tta else ae['label']
+    gt_truth = label
     gt_truth = tf.reshape(gt_truth, (-1, 68, 2))
     # Calculate predictions.
     norm_error = utils.normalized_rmse(avg_pred, gt_truth)
@@ -738,19 +905,22 @@ def eval_vae_align(files,
     # test_xs = test_xs
     #print(test_xs.max())
     # utils.montage_landmarks(test_label[:8], 'map_train/test_xs.png')
-    all_err = []
-    fucking_err = []
+    # per-image errors (ocular) and normalized_rmse errors, binned per
+    # 300-W subset instead of kept in lists
+    errors = metrics.ErrorAccumulator(metrics.SUBSETS_300W)
+    norm_errors = metrics.ErrorAccumulator(metrics.SUBSETS_300W)
     predictions = []
-    gts = []
     
     try:
         while not coord.should_stop() and epoch_i < n_epochs:
             batch_i += 1
-            batch_xs, label_xs = sess.run(batch)
-            #batch_xs = batch_xs
-            train_cost, pred, norm_err = sess.run([ae['cost'], ae['y'], norm_error], feed_dict={
-                ae['x']: batch_xs, ae['label']: label_xs, ae['train']: False,
-                ae['keep_prob']: keep_prob, ae['keep_prob1']: 0.9, ae['keep_prob2']: 0.7, ae['keep']: False})[:3]
+            feed_dict = {ae['train']: False,
+                ae['keep_prob']: keep_prob, ae['keep_prob1']: 0.9, ae['keep_prob2']: 0.7, ae['keep']: False}
+            if in_memory:
+                x, y = inputs if tta else (ae['x'], ae['label'])
+                feed_dict[x], feed_dict[y] = next(batches)
+            train_cost, pred, norm_err, label_xs = sess.run([ae['cost'], avg_pred, norm_error, label],
+                feed_dict=feed_dict)
 
             # Directly from map
              
@@ -759,8 +929,8 @@ def eval_vae_align(files,
             #pred_flip = sess.run(ae['y'], feed_dict={ae['x']:flipped, ae['train']: False, ae['keep_prob']: keep_prob, ae['keep']: False})
             #import pdb; pdb.set_trace()
             #pred_flip = np.asarray([utils.flip_landmarks(pred_flip[0])])
-            predictions.append(pred)
-            gts.append(label_xs[0].reshape([68, 2]))
+            if opts['predictions_file']:
+                predictions.append(pred)
             print(batch_i, train_cost)
             cost += train_cost
             if batch_i % n_files == 0:
@@ -770,13 +940,14 @@ def eval_vae_align(files,
                 batch_i = 0
                 epoch_i += 1
 
-            if batch_i % img_step == 0:
+            # every batch: the 300-W subsets are positions in the stream
+            label_xs = label_xs.reshape([-1, 68, 2])
+            err = metrics.nme(label_xs, pred)
+            errors.update(err)
+            norm_errors.update(norm_err)
 
-                label_xs = label_xs.reshape([-1, 68, 2])
-                err = utils.evaluateBatchError(label_xs, pred, batch_size)
-                all_err.append(err)
-                fucking_err.append(norm_err)
-                print('Mean error:' + np.array_str(err))
+            if batch_i % img_step == 0:
+                print('Mean error:' + np.array_str(err.mean()))
                 #print(norm_err)
                 t_i += 1
 
@@ -786,17 +957,16 @@ def eval_vae_align(files,
     finally:
         # One of the threads has issued an exception.  So let's tell all the
         # threads to shutdown.
-        all_err = np.asarray(all_err)
-        fucking_err = np.vstack(fucking_err).ravel()
-        auc_at_08 = (fucking_err < .08).mean()
-        auc_at_05 = (fucking_err < .05).mean()
-        #output = open('fullset-det-gt-0109.pkl', 'wb')
-        #pickle.dump(predictions, output)
-        #output.close()
-
-        print('Overall mean error: ' + np.array_str(all_err.mean(axis=0)))
-        print('LFPW: %f, HELEN: %f, IBUG: %f' %(all_err[:224].mean(), all_err[224:554].mean(), all_err[554:].mean()))
-        print('Fucking error: %f, auc@05: %.4f, auc@08: %.4f.' %(fucking_err.mean(), auc_at_05, auc_at_08))
+        auc_at_05, auc_at_08 = norm_errors.ced([.05, .08])
+        if opts['predictions_file']:
+            output = open(opts['predictions_file'], 'wb')
+            pickle.dump(predictions, output)
+            output.close()
+
+        print('Overall mean error: %f' % errors.mean())
+        print('LFPW: %f, HELEN: %f, IBUG: %f' %(errors.mean('LFPW'), errors.mean('HELEN'), errors.mean('IBUG')))
+        print('Fucking error: %f, auc@05: %.4f, auc@08: %.4f.' %(norm_errors.mean(), auc_at_05, auc_at_08))
+        print('AUC@0.08: %.4f, failure@0.08: %.4f' % (errors.auc(0.08), errors.failure_rate(0.08)))
         # saver_m.save(sess, "./" + "align",
         #     global_step=batch_i,
         #     write_meta_graph=False)
@@ -826,23 +996,61 @@ def train_vae_align(files,
               activation=tf.nn.relu,
               img_step=100,
               save_step=20000,
-              ckpt_name="vae.ckpt"):
-    
+              ckpt_name="vae.ckpt",
+              input_threads=1,
+              records=None,
+              variant='base',
+              augment=False,
+              train_list=None,
+              xla=False,
+              compute_dtype=tf.float32,
+              keep_checkpoints=5,
+              profile_dir=None,
+              trace_every=0,
+              n_towers=1,
+              accumulate_steps=1,
+              recompute=False):
     
-    batch = input_pipeline_reg(['300w-gt-aug.txt'], batch_size=64, shape=[128, 128, 1], is_training=True)
-    ae = VAE_ALIGN1(input_shape=[None] + crop_shape,
-             convolutional=convolutional,
-             variational=variational,
-             n_filters=n_filters,
-             n_hidden=n_hidden,
-             n_code=n_code,
-             dropout=dropout,
-             filter_sizes=filter_sizes,
-             activation=activation)
+    opts = VARIANTS[variant]
+    # fail now, not at the first sess.run after the pipeline started
+    utils.check_compute_dtype(compute_dtype)
+    if train_list is None:
+        # 300w-gt-aug.txt already holds offline augmented copies, augment
+        # the plain list online instead
+        train_list = '300w-gt.txt' if augment else '300w-gt-aug.txt'
+    if records:
+        batch = parallel_pipeline.input_pipeline_records(records, batch_size=batch_size * n_towers, shape=[128, 128, 1], is_training=True,
+                                                         num_readers=input_threads, num_threads=input_threads,
+                                                         augment=augment)
+    elif input_threads > 1 or augment:
+        # online flip / rotation / scale / shift per worker, see libs.augment
+        batch = parallel_pipeline.input_pipeline_reg([train_list], batch_size=batch_size * n_towers, shape=[128, 128, 1], is_training=True,
+                                                     num_readers=input_threads, num_threads=input_threads,
+                                                     augment=augment)
+    else:
+        batch = input_pipeline_reg([train_list], batch_size=batch_size * n_towers, shape=[128, 128, 1], is_training=True)
+    # data parallel: n_towers replicas sharing variables, each on its own
+    # batch_size slice of the batch, see libs.towers.  With xla the model
+    # ops are marked for XLA, their gradients follow them into the clusters
+    with utils.jit_scope(xla):
+        towers = build_towers(lambda shard: VAE_ALIGN1(input_shape=[None] + crop_shape,
+                 convolutional=convolutional,
+                 variational=variational,
+                 n_filters=n_filters,
+                 n_hidden=n_hidden,
+                 n_code=n_code,
+                 dropout=dropout,
+                 filter_sizes=filter_sizes,
+                 activation=activation,
+                 batch=shard,
+                 loss_weights=opts['loss_weights'],
+                 compute_dtype=compute_dtype,
+                 recompute=recompute), batch, n_towers)
+    ae = towers[0]
 
     
     opt_vars = [v for v in tf.trainable_variables() if v.name.startswith("align/")]
-    ori_vars = [v for v in tf.global_variables() if not v.name.startswith("align/")]
+    ori_vars = [v for v in checkpoint_variables() if not v.name.startswith("align/")]
     #old_names = ["align/bn1/align/bn1/moments/moments_1/mean/ExponentialMovingAverage", "align/bn11/align/bn11/moments/moments_1/mean/ExponentialMovingAverage",
     #"align/bn2/align/bn2/moments/moments_1/mean/ExponentialMovingAverage", "align/bn22/align/bn22/moments/moments_1/mean/ExponentialMovingAverage",
     #"align/bn3/align/bn3/moments/moments_1/mean/ExponentialMovingAverage", "align/bn33/align/bn33/moments/moments_1/mean/ExponentialMovingAverage",
@@ -867,17 +1075,36 @@ def train_vae_align(files,
     #    del names_to_vars[new_name]
     #import pdb; pdb.set_trace()
     batch_idx = tf.Variable(0, dtype=tf.int32)
-    learning_rate = tf.train.exponential_decay(0.0006, batch_idx * batch_size, 192000, 0.95, staircase=True)
-    optimizer = tf.train.AdamOptimizer(
-        learning_rate=learning_rate).minimize(ae['cost'], var_list=opt_vars, global_step=batch_idx)
+    # one update trains on batch_size * n_towers * accumulate_steps examples,
+    # the decay counts examples
+    learning_rate = tf.train.exponential_decay(opts['learning_rate'], batch_idx * batch_size * n_towers * accumulate_steps,
+                                               192000, 0.95, staircase=True)
+    adam = tf.train.AdamOptimizer(learning_rate=learning_rate)
+    grads_and_vars, cost_op = tower_gradients(
+        adam, towers, var_list=opt_vars if opts['align_only'] else None)
+    if accumulate_steps > 1:
+        # sum accumulate_steps micro-batches, then one Adam update
+        train_step, optimizer = accumulate_gradients(adam, grads_and_vars, accumulate_steps,
+                                                     global_step=batch_idx)
+    else:
+        optimizer = adam.apply_gradients(grads_and_vars, global_step=batch_idx)
+        train_step = optimizer
 
     # We create a session to use the graph
     gpu_options = tf.GPUOptions(per_process_gpu_memory_fraction=0.45)
-    sess = tf.Session(config=tf.ConfigProto(gpu_options=gpu_options))
+    config = tf.ConfigProto(gpu_options=gpu_options)
+    sess = tf.Session(config=config)
     #sess = tf.Session()
     saver = tf.train.Saver(ori_vars)
-    saver_m = tf.train.Saver(tf.global_variables())
+    saver_m = tf.train.Saver(checkpoint_variables())
     sess.run(tf.global_variables_initializer())
+    sess.run(tf.local_variables_initializer())
+    # snapshots on this thread, writes on a background one; keeps the last
+    # `keep_checkpoints` and the one with the lowest average cost
+    ckpt = AsyncCheckpointer(sess, checkpoint_variables(), opts['align_dir'],
+                             'align-300w-gtbbx', keep_last=keep_checkpoints,
+                             keep_best=1)
+    prof = StepProfiler(sess, profile_dir, trace_every=trace_every)
 
     # This will handle our threaded image pipeline
     coord = tf.train.Coordinator()
@@ -888,7 +1115,11 @@ def train_vae_align(files,
     # Start up the queues for handling the image pipeline
     threads = tf.train.start_queue_runners(sess=sess, coord=coord)
 
-    if os.path.exists(ckpt_name):
+    if opts['restore_all'] and os.path.exists(ckpt_name + '.index'):
+        # fine-tune from a full (trunk + align) checkpoint
+        saver_m.restore(sess, ckpt_name)
+        print('load ' + ckpt_name + ' successfully')
+    elif not opts['restore_all'] and os.path.exists(ckpt_name):
         saver.restore(sess, ckpt_name)
         print('load ' + ckpt_name + ' successfully')
     print(learning_rate)
@@ -896,30 +1127,26 @@ def train_vae_align(files,
     # Fit all training data
     t_i = 0
     batch_i = 0
+    micro_i = 0
     epoch_i = 0
     cost = 0
+    window_cost, window_n = 0, 0
+    last_saved = None
     n_files = 100000
-    test_xs, test_label = sess.run(batch)
-    test_xs = test_xs
-    print(test_xs.max())
     # utils.montage_landmarks(test_label[:8], 'map_train/test_xs.png')
     # all_err = []
     try:
         while not coord.should_stop() and epoch_i < n_epochs:
             batch_i += 1
-            batch_xs, label_xs = sess.run(batch)
-            #batch_xs = batch_xs
-            train_cost, pred = sess.run([ae['cost'], ae['y'], optimizer], feed_dict={
-                ae['x']: batch_xs, ae['label']: label_xs, ae['train']: True,
-                ae['keep_prob']: keep_prob, ae['keep_prob1']: 0.9, ae['keep_prob2']: 0.7, ae['keep']: False})[:2]
-            print(batch_i, train_cost)
+            train_cost, pred, label_xs = prof.run([cost_op, ae['y'], ae['label'], train_step], feed_dict=tower_feed(towers, {
+                'train': True,
+                'keep_prob': keep_prob, 'keep_prob1': 0.9, 'keep_prob2': 0.7, 'keep': False}))[:3]
+            micro_i += 1
+            if accumulate_steps > 1 and micro_i % accumulate_steps == 0:
+                prof.run(optimizer)
             cost += train_cost
-            if batch_i % n_files == 0:
-                print('epoch:', epoch_i)
-                print('average cost:', cost / batch_i)
-                cost = 0
-                batch_i = 0
-                epoch_i += 1
+            window_cost += train_cost
+            window_n += 1
 
             if batch_i % img_step == 0:
                 lr = sess.run(learning_rate)
@@ -932,10 +1159,20 @@ def train_vae_align(files,
                 t_i += 1
 
             if batch_i % save_step == 0:
-                # Save the variables to disk.
-                saver_m.save(sess, "models/" + "align-300w-gtbbx",
-                           global_step=batch_i,
-                           write_meta_graph=False)
+                # Save the variables to disk, named by the global step.  The
+                # metric is the mean cost of the batches since the previous
+                # save, the same number of batches for every checkpoint
+                last_saved = sess.run(batch_idx)
+                ckpt.save(last_saved, metric=window_cost / window_n)
+                window_cost, window_n = 0, 0
+
+            if batch_i % n_files == 0:
+                print('epoch:', epoch_i)
+                print('average cost:', cost / batch_i)
+                cost = 0
+                batch_i = 0
+                epoch_i += 1
+            prof.step(cost=train_cost)
     except tf.errors.OutOfRangeError:
         print('Done.')
     finally:
@@ -944,9 +1181,12 @@ def train_vae_align(files,
         # all_err = np.asarray(all_err)
 
         # print('mean error:' + np.array_str(all_err.mean(axis=0)))
-        saver_m.save(sess, "models/" + "align-300w-gtbbx",
-             global_step=t_i,
-             write_meta_graph=False)
+        # a partial window has no comparable metric
+        step = sess.run(batch_idx)
+        if step != last_saved:
+            ckpt.save(step)
+        ckpt.close()
+        prof.close()
         coord.request_stop()
 
     # Wait until all threads have finished.
@@ -985,7 +1225,8 @@ def train_vae_align1(files,
              n_code=n_code,
              dropout=dropout,
              filter_sizes=filter_sizes,
-             activation=activation)
+             activation=activation,
+             batch=batch)
 
     
     opt_vars = [v for v in tf.trainable_variables() if v.name.startswith("align/")]
@@ -1031,11 +1272,9 @@ def train_vae_align1(files,
     try:
         while not coord.should_stop() and epoch_i < n_epochs:
             batch_i += 1
-            batch_xs, label_xs = sess.run(batch)
-            #batch_xs = batch_xs
-            train_cost, pred = sess.run([ae['cost'], ae['y'], optimizer], feed_dict={
-                ae['x']: batch_xs, ae['label']: label_xs, ae['train']: True,
-                ae['keep_prob']: keep_prob, ae['keep']: False})[:2]
+            train_cost, pred, label_xs = sess.run([ae['cost'], ae['y'], ae['label'], optimizer], feed_dict={
+                ae['train']: True,
+                ae['keep_prob']: keep_prob, ae['keep']: False})[:3]
             print(batch_i, train_cost)
             cost += train_cost
             if batch_i % n_files == 0:
@@ -1098,7 +1337,8 @@ def eval_vae(files,
               activation=tf.nn.relu,
               img_step=100,
               save_step=100,
-              ckpt_name="vae.ckpt"):
+              ckpt_name="vae.ckpt",
+              variant='base'):
     """General purpose training of a (Variational) (Convolutional) Autoencoder.
 
     Supply a list of file paths to images, and this will do everything else.
@@ -1166,7 +1406,8 @@ def eval_vae(files,
              n_code=n_code,
              dropout=dropout,
              filter_sizes=filter_sizes,
-             activation=activation)
+             activation=activation,
+             use_bn=VARIANTS[variant]['use_bn'])
 
     # Create a manifold of our inner most layer to show
     # example reconstructions.  This is one way to see
@@ -1255,7 +1496,12 @@ def train_vae(files,
               activation=tf.nn.relu,
               img_step=200,
               save_step=20000,
-              ckpt_name="vae.ckpt"):
+              ckpt_name="vae.ckpt",
+              heatmap_cache=False,
+              sparse_maps=False,
+              variant='base',
+              profile_dir=None,
+              trace_every=0):
     """General purpose training of a (Variational) (Convolutional) Autoencoder.
 
     Supply a list of file paths to images, and this will do everything else.
@@ -1305,7 +1551,22 @@ def train_vae(files,
         How often to save checkpoints.
     ckpt_name : str, optional
         Checkpoints will be named as this, e.g. 'model.ckpt'
+    heatmap_cache : bool, optional
+        Read landmark maps from the cache written by build_heatmap_cache.py
+        instead of rendering them every epoch.
+    sparse_maps : bool, optional
+        Queue landmark coordinates and render the maps per batch after
+        dequeueing, see tfpipeline.input_pipeline.
+    variant : str, optional
+        Key of VARIANTS: batch norm, GPU memory fraction, manifold plots and
+        checkpoint directory.
+    profile_dir : str, optional
+        Write step-time reports, TensorBoard scalars and traces here, see
+        profiler.StepProfiler.
+    trace_every : int, optional
+        Write a Chrome trace every this many steps (needs profile_dir).
     """
+    opts = VARIANTS[variant]
     #batch = create_input_pipeline(
     #    files=files,
     #    batch_size=batch_size,
@@ -1314,7 +1575,11 @@ def train_vae(files,
     #    crop_factor=crop_factor,
     #    shape=input_shape)
     
-    batch = input_pipeline(['300w-gt-aug.txt'], batch_size=batch_size, shape=[128, 128, 1], is_training=True)
+    if heatmap_cache:
+        batch = input_pipeline_cached(['300w-gt-aug.txt'], batch_size=batch_size, shape=[128, 128, 1], is_training=True)
+    else:
+        batch = input_pipeline(['300w-gt-aug.txt'], batch_size=batch_size, shape=[128, 128, 1], is_training=True,
+                               sparse=sparse_maps)
     ae = VAE(input_shape=[None] + crop_shape,
              convolutional=convolutional,
              variational=variational,
@@ -1323,7 +1588,9 @@ def train_vae(files,
              n_code=n_code,
              dropout=dropout,
              filter_sizes=filter_sizes,
-             activation=activation)
+             activation=activation,
+             batch=batch,
+             use_bn=opts['use_bn'])
 
     # Create a manifold of our inner most layer to show
     # example reconstructions.  This is one way to see
@@ -1339,10 +1606,11 @@ def train_vae(files,
         learning_rate=learning_rate).minimize(ae['cost'])
 
     # We create a session to use the graph
-    gpu_options = tf.GPUOptions(per_process_gpu_memory_fraction=0.2)
+    gpu_options = tf.GPUOptions(per_process_gpu_memory_fraction=opts['gpu_fraction'])
     sess = tf.Session(config=tf.ConfigProto(gpu_options=gpu_options))
     saver = tf.train.Saver()
-    sess.run(tf.initialize_all_variables())
+    sess.run(tf.global_variables_initializer())
+    prof = StepProfiler(sess, profile_dir, trace_every=trace_every)
 
     # This will handle our threaded image pipeline
     coord = tf.train.Coordinator()
@@ -1370,12 +1638,9 @@ def train_vae(files,
     try:
         while not coord.should_stop() and epoch_i < n_epochs:
             batch_i += 1
-            batch_xs, label_xs = sess.run(batch)
-
-            train_cost = sess.run([ae['cost'], optimizer], feed_dict={
-                ae['x']: batch_xs, ae['label']: label_xs, ae['train']: True,
+            train_cost = prof.run([ae['cost'], optimizer], feed_dict={
+                ae['train']: True,
                 ae['keep_prob']: keep_prob})[0]
-            print(batch_i, train_cost)
             cost += train_cost
             if batch_i % n_files == 0:
                 print('epoch:', epoch_i)
@@ -1386,13 +1651,14 @@ def train_vae(files,
 
             if batch_i % img_step == 0:
                 # Plot example reconstructions from latent layer
-            #    recon = sess.run(
-            #        ae['y'], feed_dict={
-            #            ae['z']: zs,
-            #            ae['train']: False,
-            #            ae['keep_prob']: 1.0})
-            #    utils.montage_landmarks(recon[:8],
-            #                  'map_train/manifold_%08d.png' % t_i)
+                if opts['plot_manifold']:
+                    recon = sess.run(
+                        ae['y'], feed_dict={
+                            ae['z']: zs,
+                            ae['train']: False,
+                            ae['keep_prob']: 1.0})
+                    utils.montage_landmarks(recon[:8],
+                                  'map_train/manifold_%08d.png' % t_i)
 
                 # Plot example reconstructions
                 recon = sess.run(
@@ -1407,17 +1673,19 @@ def train_vae(files,
 
             if batch_i % save_step == 0:
                 # Save the variables to disk.
-                saver.save(sess, "models/" + 'vae_gt%d'%batch_i,
+                saver.save(sess, opts['vae_dir'] + 'vae_gt%d'%batch_i,
                            global_step=batch_i,
                            write_meta_graph=False)
+            prof.step(cost=train_cost)
     except tf.errors.OutOfRangeError:
         print('Done.')
     finally:
         # One of the threads has issued an exception.  So let's tell all the
         # threads to shutdown.
-        saver.save(sess, "models/" + 'vae_shit_gt',
+        saver.save(sess, opts['vae_dir'] + 'vae_shit_gt',
                            global_step=batch_i,
                            write_meta_graph=False)
+        prof.close()
         coord.request_stop()
 
     # Wait until all threads have finished.
@@ -1564,10 +1832,20 @@ def eval_local(files,
               activation=tf.nn.relu,
               img_step=1,
               save_step=5000,
-              ckpt_name="vae.ckpt"):
+              ckpt_name="vae.ckpt",
+              in_memory=False,
+              decode='topk',
+              decode_in_graph=False,
+              variant='base'):
     
     
-    batch = input_pipeline_local(['300w-gt-test.txt'], batch_size=batch_size, shape=[128, 128, 1], is_training=False)
+    if in_memory:
+        # decoded once and memory-mapped, no queue runners or per-file reads
+        data = LandmarkDataset.load('300w-gt-test.txt', shape=[128, 128, 1])
+        batches = data.batches(batch_size)
+        batch = None
+    else:
+        batch = input_pipeline_local(['300w-gt-test.txt'], batch_size=batch_size, shape=[128, 128, 1], is_training=False)
     ae = VAE(input_shape=[None] + crop_shape,
              convolutional=convolutional,
              variational=variational,
@@ -1576,7 +1854,9 @@ def eval_local(files,
              n_code=n_code,
              dropout=dropout,
              filter_sizes=filter_sizes,
-             activation=activation)
+             activation=activation,
+             batch=batch[:2] if not in_memory else None,
+             use_bn=VARIANTS[variant]['use_bn'])
 
     
     # opt_vars = [v for v in tf.trainable_variables() if v.name.startswith("align/")]
@@ -1587,6 +1867,10 @@ def eval_local(files,
     #     learning_rate=learning_rate).minimize(ae['cost'], var_list=opt_vars, global_step=batch_idx)
 
     avg_pred = ae['y']
+    # N x 68 x 2 locations decoded in the graph, so the 64 x 64 x 68 maps
+    # never have to be copied out of the session
+    fetch_pred = utils.heatmap_locations(ae['y'], mode=decode) \
+        if decode_in_graph else ae['y']
     gt_truth = ae['label']
     gt_truth = tf.reshape(gt_truth, (-1, 68, 2))
     # Calculate predictions.
@@ -1630,12 +1914,15 @@ def eval_local(files,
     try:
         while not coord.should_stop() and epoch_i < n_epochs:
             batch_i += 1
-            batch_xs, label_xs, locs = sess.run(batch)
-            #batch_xs = batch_xs
-            train_cost, landMaps = sess.run([ae['cost'], ae['y']], feed_dict={
-                ae['x']: batch_xs, ae['label']: label_xs, ae['train']: False,
-                ae['keep_prob']: keep_prob})[:2]
-            pred = utils.getLocation(landMaps)
+            if in_memory:
+                batch_xs, locs = next(batches)
+                train_cost, landMaps = sess.run([ae['cost'], fetch_pred], feed_dict={
+                    ae['x']: batch_xs, ae['label']: genBatchMaps(locs, [64, 64], 3),
+                    ae['train']: False, ae['keep_prob']: keep_prob})
+            else:
+                train_cost, landMaps, locs = sess.run([ae['cost'], fetch_pred, batch[2]], feed_dict={
+                    ae['train']: False, ae['keep_prob']: keep_prob})
+            pred = landMaps if decode_in_graph else utils.decode_heatmaps(landMaps, mode=decode)
             # Directly from map
              
             #flipped = np.asarray([utils.flip_img(batch_xs[0])])
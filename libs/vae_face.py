@@ -10,22 +10,16 @@ import os
 from libs.batch_norm import batch_norm
 from libs.tfpipeline import input_pipeline
 from libs import utils
+from libs import metrics
 from numpy.linalg import norm
 import h5py
 import matplotlib.pyplot as plt
 
 def evaluateError(landmarkGt, landmarkP):
-    e = np.zeros(5)
-    ocular_dist = norm(landmarkGt[1] - landmarkGt[0])
-    for i in range(5):
-        e[i] = norm(landmarkGt[i] - landmarkP[i])
-    e = e / ocular_dist
-    return e
+    return metrics.normalized_errors(landmarkGt, landmarkP)[0]
 
 def evaluateBatchError(landmarkGt, landmarkP, batch_size):
-    e = np.zeros([batch_size, 5])
-    for i in range(batch_size):
-        e[i] = evaluateError(landmarkGt[i], landmarkP[i])
+    e = metrics.normalized_errors(landmarkGt[:batch_size], landmarkP[:batch_size])
     mean_err = e.mean(axis=0)
     return mean_err
 
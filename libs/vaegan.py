@@ -9,6 +9,7 @@ import numpy as np
 import os
 from libs.dataset_utils import create_input_pipeline
 from libs.datasets import CELEB
+from libs.profiler import StepProfiler
 from libs.utils import *
 
 
@@ -447,7 +448,9 @@ def train_vaegan(files,
                  variational=True,
                  filter_sizes=[3, 3, 3, 3],
                  activation=tf.nn.elu,
-                 ckpt_name="vaegan.ckpt"):
+                 ckpt_name="vaegan.ckpt",
+                 profile_dir=None,
+                 trace_every=0):
     """Summary
 
     Parameters
@@ -484,6 +487,11 @@ def train_vaegan(files,
         Description
     ckpt_name : str, optional
         Description
+    profile_dir : str, optional
+        Write step-time reports, TensorBoard scalars and traces here, see
+        profiler.StepProfiler.
+    trace_every : int, optional
+        Write a Chrome trace every this many steps (needs profile_dir).
 
     Returns
     -------
@@ -533,6 +541,7 @@ def train_vaegan(files,
     saver = tf.train.Saver()
     sess.run(tf.initialize_all_variables())
     coord = tf.train.Coordinator()
+    prof = StepProfiler(sess, profile_dir, trace_every=trace_every)
     tf.get_default_graph().finalize()
     threads = tf.train.start_queue_runners(sess=sess, coord=coord)
 
@@ -558,16 +567,15 @@ def train_vaegan(files,
                 print('---------- EPOCH:', epoch_i)
 
             batch_i += 1
-            batch_xs = sess.run(batch) / 255.0
+            batch_xs = prof.run_batch(batch) / 255.0
             batch_zs = np.random.randn(batch_size, n_code).astype(np.float32)
-            real_cost, fake_cost, _ = sess.run([
+            real_cost, fake_cost, _ = prof.run([
                 ae['loss_real'], ae['loss_fake'], opt_enc],
                 feed_dict={
                     ae['x']: batch_xs,
                     ae['gamma']: 0.5})
             real_cost = -np.mean(real_cost)
             fake_cost = -np.mean(fake_cost)
-            print('real:', real_cost, '/ fake:', fake_cost)
 
             gen_update = True
             dis_update = True
@@ -585,12 +593,12 @@ def train_vaegan(files,
                 dis_update = True
 
             if gen_update:
-                sess.run(opt_gen, feed_dict={
+                prof.run(opt_gen, feed_dict={
                     ae['x']: batch_xs,
                     ae['z_samp']: batch_zs,
                     ae['gamma']: 0.5})
             if dis_update:
-                sess.run(opt_dis, feed_dict={
+                prof.run(opt_dis, feed_dict={
                     ae['x']: batch_xs,
                     ae['z_samp']: batch_zs,
                     ae['gamma']: 0.5})
@@ -622,11 +630,13 @@ def train_vaegan(files,
                                        global_step=batch_i,
                                        write_meta_graph=False)
                 print("Model saved in file: %s" % save_path)
+            prof.step(real=real_cost, fake=fake_cost)
     except tf.errors.OutOfRangeError:
         print('Done training -- epoch limit reached')
     finally:
         # One of the threads has issued an exception.  So let's tell all the
         # threads to shutdown.
+        prof.close()
         coord.request_stop()
 
     # Wait until all threads have finished.
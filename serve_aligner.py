@@ -0,0 +1,21 @@
+"""HTTP landmark service around a graph written by export_aligner.py.
+
+    python serve_aligner.py aligner.pb --port 8000 --max_batch 32
+    curl --data-binary @face.png http://127.0.0.1:8000/predict
+    curl http://127.0.0.1:8000/stats
+"""
+from libs.serving import serve
+import argparse
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser()
+    parser.add_argument('graph')
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--port', type=int, default=8000)
+    parser.add_argument('--max_batch', type=int, default=32)
+    parser.add_argument('--max_latency_ms', type=float, default=5.0)
+    parser.add_argument('--decode_threads', type=int, default=4)
+    args = parser.parse_args()
+    serve(args.graph, args.host, args.port, max_batch=args.max_batch,
+          max_latency=args.max_latency_ms / 1000.0,
+          decode_threads=args.decode_threads)
@@ -0,0 +1,44 @@
+"""Checkpoint rotation of libs.checkpoint.AsyncCheckpointer."""
+import os
+import pytest
+
+checkpoint = pytest.importorskip('libs.checkpoint')
+
+
+def _rotated(tmp_path, metrics, keep_last, keep_best, mode='min'):
+    """Write empty files for one checkpoint per metric, rotate after every
+    write as _write does, and return the steps left on disk."""
+    # only the rotation state, no sessions or writer thread
+    ckpt = object.__new__(checkpoint.AsyncCheckpointer)
+    ckpt.keep_last, ckpt.keep_best, ckpt.mode = keep_last, keep_best, mode
+    ckpt.saved = []
+    for step, metric in enumerate(metrics):
+        prefix = str(tmp_path / ('model-%d' % step))
+        for suffix in ('.index', '.data-00000-of-00001'):
+            open(prefix + suffix, 'w').close()
+        ckpt.saved.append((step, metric, prefix))
+        ckpt._rotate()
+    on_disk = sorted(int(f.split('-')[1].split('.')[0])
+                     for f in os.listdir(str(tmp_path)) if f.endswith('.index'))
+    assert on_disk == sorted(s for s, _, _ in ckpt.saved)
+    return on_disk
+
+
+def test_keep_last(tmp_path):
+    assert _rotated(tmp_path, [None] * 6, keep_last=2, keep_best=0) == [4, 5]
+
+
+def test_keep_best_min(tmp_path):
+    metrics = [0.5, 0.1, 0.4, 0.3, 0.9, 0.8]
+    assert _rotated(tmp_path, metrics, keep_last=2, keep_best=1) == [1, 4, 5]
+
+
+def test_keep_best_max(tmp_path):
+    metrics = [0.5, 0.1, 0.4, 0.3, 0.9, 0.8, 0.2]
+    assert _rotated(tmp_path, metrics, keep_last=1, keep_best=2,
+                    mode='max') == [4, 5, 6]
+
+
+def test_unscored_checkpoints_are_not_best(tmp_path):
+    metrics = [0.3, None, None, None]
+    assert _rotated(tmp_path, metrics, keep_last=1, keep_best=1) == [0, 3]
@@ -0,0 +1,57 @@
+"""Bit-packed landmark map cache (libs.heatmap_cache)."""
+import os
+import numpy as np
+import pytest
+
+heatmap_cache = pytest.importorskip('libs.heatmap_cache')
+from libs.tfpipeline import genBatchMaps
+
+
+def _write_list(path, landmarks):
+    with open(path, 'w') as f:
+        for i, points in enumerate(landmarks):
+            f.write('img%d.png %s\n' % (i, ' '.join('%f' % v for v in points)))
+            if i == 1:
+                # blank lines keep an empty row
+                f.write('\n')
+
+
+def test_build_lookup_round_trip(tmp_path):
+    landmarks = np.random.RandomState(0).uniform(
+        0.1, 0.9, size=(5, 136)).astype(np.float32)
+    txt = str(tmp_path / 'list.txt')
+    _write_list(txt, landmarks)
+    path = heatmap_cache.build_heatmap_cache(txt, shape=[64, 64], radius=3,
+                                             chunk_size=2)
+    cache = heatmap_cache.HeatmapCache([txt], shape=[64, 64])
+    assert cache.record_bytes == 64 * 64 * 9
+    assert os.path.getsize(path) == \
+        cache.header_bytes + 6 * cache.record_bytes
+
+    expected = genBatchMaps(landmarks, [64, 64], 3)
+    # TextLineReader keys count lines from 1, the blank line is line 3
+    lines = [1, 2, 4, 5, 6]
+    for line, maps in zip(lines, expected):
+        key = ('%s:%d' % (txt, line)).encode()
+        np.testing.assert_array_equal(cache.lookup(key), maps)
+    assert not cache.lookup(('%s:3' % txt).encode()).any()
+
+
+def test_stale_cache_is_rejected(tmp_path):
+    txt = str(tmp_path / 'list.txt')
+    _write_list(txt, np.full((2, 136), 0.5))
+    path = heatmap_cache.build_heatmap_cache(txt)
+    os.utime(txt, (os.path.getmtime(path) + 10,) * 2)
+    with pytest.raises(ValueError):
+        heatmap_cache.HeatmapCache([txt])
+
+
+def test_unpack_maps_matches_unpackbits():
+    tf = pytest.importorskip('tensorflow')
+    from libs.tfpipeline import unpack_maps
+    packed = np.random.RandomState(1).randint(
+        0, 256, size=(2, 4, 4, 9)).astype(np.uint8)
+    with tf.Graph().as_default(), tf.Session() as sess:
+        maps = sess.run(unpack_maps(tf.constant(packed), 68))
+    np.testing.assert_array_equal(
+        maps, np.unpackbits(packed, axis=-1)[..., :68])
@@ -0,0 +1,87 @@
+"""libs.metrics against plain-Python reference implementations."""
+import numpy as np
+
+from libs import metrics
+
+
+def _landmarks(n, k=68, seed=0):
+    rng = np.random.RandomState(seed)
+    gt = rng.uniform(0.2, 0.8, size=(n, k, 2))
+    pred = gt + rng.normal(scale=0.02, size=gt.shape)
+    return gt, pred
+
+
+def _nme_reference(gt, pred):
+    errors = []
+    for g, p in zip(gt, pred):
+        d = np.mean([np.linalg.norm(g[i] - g[j])
+                     for i, j in zip(range(36, 42), range(42, 48))])
+        errors.append(np.mean([np.linalg.norm(g[i] - p[i])
+                               for i in range(len(g))]) / d)
+    return np.asarray(errors)
+
+
+def test_nme_matches_reference():
+    gt, pred = _landmarks(5)
+    np.testing.assert_allclose(metrics.nme(gt, pred),
+                               _nme_reference(gt, pred))
+    # flat [N, 2K] is the same as [N, K, 2]
+    np.testing.assert_allclose(metrics.nme(gt.reshape((5, -1)),
+                                           pred.reshape((5, -1))),
+                               metrics.nme(gt, pred))
+
+
+def test_failure_rate():
+    errors = [0.01, 0.05, 0.08, 0.09, 0.2]
+    assert metrics.failure_rate(errors, 0.08) == 2 / 5.0
+    assert metrics.failure_rate(errors, 0.3) == 0.0
+
+
+def test_auc():
+    # no errors: the CED is 1 everywhere
+    assert np.isclose(metrics.auc(np.zeros(10)), 1.0)
+    # every error above the threshold: the CED is 0 everywhere
+    assert metrics.auc(np.ones(10)) == 0.0
+    # uniform errors on [0, 0.08]: the CED is the diagonal
+    errors = np.linspace(0, 0.08, 100001)
+    assert np.isclose(metrics.auc(errors, 0.08), 0.5, atol=1e-3)
+
+
+def _accumulate(errors, batch_sizes, **kwargs):
+    acc = metrics.ErrorAccumulator(metrics.SUBSETS_300W, **kwargs)
+    start = 0
+    for size in batch_sizes:
+        acc.update(errors[start:start + size])
+        start += size
+    return acc
+
+
+def test_error_accumulator_matches_list_reference():
+    errors = np.random.RandomState(1).uniform(0, 0.2, size=689)
+    # batches that straddle the subset boundaries
+    acc = _accumulate(errors, [100] * 6 + [89])
+    subsets = dict(metrics.SUBSETS_300W, all=slice(0, None))
+    for name, idxs in subsets.items():
+        ref = list(errors[idxs])
+        assert acc.count(name) == len(ref)
+        assert np.isclose(acc.mean(name), sum(ref) / len(ref))
+        for t in (0.05, 0.08):
+            below = len([e for e in ref if e <= t]) / float(len(ref))
+            assert np.isclose(acc.ced([t], name)[0], below)
+            assert np.isclose(acc.failure_rate(t, name), 1 - below)
+        assert np.isclose(acc.auc(0.08, name), metrics.auc(ref, 0.08),
+                          atol=1e-3)
+
+
+def test_error_accumulator_merge():
+    errors = np.random.RandomState(2).uniform(0, 0.2, size=689)
+    whole = _accumulate(errors, [689])
+    first = metrics.ErrorAccumulator(metrics.SUBSETS_300W)
+    second = metrics.ErrorAccumulator(metrics.SUBSETS_300W)
+    first.update(errors[:300], start=0)
+    second.update(errors[300:], start=300)
+    merged = first.merge(second)
+    assert merged.n_seen == whole.n_seen
+    for name in whole.subsets:
+        np.testing.assert_array_equal(merged.hist[name], whole.hist[name])
+        assert np.isclose(merged.sum[name], whole.sum[name])
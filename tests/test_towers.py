@@ -0,0 +1,56 @@
+"""Graph construction of VAE_ALIGN1 data-parallel towers (libs.towers)."""
+import pytest
+
+tf = pytest.importorskip('tensorflow')
+
+from libs.vae import VAE_ALIGN1
+from libs.towers import build_towers
+from libs.towers import minimize_towers
+from libs.towers import checkpoint_variables
+
+
+def _model(shard):
+    return VAE_ALIGN1(input_shape=[None, 128, 128, 1],
+                      convolutional=True,
+                      variational=True,
+                      n_filters=[8, 8, 8],
+                      n_hidden=16,
+                      n_code=8,
+                      dropout=True,
+                      filter_sizes=[3, 3, 3],
+                      activation=tf.nn.relu,
+                      batch=shard)
+
+
+def _batch(batch_size):
+    return [tf.zeros([batch_size, 128, 128, 1]), tf.zeros([batch_size, 136])]
+
+
+@pytest.mark.parametrize('n_towers', [1, 2, 3])
+def test_towers_share_variables(n_towers):
+    with tf.Graph().as_default():
+        towers = build_towers(_model, _batch(2 * n_towers), n_towers)
+        single = tf.trainable_variables()
+        train_op, cost = minimize_towers(tf.train.AdamOptimizer(1e-3),
+                                         towers)
+
+        assert len(towers) == n_towers
+        # one set of weights, whatever the number of towers
+        assert all('tower_' not in v.op.name for v in single)
+        assert towers[-1]['Ws'][0] is towers[0]['Ws'][0]
+        # the other towers' moving averages stay out of checkpoints
+        averages = [v for v in tf.global_variables()
+                    if v.op.name.endswith('ExponentialMovingAverage')]
+        private = [v for v in averages if 'tower_' in v.op.name]
+        assert len(private) == (n_towers - 1) * (len(averages) // n_towers)
+        assert not set(private) & set(checkpoint_variables())
+
+
+def test_towers_checkpoint_names_match_single_model():
+    with tf.Graph().as_default():
+        _model(_batch(2))
+        names = sorted(v.op.name for v in tf.global_variables())
+    with tf.Graph().as_default():
+        build_towers(_model, _batch(4), 2)
+        tower_names = sorted(v.op.name for v in checkpoint_variables())
+    assert tower_names == names
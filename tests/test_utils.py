@@ -0,0 +1,65 @@
+"""NumPy helpers of libs.utils."""
+import numpy as np
+import pytest
+
+utils = pytest.importorskip('libs.utils')
+
+
+def _gaussian_maps(locations, shape=(32, 32), sigma=1.5):
+    """N x H x W x K maps peaking at N x K x 2 (x, y) pixel locations."""
+    ys, xs = np.mgrid[:shape[0], :shape[1]]
+    x = locations[:, None, None, :, 0]
+    y = locations[:, None, None, :, 1]
+    return np.exp(-((xs[..., None] - x) ** 2 + (ys[..., None] - y) ** 2) /
+                  (2 * sigma ** 2))
+
+
+def test_decode_heatmaps_topk_block():
+    maps = np.zeros((1, 16, 16, 2))
+    maps[0, 4:6, 10:12, 0] = 1
+    maps[0, 8:10, 2:4, 1] = 1
+    locations = utils.decode_heatmaps(maps, mode='topk', k=4)
+    np.testing.assert_allclose(locations[0], [[10.5 / 16, 4.5 / 16],
+                                              [2.5 / 16, 8.5 / 16]])
+
+
+LOCATIONS = np.array([[[10.3, 20.6], [15.0, 5.0], [25.7, 12.2]]])
+
+
+def test_decode_heatmaps_softargmax():
+    # softmax(beta * log(gaussian) / beta) is the gaussian itself, whose
+    # mean is the peak
+    maps = np.log(_gaussian_maps(LOCATIONS)) / 100.0
+    decoded = utils.decode_heatmaps(maps, mode='softargmax', beta=100.0)
+    np.testing.assert_allclose(decoded * 32, LOCATIONS, atol=1e-3)
+
+
+def test_decode_heatmaps_quadratic():
+    decoded = utils.decode_heatmaps(_gaussian_maps(LOCATIONS),
+                                    mode='quadratic')
+    np.testing.assert_allclose(decoded * 32, LOCATIONS, atol=0.15)
+    # better than the pixel the argmax falls on
+    assert (np.abs(decoded * 32 - LOCATIONS) <
+            np.abs(np.round(LOCATIONS) - LOCATIONS) + 1e-9).all()
+
+
+def test_decode_heatmaps_unknown_mode():
+    with pytest.raises(ValueError):
+        utils.decode_heatmaps(np.zeros((1, 4, 4, 1)), mode='argmin')
+
+
+@pytest.mark.parametrize('n_landmarks', [68, 106])
+def test_flip_permutation_is_an_involution(n_landmarks):
+    perm = utils.FLIP_PERMUTATIONS[n_landmarks]
+    assert sorted(perm) == list(range(n_landmarks))
+    np.testing.assert_array_equal(perm[perm], np.arange(n_landmarks))
+
+
+def test_flip_landmarks_twice_is_identity():
+    landmarks = np.random.RandomState(0).uniform(size=(3, 68, 2))
+    np.testing.assert_allclose(
+        utils.flip_landmarks(utils.flip_landmarks(landmarks)), landmarks)
+    # the outer eye corners swap places
+    flipped = utils.flip_landmarks(landmarks)
+    np.testing.assert_allclose(flipped[:, 36], [1, 0] + [-1, 1] *
+                               landmarks[:, 45])
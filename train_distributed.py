@@ -0,0 +1,115 @@
+"""Parameter server training of the VAE / VAEGAN, see libs.distributed.
+
+One task per process, e.g. on two hosts:
+
+    python train_distributed.py --job ps --task 0 \
+        --ps host0:2222 --workers_hosts host0:2223,host1:2222
+    python train_distributed.py --job worker --task 0 ...
+    python train_distributed.py --job worker --task 1 ...
+
+or every task on localhost, once per worker count, printing the aggregate
+throughput:
+
+    python train_distributed.py --local --model vae --workers 1,2,4 --sync
+"""
+import glob
+import argparse
+import multiprocessing
+import tensorflow as tf
+from libs.distributed import local_cluster
+from libs.distributed import run_ps
+from libs.distributed import run_worker
+
+
+def model_kwargs(args):
+    if args.model == 'vae':
+        kwargs = {'txt': args.txt}
+    else:
+        kwargs = {'files': sorted(glob.glob(args.files))}
+    if args.batch_size:
+        kwargs['batch_size'] = args.batch_size
+    return kwargs
+
+
+def worker_kwargs(args):
+    return dict(model=args.model, sync=args.sync, n_steps=args.steps,
+                warmup=args.warmup, checkpoint_dir=args.checkpoint_dir,
+                **model_kwargs(args))
+
+
+def run_local(args, n_workers, port):
+    ctx = multiprocessing.get_context('spawn')
+    cluster = local_cluster(args.n_ps, n_workers, port)
+    results = ctx.Queue()
+    ps = [ctx.Process(target=run_ps, args=(cluster.as_dict(), i))
+          for i in range(args.n_ps)]
+    workers = [ctx.Process(target=_worker,
+                           args=(cluster.as_dict(), i, results,
+                                 worker_kwargs(args)))
+               for i in range(n_workers)]
+    for p in ps + workers:
+        p.start()
+    rows = [results.get() for _ in workers]
+    for p in workers:
+        p.join()
+    for p in ps:
+        p.terminate()
+        p.join()
+    return rows
+
+
+def _worker(cluster, task_index, results, kwargs):
+    run_worker(tf.train.ClusterSpec(cluster), task_index,
+               report=results.put, **kwargs)
+
+
+def main(args):
+    if not args.local:
+        cluster = tf.train.ClusterSpec({
+            'ps': args.ps.split(','), 'worker': args.workers_hosts.split(',')})
+        if args.job == 'ps':
+            run_ps(cluster, args.task)
+        else:
+            run_worker(cluster, args.task, **worker_kwargs(args))
+        return
+
+    table = []
+    for run_i, n_workers in enumerate(int(n) for n in args.workers.split(',')):
+        # fresh ports, the previous run's may still be in TIME_WAIT
+        rows = run_local(args, n_workers, args.port + 100 * run_i)
+        table.append((n_workers, sum(r['examples_per_sec'] for r in rows)))
+    base = table[0][1] / table[0][0]
+    print('%8s %16s %20s %10s' % ('workers', 'examples/sec',
+                                  'examples/sec/worker', 'efficiency'))
+    for n_workers, rate in table:
+        print('%8d %16.1f %20.1f %9.0f%%' % (
+            n_workers, rate, rate / n_workers,
+            100.0 * rate / (n_workers * base)))
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--model', default='vae', choices=['vae', 'vaegan'])
+    parser.add_argument('--sync', action='store_true',
+                        help='aggregate gradients with SyncReplicasOptimizer')
+    parser.add_argument('--steps', type=int, default=1000,
+                        help='last global step')
+    parser.add_argument('--warmup', type=int, default=10)
+    parser.add_argument('--batch_size', type=int, default=None)
+    parser.add_argument('--checkpoint_dir', default=None)
+    parser.add_argument('--txt', default='300w-gt-aug.txt',
+                        help='300-W list for --model vae')
+    parser.add_argument('--files', default='img_align_celeba/*.png',
+                        help='image glob for --model vaegan')
+    # one task
+    parser.add_argument('--job', choices=['ps', 'worker'])
+    parser.add_argument('--task', type=int, default=0)
+    parser.add_argument('--ps', default='localhost:2222')
+    parser.add_argument('--workers_hosts', default='localhost:2223')
+    # every task on localhost
+    parser.add_argument('--local', action='store_true')
+    parser.add_argument('--n_ps', type=int, default=1)
+    parser.add_argument('--workers', default='1,2,4',
+                        help='comma separated worker counts for --local')
+    parser.add_argument('--port', type=int, default=2222)
+    main(parser.parse_args())